@@ -10,25 +10,81 @@ Biopython sequences tools
 import pandas as pd
 from pandas import isnull
 import numpy as np
-from collections import Counter
+from collections import Counter, deque, defaultdict
+from collections.abc import Mapping
 import re
+import textwrap
 import os.path
 from pathlib import Path
 import gzip
+import shutil
 from Bio.Data import CodonTable
 from Bio.SeqFeature import SeqFeature, FeatureLocation, ExactPosition
 from Bio.Data.CodonTable import TranslationError
 from Bio.Seq import Seq
-import numbers
-import textwrap
+from Bio.SeqRecord import SeqRecord
+from Bio import SeqIO
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import json
+import mmap
+import hashlib
 
 from .pandas import sort_df
+from .general import open_by_suffix, executor_map_bounded, sliding_window_array
 
 
 
 codonTableBioMPN = CodonTable.unambiguous_dna_by_name['Mycoplasma']
 
 
+@contextmanager
+def _open_text_output(filepath):
+    """Open a file path for writing text (gzip compressed if the suffix is .gz), or pass through an open file handle."""
+    if hasattr(filepath, 'write'):
+        yield filepath
+    elif Path(str(filepath)).suffix == '.gz':
+        with gzip.open(str(filepath), 'wt') as f:
+            yield f
+    else:
+        with open(str(filepath), 'w') as f:
+            yield f
+
+
+_textwrapBreakRegex = re.compile(r'[\s-]')
+
+
+def _wrap_sequence(seq, lineWidth=70):
+    """
+    Wrap a sequence in lines of fixed width by slicing. Sequences containing whitespace or hyphens (e.g.
+    alignments) are wrapped with `textwrap.fill`, which breaks lines at these characters.
+    """
+    if _textwrapBreakRegex.search(seq):
+        return textwrap.fill(seq, lineWidth)
+    return "\n".join([seq[i:i + lineWidth] for i in range(0, len(seq), lineWidth)])
+
+
+def _build_fasta_records(df, seqCol, idColList=None, wrap_sequence=True, lineWidth=70):
+    """Build the list of fasta records of a dataframe, building the identifiers column-wise."""
+    if idColList is not None:
+        idS = None
+        for idCol in idColList:
+            colS = df[idCol]
+            colS = colS.astype(object).where(colS.notnull(), '').map(str)
+            idS = colS if idS is None else idS + '|' + colS
+        idList = idS.tolist()
+    else:
+        # By default, use row index as id
+        idList = [str(idx) for idx in df.index]
+
+    seqList = [str(seq) for seq in df[seqCol]]
+    if wrap_sequence:
+        seqList = [_wrap_sequence(seq, lineWidth) for seq in seqList]
+    return ['>' + fastaId + '\n' + seq for fastaId, seq in zip(idList, seqList)]
+
+
 def convert_df_to_fasta(df, seqCol, idColList=None, filepath=None, wrap_sequence=True,
                         verbose=0):
     """
@@ -41,6 +97,9 @@ def convert_df_to_fasta(df, seqCol, idColList=None, filepath=None, wrap_sequence
 
     Note that for building a local blast database, the required formatting for `makeblastdb`
     is `>lcl|integer_or_string`
+
+    For large dataframes, use `write_df_to_fasta` which streams the records to the file
+    without building the whole fasta string in memory.
     """
 
     if len(df) == 0:
@@ -52,41 +111,45 @@ def convert_df_to_fasta(df, seqCol, idColList=None, filepath=None, wrap_sequence
     else:
         df2 = df
 
-    indexName = df2.index.name
-    # df2 = df2.reset_index()
-    
-    def convert_record_to_fasta(row):
-
-        if idColList is not None:
-            idList = row[idColList].tolist()
-            idList = [str(idj) if not pd.isnull(idj) else '' for idj in idList]
-        else:
-            # By default, use row index as id
-            idList = [row.name]
-
-        idList = [str(id1) for id1 in idList]
-        fastaString = '>' + "|".join(idList) + '\n'
-        seqString = row[seqCol]
-        if wrap_sequence:
-            seqString = textwrap.fill(seqString, 70)
-        fastaString += seqString
-        return fastaString
-
-    seqList = df2.apply(convert_record_to_fasta, axis=1).tolist()
-    fastaString = "\n".join(seqList)
+    fastaString = "\n".join(_build_fasta_records(df2, seqCol, idColList=idColList, wrap_sequence=wrap_sequence))
 
     if filepath is not None:
-        with open(str(filepath), 'w') as f:
+        with _open_text_output(filepath) as f:
             f.write(fastaString)
     
     return fastaString
 
 
+def write_df_to_fasta(df, seqCol, filepath, idColList=None, wrap_sequence=True, lineWidth=70,
+                      chunkSize=100000, verbose=0):
+    """
+    Write a dataframe to a fasta file, streaming the records by chunks of rows.
+
+    Same formatting as `convert_df_to_fasta`, but only one chunk of records is held in memory
+    at a time. `filepath` can be a path (gzip compressed if the suffix is .gz) or an open text
+    file handle. Every record ends with a newline.
+
+    Returns the number of records written.
+    """
+
+    if type(df) is pd.Series:
+        df = df.to_frame().T
+
+    with _open_text_output(filepath) as f:
+        for i in range(0, len(df), chunkSize):
+            recordList = _build_fasta_records(df.iloc[i:i + chunkSize], seqCol, idColList=idColList,
+                                              wrap_sequence=wrap_sequence, lineWidth=lineWidth)
+            f.write("\n".join(recordList) + "\n")
+            if verbose >= 1: print("Written records:", min(i + chunkSize, len(df)), "/", len(df))
+
+    return len(df)
+
+
 def pretty_print_mRNA(genomeBioSeq, TSS, TTS, CDS_start, CDS_stop, strand):
     """
     Pretty print a DNA sequence (corresponding to a mRNA transcript) by highlighting start and stop codons.
     
-    genomeBioSeq: DNA sequence of type Bio.Seq object
+    genomeBioSeq: DNA sequence of type Bio.SeqRecord object, or `PackedSequence`
     TSS, TTS, CDS_start, CDS_stop: all position are 0-based start-inclusive end-exclusive index
     
     More information on how to use HTML and CSS styles in jupyter output:
@@ -100,6 +163,8 @@ def pretty_print_mRNA(genomeBioSeq, TSS, TTS, CDS_start, CDS_stop, strand):
     pretty_print_mRNA(seq, len(seq), 1, len(seq)+1-7, 20, "-")
     """
     
+    if isinstance(genomeBioSeq, PackedSequence):
+        genomeBioSeq = SeqRecord(Seq(str(genomeBioSeq)))
     genomeSeq = 0
     if strand == '+':
         genomeSeq = str(genomeBioSeq.seq)
@@ -234,6 +299,86 @@ def convert_index_1b_inc_inc_to_0b_inc_inc(row):
         return {'start':None, 'end':None, 'strand':strand}
 
 
+def _convert_strand_numeric_to_strand_string_series(strandS):
+    """Vectorized version of `convert_strand_numeric_to_strand_string` for a pandas Series."""
+    strandS = strandS.map({+1:'+', -1:'-', '+':'+', '-':'-'})
+    return strandS.astype(object).where(strandS.notnull(), None)
+
+
+def _get_coordinate_arrays(df, startCol, endCol):
+    """Return the start and end columns as int64 arrays, and the mask of rows with a missing coordinate."""
+    startS = pd.to_numeric(df[startCol])
+    endS = pd.to_numeric(df[endCol])
+    isMissing = (startS.isnull() | endS.isnull()).values
+    start = startS.fillna(0).values.astype(np.int64)
+    end = endS.fillna(0).values.astype(np.int64)
+    return start, end, isMissing
+
+
+def convert_index_1b_inc_inc_to_0b_inc_exc_df(df, strandCol='strand', startCol='start', endCol='end',
+                                              detect_strand=False):
+    """
+    Dataframe version of `convert_index_1b_inc_inc_to_0b_inc_exc`, converting whole columns at once.
+    From: 1-based index inclusive-inclusive oriented (start > end on minus strand) [wetlab index]
+    To:   0-based index inclusive-exclusive ordered (start < end always) [Biopython index]
+
+    Returns a copy of the dataframe, with start and end as nullable integer columns (missing
+    coordinates are kept as <NA>).
+    """
+    start, end, isMissing = _get_coordinate_arrays(df, startCol, endCol)
+    isOrdered = start <= end
+    left = np.where(isOrdered, start - 1, end - 1)
+    right = np.where(isOrdered, end, start)
+
+    df = df.copy()
+    if detect_strand:
+        strand = np.where(isOrdered, '+', '-').astype(object)
+        strand[isMissing] = None
+        df[strandCol] = strand
+    else:
+        df[strandCol] = _convert_strand_numeric_to_strand_string_series(df[strandCol])
+    df[startCol] = pd.arrays.IntegerArray(left, isMissing)
+    df[endCol] = pd.arrays.IntegerArray(right, isMissing)
+    return df
+
+
+def convert_index_0b_inc_exc_to_1b_inc_inc_df(df, strandCol='strand', startCol='start', endCol='end'):
+    """
+    Dataframe version of `convert_index_0b_inc_exc_to_1b_inc_inc`, converting whole columns at once.
+    From: 0-based index inclusive-exclusive ordered (start < end always) [Biopython index]
+    To:   1-based index inclusive-inclusive oriented (start < end always) [GFF3 index]
+
+    Returns a copy of the dataframe, with start and end as nullable integer columns (missing
+    coordinates are kept as <NA>).
+    """
+    start, end, isMissing = _get_coordinate_arrays(df, startCol, endCol)
+    if np.any(~isMissing & (start >= end)):
+        raise ValueError("start > end in 0-based inclusive-exclusive index.")
+
+    df = df.copy()
+    df[startCol] = pd.arrays.IntegerArray(start + 1, isMissing)
+    df[endCol] = pd.arrays.IntegerArray(end, isMissing)
+    return df
+
+
+def convert_index_1b_inc_inc_to_0b_inc_inc_df(df, strandCol='strand', startCol='start', endCol='end'):
+    """
+    Dataframe version of `convert_index_1b_inc_inc_to_0b_inc_inc`, converting whole columns at once.
+    From: 1-based index inclusive-inclusive oriented (start > end on minus strand) [wetlab index]
+    To:   0-based index inclusive-inclusive ordered (start < end always)
+
+    Returns a copy of the dataframe, with start and end as nullable integer columns (missing
+    coordinates are kept as <NA>).
+    """
+    start, end, isMissing = _get_coordinate_arrays(df, startCol, endCol)
+    isOrdered = start <= end
+
+    df = df.copy()
+    df[startCol] = pd.arrays.IntegerArray(np.where(isOrdered, start, end) - 1, isMissing)
+    df[endCol] = pd.arrays.IntegerArray(np.where(isOrdered, end, start) - 1, isMissing)
+    return df
+
+
 def convert_codon_pos_to_genome_pos(codonPos, CDS, strand=None):
     if strand is None:
         strand = CDS['strand']
@@ -277,6 +422,90 @@ def get_context_window(codonPos, CDS, windowContextUp, windowContextDown):
             }
 
 
+def convert_codon_pos_to_genome_pos_array(codonPos, start, end, strand):
+    """
+    Vectorized version of `convert_codon_pos_to_genome_pos`, for arrays of codon positions and of CDS
+    start, end and strand ('+' or '-').
+    """
+    codonPos = np.asarray(codonPos, dtype=np.int64)
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    strand = np.asarray(strand)
+    if not np.isin(strand, ['+', '-']).all():
+        raise ValueError("Strand must be '+' or '-'.")
+    return np.where(strand == '+', start + 3*codonPos, end - 3*codonPos)
+
+
+def get_context_window_batch(codonPos, CDSDf, windowContextUp, windowContextDown, CDSIndex=None,
+                             startCol='start', endCol='end', strandCol='strand', proteinSeqCol='protein_seq',
+                             asCharMatrix=False):
+    """
+    Vectorized version of `get_context_window`, for many codon positions at once.
+
+    codonPos: array of codon positions in the CDS.
+    CDSDf: dataframe of CDS with start, end, strand and protein_seq columns. Either its rows are aligned
+    with codonPos, or CDSIndex gives for each codon position the (positional) row of its CDS.
+    asCharMatrix: instead of the context strings, return as second output a fixed-width uint8 character
+    matrix of shape (len(codonPos), windowContextUp + windowContextDown), in which the codon is at column
+    windowContextUp and positions outside of the protein are padded with '-'.
+
+    Returns a dataframe with the same columns as `get_context_window` (without context_window_protein_seq
+    if asCharMatrix is True), with one row per codon position.
+    """
+    codonPos = np.asarray(codonPos, dtype=np.int64)
+    if CDSIndex is None:
+        if len(CDSDf) != len(codonPos):
+            raise ValueError("CDSDf must be aligned with codonPos when CDSIndex is not given.")
+        CDSIndex = np.arange(len(codonPos))
+    else:
+        CDSIndex = np.asarray(CDSIndex, dtype=np.int64)
+
+    # The protein sequences of all CDS are concatenated in one buffer
+    proteinSeqList = [seq if isinstance(seq, str) else '' for seq in CDSDf[proteinSeqCol]]
+    proteinLength = np.array([len(seq) for seq in proteinSeqList], dtype=np.int64)
+    proteinOffset = np.concatenate([[0], np.cumsum(proteinLength)[:-1]]).astype(np.int64)
+    length = proteinLength[CDSIndex]
+    offset = proteinOffset[CDSIndex]
+
+    contextCodonUp = np.maximum(0, codonPos - windowContextUp)
+    contextCodonDown = np.minimum(length, codonPos + windowContextDown)
+    posCodonInContext = np.minimum(codonPos, windowContextUp)
+
+    start = CDSDf[startCol].to_numpy()[CDSIndex]
+    end = CDSDf[endCol].to_numpy()[CDSIndex]
+    strand = CDSDf[strandCol].to_numpy()[CDSIndex]
+    contextPosInGenomeUp = convert_codon_pos_to_genome_pos_array(contextCodonUp, start, end, strand)
+    contextPosInGenomeDown = convert_codon_pos_to_genome_pos_array(contextCodonDown, start, end, strand)
+    isPlus = strand == '+'
+
+    contextDf = pd.DataFrame({'codon_pos_in_context':posCodonInContext,
+                              'context_window_codon_pos_up':contextCodonUp,
+                              'context_window_codon_pos_down':contextCodonDown,
+                              'context_window_genome_pos_start':np.where(isPlus, contextPosInGenomeUp,
+                                                                         contextPosInGenomeDown),
+                              'context_window_genome_pos_end':np.where(isPlus, contextPosInGenomeDown,
+                                                                       contextPosInGenomeUp)})
+
+    if asCharMatrix:
+        proteinBuffer = np.frombuffer(''.join(proteinSeqList).encode('ascii'), dtype=np.uint8)
+        posMatrix = codonPos[:, None] + np.arange(-windowContextUp, windowContextDown)[None, :]
+        isInside = (posMatrix >= 0) & (posMatrix < length[:, None])
+        charMatrix = np.full(posMatrix.shape, ord('-'), dtype=np.uint8)
+        charMatrix[isInside] = proteinBuffer[(offset[:, None] + posMatrix)[isInside]]
+        return contextDf, charMatrix
+
+    proteinString = ''.join(proteinSeqList)
+    contextDf.insert(0, 'context_window_protein_seq',
+                     [proteinString[o + a:o + max(a, b)] for o, a, b in zip(offset, contextCodonUp, contextCodonDown)])
+    return contextDf
+
+
+def _motif_context(seq, start, end, nUp, nDown):
+    """Subsequence around a match, padded left and right with '-' characters."""
+    return '-'*max(nUp - start, 0) + seq[max(start - nUp, 0):min(end + nDown, len(seq))] + \
+        '-'*max(nDown - len(seq) + end, 0)
+
+
 def find_motif_context_in_sequence(seq, motif, nUp, nDown, onlyFirstMatch=False):
     """
     Returns the subsequence around a motif in a sequence. Pads left and right with
@@ -306,17 +535,144 @@ def find_motif_context_in_sequence(seq, motif, nUp, nDown, onlyFirstMatch=False)
             # Find the end index of the keyword
             end = match.span()[1]
 
-            alignedString = "".join(['-' for _ in range(max(nUp - start, 0))] +
-                                    [seq[max(start - nUp, 0):min(end + nDown, len(seq))]] +
-                                    ['-' for _ in range(max(nDown - len(seq) + end, 0))]
-                                    )
-            stringList.append(alignedString)
+            stringList.append(_motif_context(seq, start, end, nUp, nDown))
             if onlyFirstMatch:
                 break
         
     return stringList
 
 
+class _AhoCorasick(object):
+    """Aho-Corasick automaton, finding all occurrences of a set of literal patterns in a single pass over a text."""
+
+    def __init__(self, patternList):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for iPattern, pattern in enumerate(patternList):
+            node = 0
+            for c in pattern:
+                child = self.goto[node].get(c)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][c] = child
+                node = child
+            self.output[node].append(iPattern)
+
+        # Failure links, by breadth-first traversal of the trie
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f != 0 and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(c, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text):
+        """Yield (end position, pattern number) of all occurrences, possibly overlapping, ordered by end position."""
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for i, c in enumerate(text):
+            while node != 0 and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for iPattern in output[node]:
+                yield i + 1, iPattern
+
+
+_motifWorkerState = {}
+
+
+def _init_motif_worker(motifList, nUp, nDown, onlyFirstMatch):
+    """Compile the motifs once per process."""
+    literalMotifList = [motif for motif in motifList if re.escape(motif) == motif]
+    _motifWorkerState['literalMotifList'] = literalMotifList
+    _motifWorkerState['automaton'] = _AhoCorasick(literalMotifList)
+    _motifWorkerState['regexMotifList'] = [(motif, re.compile(motif)) for motif in motifList
+                                           if re.escape(motif) != motif]
+    _motifWorkerState['motifOrder'] = {motif:i for i, motif in enumerate(motifList)}
+    _motifWorkerState['nUp'] = nUp
+    _motifWorkerState['nDown'] = nDown
+    _motifWorkerState['onlyFirstMatch'] = onlyFirstMatch
+
+
+def _find_motif_context_worker(seqItemList):
+    state = _motifWorkerState
+    literalMotifList, automaton = state['literalMotifList'], state['automaton']
+    nUp, nDown, onlyFirstMatch = state['nUp'], state['nDown'], state['onlyFirstMatch']
+
+    rowList = []
+    for seqId, seq in seqItemList:
+        matchList = []
+        # Literal motifs: all occurrences are found in one pass, then we keep the non-overlapping
+        # occurrences of each motif from left to right, as re.finditer does.
+        lastEndDict = {}
+        for end, iMotif in automaton.iter_matches(seq):
+            motif = literalMotifList[iMotif]
+            start = end - len(motif)
+            lastEnd = lastEndDict.get(motif)
+            if lastEnd is None or (start >= lastEnd and not onlyFirstMatch):
+                lastEndDict[motif] = end
+                matchList.append((motif, start, end))
+        # Regular expression motifs
+        for motif, motifRegex in state['regexMotifList']:
+            for match in motifRegex.finditer(seq):
+                matchList.append((motif, match.start(), match.end()))
+                if onlyFirstMatch:
+                    break
+
+        matchList.sort(key=lambda m: (state['motifOrder'][m[0]], m[1]))
+        rowList.extend([(seqId, motif, start, _motif_context(seq, start, end, nUp, nDown))
+                        for motif, start, end in matchList])
+    return rowList
+
+
+def find_motif_context_batch(seqS, motifList, nUp, nDown, onlyFirstMatch=False, nJobs=1, chunkSize=1000):
+    """
+    Batch version of `find_motif_context_in_sequence`, searching many motifs in many sequences.
+
+    All literal motifs are compiled into one Aho-Corasick automaton, such that each sequence is scanned
+    once for all of them. Motifs containing regular expression syntax are searched separately with `re`.
+    As with `re.finditer`, the matches of a motif in a sequence do not overlap.
+
+    seqS: pandas Series of sequences (or list), whose index is used as sequence id.
+    nJobs: if > 1, chunks of `chunkSize` sequences are processed in a pool of processes, each compiling
+    the motifs once.
+
+    Returns a dataframe with columns sequence_id, motif, position (0-based start of the match) and
+    context (subsequence around the match, padded with '-' characters), ordered by sequence, motif
+    and position.
+    """
+    if type(seqS) is not pd.Series:
+        seqS = pd.Series(seqS)
+    motifList = list(dict.fromkeys(motifList))
+    if '' in motifList:
+        raise ValueError("Empty motif.")
+
+    seqItemList = list(seqS.items())
+    chunkList = [seqItemList[i:i + chunkSize] for i in range(0, len(seqItemList), chunkSize)]
+    initArgs = (motifList, nUp, nDown, onlyFirstMatch)
+    if nJobs == 1:
+        # The worker state is cleared afterwards, such that the automaton is not kept alive in this process
+        _init_motif_worker(*initArgs)
+        try:
+            rowListList = [_find_motif_context_worker(chunk) for chunk in chunkList]
+        finally:
+            _motifWorkerState.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=nJobs, initializer=_init_motif_worker, initargs=initArgs) as executor:
+            rowListList = list(executor.map(_find_motif_context_worker, chunkList))
+
+    return pd.DataFrame([row for rowList in rowListList for row in rowList],
+                        columns=['sequence_id', 'motif', 'position', 'context'])
+
+
 def convert_location_bio_to_dict(feature, verbose=1):
     """Extracts start, end and strand from Biopython feature, only if it has an exact position,
     in 0-based start-inclusive end-exclusive counting with start <= end.
@@ -339,54 +695,66 @@ def convert_location_bio_to_dict(feature, verbose=1):
         return None
 
 
+_complementTable = str.maketrans('ACGTUMRWSYKVHDBNacgtumrwsykvhdbn', 'TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn')
+
+
+def reverse_complement_string(seq):
+    """Reverse complement a DNA sequence string (IUPAC ambiguity codes are complemented)."""
+    return seq.translate(_complementTable)[::-1]
+
+
+def _extract_location_seq(genomeSeq, location):
+    """
+    Extract the sequence of a Biopython location (simple or compound) by slicing the genome sequence string,
+    following the same rules as `SeqFeature.extract`.
+    """
+    seqList = []
+    for part in location.parts:
+        seq = genomeSeq[int(part.start):int(part.end)]
+        if part.strand == -1:
+            seq = reverse_complement_string(seq)
+        seqList.append(seq)
+    return "".join(seqList)
+
+
+_annotationDfColumnList = ['chromosome', 'id', 'feature', 'strand', 'start', 'end', 'locus_tag', 'gene', 'protein_id']
+
+
 def convert_genbank_to_annotation_df(genomeBio, extractDNASeq=False, extractProteinSeq=False,
                                      substituteSpaces=True, verbose=1):
     
     species_name = genomeBio.annotations.get('organism')
     species_name = species_name if species_name is not None else ''
+    genomeId = genomeBio.id
     if substituteSpaces:
-        genomeId = re.sub(r' ', r'_', genomeBio.id)
-    
-    def get_proteinGI(feature):
-        proteinGI = feature.qualifiers.get('db_xref')
-        proteinGI = int(re.sub(r'GI:', '', proteinGI[0])) if proteinGI is not None else None
-        return proteinGI
+        genomeId = re.sub(r' ', r'_', genomeId)
     
     def get_attribute(feature, attName):
-        if attName == 'proteinGI':
-            att = get_proteinGI(feature)
-        else:
-            att = feature.qualifiers.get(attName)
-            att = att[0] if att is not None else None
+        att = feature.qualifiers.get(attName)
+        att = att[0] if att is not None else None
         return att
-      
-#     def get_attribute_dict(feature):
-#         # Extract the first value of each qualifier
-#         return {q:v[0] for q, v in feature.qualifiers.items()}
 
-    def get_attribute_dict(feature):
-        return {att:get_attribute(feature, att) for att in feature.qualifiers.keys()}
-    
-    hasWellDefinedGenomeSeq = \
-        not (
-            (genomeBio.seq.count('N') / len(genomeBio.seq)) > 0.5 or
-            genomeBio.seq == ''
-        )
+    # The genome sequence is converted once to a string, and feature sequences are extracted by slicing.
+    if extractDNASeq:
+        genomeSeq = str(genomeBio.seq)
+        hasWellDefinedGenomeSeq = not (genomeSeq == '' or (genomeSeq.count('N') / len(genomeSeq)) > 0.5)
+    else:
+        genomeSeq = None
+        hasWellDefinedGenomeSeq = False
 
     geneIdentifierPriorityList = ['locus_tag', 'gene', 'label', 'protein_id']
     
     CDSList = []
+    translationTaskList = []
     if verbose >= 1: print("len(genomeBio.features):", len(genomeBio.features))
     for feature in genomeBio.features:
-        attDict = get_attribute_dict(feature)
         location = convert_location_bio_to_dict(feature)
-        locationBio = feature.location
 
         # Use the first of the attributes of the priority list found in the feature as main identifier
         featId = None
         for identifier in geneIdentifierPriorityList:
-            if attDict.get(identifier) is not None:
-                featId = attDict[identifier]
+            featId = get_attribute(feature, identifier)
+            if featId is not None:
                 break
 
         CDSDict = {'chromosome':genomeId,
@@ -395,48 +763,143 @@ def convert_genbank_to_annotation_df(genomeBio, extractDNASeq=False, extractProt
                    'strand':location['strand'],
                    'start':location['start'],
                    'end':location['end'],
-                   'locus_tag':attDict.get('locus_tag'),
-                   'gene':attDict.get('gene'),
-                   'protein_id':attDict.get('protein_id')
+                   'locus_tag':get_attribute(feature, 'locus_tag'),
+                   'gene':get_attribute(feature, 'gene'),
+                   'protein_id':get_attribute(feature, 'protein_id')
                    }
         if extractDNASeq and hasWellDefinedGenomeSeq:
-            dnaSeqBio = SeqFeature(location=locationBio).extract(genomeBio)
-            dnaSeq = str(dnaSeqBio.seq)
+            dnaSeq = _extract_location_seq(genomeSeq, feature.location)
             CDSDict['DNA_seq'] = dnaSeq
         else:
-            dnaSeqBio = None
             dnaSeq = None
         
-        if extractProteinSeq and feature.type == 'CDS' and dnaSeqBio is not None:
-            codonTableId = attDict.get('transl_table')
-            codonStartPos = attDict.get('codon_start')    # in 1-based index
+        if extractProteinSeq and feature.type == 'CDS' and dnaSeq is not None:
+            # Proteins are translated in batch per codon table after the loop
+            CDSDict['protein_seq'] = None
+            codonTableId = get_attribute(feature, 'transl_table')
+            codonStartPos = get_attribute(feature, 'codon_start')    # in 1-based index
             codonStartPos = int(codonStartPos) if codonStartPos is not None else 1
             if codonTableId is not None:
-                try:
-                    proteinSeq = str(dnaSeqBio.seq[3*(codonStartPos - 1):].translate(table=codonTableId, cds=True))
-                except TranslationError:
-                    try:
-                        proteinSeq = str(dnaSeqBio.seq[3*(codonStartPos - 1):].translate(table=codonTableId, cds=False))
-                    except TranslationError:
-                        proteinSeq = None
-
-            CDSDict['protein_seq'] = proteinSeq
+                translationTaskList.append((len(CDSList), int(codonTableId), dnaSeq, codonStartPos))
 
         CDSList.append(CDSDict)
         if verbose >= 2: print("\n\n")
 
+    for codonTableId in sorted(set(task[1] for task in translationTaskList)):
+        taskList = [task for task in translationTaskList if task[1] == codonTableId]
+        proteinSeqList = translate_dna_seq_batch([task[2] for task in taskList], codonTable=codonTableId,
+                                                 codonStartList=[task[3] for task in taskList])
+        for task, proteinSeq in zip(taskList, proteinSeqList):
+            CDSList[task[0]]['protein_seq'] = proteinSeq
+
+    if len(CDSList) == 0:
+        return pd.DataFrame(columns=_annotationDfColumnList)
+
     CDSDf = pd.DataFrame(CDSList)
     CDSDf = CDSDf.sort_values(by=['start', 'end', 'strand'])
     
     return CDSDf
 
 
+def iterate_genbank_file(filepath):
+    """
+    Iterate over the records of a GenBank/GBFF file (gzip compressed if the suffix is .gz) without loading
+    the whole file. An open text file handle (e.g. from `open_compressed_genome_file`) can be given instead
+    of a path; it is not closed.
+    """
+    if hasattr(filepath, 'read'):
+        for genomeBio in SeqIO.parse(filepath, 'genbank'):
+            yield genomeBio
+        return
+    with open_by_suffix(str(filepath)) as f:
+        for genomeBio in SeqIO.parse(f, 'genbank'):
+            yield genomeBio
+
+
+def _convert_genbank_record_worker(args):
+    genomeBio, kwargs = args
+    return convert_genbank_to_annotation_df(genomeBio, **kwargs)
+
+
+def convert_genbank_file_to_annotation_df(filepath, extractDNASeq=False, extractProteinSeq=False,
+                                          substituteSpaces=True, nJobs=1, maxPendingRecords=None, verbose=1):
+    """
+    Build the annotation dataframe of all the records (chromosomes, plasmids) of a GenBank/GBFF file,
+    which can be gzip compressed (e.g. RefSeq `.gbff.gz` files), or of an open text file handle.
+
+    Records are parsed one at a time from the file and, if nJobs > 1, fanned out to a pool of processes
+    running `convert_genbank_to_annotation_df`. At most `maxPendingRecords` records (default 2*nJobs)
+    are held in memory at a time. The per-record annotation tables are concatenated in file order.
+    """
+    kwargs = {'extractDNASeq':extractDNASeq, 'extractProteinSeq':extractProteinSeq,
+              'substituteSpaces':substituteSpaces, 'verbose':verbose - 1}
+    taskIterator = ((genomeBio, kwargs) for genomeBio in iterate_genbank_file(filepath))
+
+    if nJobs == 1:
+        dfList = [_convert_genbank_record_worker(task) for task in taskIterator]
+    else:
+        if maxPendingRecords is None:
+            maxPendingRecords = 2*nJobs
+        with ProcessPoolExecutor(max_workers=nJobs) as executor:
+            dfList = list(executor_map_bounded(executor, _convert_genbank_record_worker, taskIterator,
+                                               maxPendingRecords))
+    if verbose >= 1: print("Nb of records in file:", len(dfList))
+
+    if len(dfList) == 0:
+        return pd.DataFrame(columns=_annotationDfColumnList)
+    return pd.concat(dfList, ignore_index=True)
+
+
+def _build_bed_lines(df, chromosomeCol='chromosome', startCol='start', endCol='end', strandCol='strand',
+                     idCol='id', featureCol='feature', combineFeatureAndId=False, bedFormat='bed6',
+                     scoreCol=None, valueCol=None):
+    """Build the BED lines (without line terminator) of an annotation dataframe column-wise."""
+    # BED format uses 0-based start-inclusive end-exclusive counting (as in Python)
+    # BED format start < end
+    start = df[startCol].values.astype(np.int64)
+    end = df[endCol].values.astype(np.int64)
+    bedStartS = pd.Series(np.minimum(start, end), index=df.index).astype(str)
+    bedEndS = pd.Series(np.maximum(start, end), index=df.index).astype(str)
+    chromosomeS = df[chromosomeCol].map(str)
+
+    if bedFormat == 'bedgraph':
+        return chromosomeS + '\t' + bedStartS + '\t' + bedEndS + '\t' + df[valueCol].map(str)
+
+    if combineFeatureAndId:
+        nameS = df[featureCol].map(str) + ';' + df[idCol].map(str)
+    else:
+        nameS = df[idCol].map(str)
+    scoreS = df[scoreCol].map(str) if scoreCol is not None else '0'
+    lineS = chromosomeS + '\t' + bedStartS + '\t' + bedEndS + '\t' + nameS + '\t' + scoreS + '\t' + \
+        df[strandCol].map(str)
+
+    if bedFormat == 'bed12':
+        # One block per feature, the thick part spans the whole feature
+        blockSizeS = pd.Series(np.abs(end - start), index=df.index).astype(str)
+        lineS = lineS + '\t' + bedStartS + '\t' + bedEndS + '\t0\t1\t' + blockSizeS + '\t0'
+    return lineS
+
+
 def convert_annotation_df_to_bed(annotDf, chromosomeCol='chromosome', startCol='start', endCol='end',
                                  strandCol='strand', idCol='id', featureCol='feature', combineFeatureAndId=False,
-                                 sort=True, sortBy=None, sortAscending=None
+                                 sort=True, sortBy=None, sortAscending=None, filepath=None, bedFormat='bed6',
+                                 scoreCol=None, valueCol=None, chunkSize=100000
                                  ):
     """We assume that annotation features dataframe uses 0-based start-inclusive end-exclusive
-    counting with start <= end."""
+    counting with start <= end.
+
+    The BED lines are built column-wise. If filepath is None, the BED file content is returned as a string,
+    otherwise it is written by chunks of rows to filepath, which can be a path (gzip compressed if the suffix
+    is .gz) or an open text file handle.
+
+    bedFormat: 'bed6' (default), 'bed12' (one block per feature), or 'bedgraph' (chromosome, start, end and the
+    value of column `valueCol`). The BED score is 0 unless a `scoreCol` is given.
+    """
+
+    if bedFormat not in ['bed6', 'bed12', 'bedgraph']:
+        raise ValueError("bedFormat should be one of 'bed6', 'bed12' or 'bedgraph'.")
+    if bedFormat == 'bedgraph' and valueCol is None:
+        raise ValueError("valueCol is required for bedgraph format.")
 
     df = annotDf
     if type(df) is pd.Series:
@@ -451,37 +914,34 @@ def convert_annotation_df_to_bed(annotDf, chromosomeCol='chromosome', startCol='
             sortAscendingList = sortAscending + sortAscendingList
         df = df.sort_values(by=sortColList, ascending=sortAscendingList)
         # df = sort_df(df, chromosomeCol, key=lambda x: (x.upper(), x[0].islower()), reverse=False)
-    df.index.name = idCol
+    df = df.rename_axis(idCol)
 
     if idCol not in df.columns:
         df = df.reset_index()
 
-    bed_string = ""
-    for index, annot in df.iterrows():
-        # BED format uses 0-based start-inclusive end-exclusive counting (as in Python)
-        # BED format start < end
-        chromosomeName = annot[chromosomeCol]
-        if combineFeatureAndId:
-            bed_id = "{};{}".format(annot[featureCol], annot[idCol])
-        else:
-            bed_id = annot[idCol]
-        bed_start = int(annot[startCol])
-        bed_end = int(annot[endCol])
-        bed_strand = annot[strandCol]
-        if bed_start > bed_end:
-            bed_start, bed_end = bed_end, bed_start
-        bed_string += "{}\t{}\t{}\t{}\t{:d}\t{}\n".format(chromosomeName, str(bed_start), str(bed_end),
-                                                          bed_id, 0, bed_strand)
-    return bed_string
+    lineKwargs = {'chromosomeCol':chromosomeCol, 'startCol':startCol, 'endCol':endCol, 'strandCol':strandCol,
+                  'idCol':idCol, 'featureCol':featureCol, 'combineFeatureAndId':combineFeatureAndId,
+                  'bedFormat':bedFormat, 'scoreCol':scoreCol, 'valueCol':valueCol}
+
+    if filepath is None:
+        if len(df) == 0:
+            return ""
+        return "".join([line + "\n" for line in _build_bed_lines(df, **lineKwargs)])
+
+    with _open_text_output(filepath) as f:
+        for i in range(0, len(df), chunkSize):
+            lineS = _build_bed_lines(df.iloc[i:i + chunkSize], **lineKwargs)
+            f.write("".join([line + "\n" for line in lineS]))
+    return None
 
 
 def convert_Bio_feature_to_bed(featureList, referenceName):
-    bed_string = ""
+    lineList = []
     for feature in featureList:
         # BED format uses 0-based start-inclusive end-exclusive counting (as in Python)
         # BED format start < end
-        start = feature.location.start.position
-        end = feature.location.end.position
+        start = int(feature.location.start)
+        end = int(feature.location.end)
         if 'gene' in feature.qualifiers.keys():
             name = feature.qualifiers['gene'][0]
         elif 'locus_tag' in feature.qualifiers.keys():
@@ -489,124 +949,104 @@ def convert_Bio_feature_to_bed(featureList, referenceName):
             name = feature.qualifiers['locus_tag'][0]
         else:
             name = ''
-        strand = convert_strand_numeric_to_strand_string(feature.strand)
+        strand = convert_strand_numeric_to_strand_string(feature.location.strand)
 
         # Start and end should be always ordered in GenBank file but we check anyway
         if start > end:
             start, end = end, start
             
-        bed_string += "{}\t{:d}\t{:d}\t{}\t0\t{}\n".format(referenceName, start, end, name, strand)
+        lineList.append("{}\t{:d}\t{:d}\t{}\t0\t{}\n".format(referenceName, start, end, name, strand))
 
-    return bed_string
+    return "".join(lineList)
 
 
 def convert_annotation_df_to_gtf(annotDf, chromosomeCol='chromosome', startCol='start', endCol='end',
                                  strandCol='strand', idCol='id', featureToIncludeList=None,
-                                 transcriptIdCol='transcript_id_unique', usePseudoTranscriptOnly=False
+                                 transcriptIdCol='transcript_id_unique', usePseudoTranscriptOnly=False,
+                                 filepath=None, chunkSize=100000
                                  ):
     """We assume that annotation features dataframe uses 0-based start-inclusive end-exclusive
-    counting with start <= end."""
-    
-    def format_attribute(attDict):
-        attList = []
-        for (key, value) in attDict.items():
-            if isinstance(value, numbers.Number):
-                attString = '{} "{}"'.format(str(key), value)
-            else:
-                attString = '{} "{}"'.format(str(key), value)
-            attList.append(attString)
-        return "; ".join(attList)
-    
-    gtf_string = ""
-    for index, annot in annotDf.sort_values(by=[chromosomeCol, startCol, endCol, strandCol]).iterrows():
-        
-        if not (featureToIncludeList is not None and annot['feature'] not in featureToIncludeList):
-
-            # See note on GTF format:
-            # > chromosome names can be given with or without the 'chr' prefix. Important note:
-            # > the seqname must be one used within Ensembl, i.e. a standard chromosome name or an Ensembl identifier
-            # > such as a scaffold ID, without any additional content such as species or assembly.
-            # chromosomeName = "chr1"
-            chromosomeName = annot[chromosomeCol]
-            gtf_feature = annot['feature']
-            gtf_attributeDict = {}
-            # GTF format uses 1-based start-inclusive end-inclusive.
-            if annot['feature'] == 'transcript' and not usePseudoTranscriptOnly:
-                gtf_feature = 'transcript'
-                gtf_attributeDict['transcript_id'] = annot['id']
-                gtf_start = int(annot[startCol]) + 1
-                gtf_end = int(annot[endCol])
-            elif annot['feature'] == 'CDS':
-                gtf_feature = 'CDS'
-                gtf_attributeDict['gene_id'] = annot['id']
-                gtf_attributeDict['transcript_id'] = annot[transcriptIdCol]
-                gtf_start = int(annot[startCol]) + 1
-                # GTF format excludes stop codon from CDS interval
-                # See http://mblab.wustl.edu/GTF22.html
-                gtf_end = int(annot[endCol]) - 3
-            elif annot['feature'] == 'ncRNA':
-                gtf_feature = 'gene'
-                gtf_attributeDict['gene_id'] = annot['id']
-                gtf_attributeDict['transcript_id'] = annot[transcriptIdCol]
-                gtf_start = int(annot[startCol]) + 1
-                gtf_end = int(annot[endCol])
-            else:
-                gtf_feature = annot['feature']
-                gtf_attributeDict['transcript_id'] = annot[transcriptIdCol]
-                gtf_start = int(annot[startCol]) + 1
-                gtf_end = int(annot[endCol])
-
-            if annot['feature'] != 'transcript' and usePseudoTranscriptOnly:
-                # Update the reference to the transcript id
-                gtf_attributeDict['transcript_id'] = 't' + annot['id']
-
-            gtf_strand = annot[strandCol]
-            gtf_frame = '.'
-
-            if annot['feature'] != 'transcript' or not usePseudoTranscriptOnly:
-                if gtf_start > gtf_end:
-                    gtf_start, gtf_end = gtf_end, gtf_start
-                gtf_string += "{}\t.\t{}\t{}\t{}\t.\t{}\t{}\t{}\n"\
-                              .format(chromosomeName,
-                                      gtf_feature,
-                                      str(gtf_start),
-                                      str(gtf_end),
-                                      gtf_strand,
-                                      gtf_frame,
-                                      format_attribute(gtf_attributeDict)
-                                      )
-
-            if annot['feature'] == 'CDS':
-                gtf_feature = 'exon'
-                gtf_string += "{}\t.\t{}\t{}\t{}\t.\t{}\t{}\t{}\n"\
-                              .format(chromosomeName,
-                                      gtf_feature,
-                                      str(gtf_start),
-                                      str(gtf_end),
-                                      gtf_strand,
-                                      gtf_frame,
-                                      format_attribute(gtf_attributeDict)
-                                      )
-
-            if annot['feature'] != 'transcript' and usePseudoTranscriptOnly:
-                # We add a pseudo-transcript with the same coordinates as the CDS
-                # but including the stop codon
-                gtf_feature = 'transcript'
-                gtf_attributeDict = {}
-                gtf_attributeDict['transcript_id'] = 't' + annot['id']
-                gtf_start = int(annot[startCol]) + 1
-                gtf_end = int(annot[endCol])
-                gtf_string += "{}\t.\t{}\t{}\t{}\t.\t{}\t{}\t{}\n"\
-                              .format(chromosomeName,
-                                      gtf_feature,
-                                      str(gtf_start),
-                                      str(gtf_end),
-                                      gtf_strand,
-                                      gtf_frame,
-                                      format_attribute(gtf_attributeDict)
-                                      )
-
-    return gtf_string
+    counting with start <= end.
+
+    The GTF rows are built column-wise: the main rows of each feature, the exon rows of the CDS
+    and the pseudo-transcript rows are built as separate masked frames, concatenated and sorted once
+    to keep the rows of each feature together. If filepath is None, the GTF file content is returned
+    as a string, otherwise it is written by chunks of rows to filepath, which can be a path (gzip
+    compressed if the suffix is .gz) or an open text file handle.
+    """
+
+    df = annotDf.sort_values(by=[chromosomeCol, startCol, endCol, strandCol], kind='mergesort')
+    if featureToIncludeList is not None:
+        df = df[df['feature'].isin(featureToIncludeList)]
+    if len(df) == 0:
+        if filepath is None:
+            return ""
+        with _open_text_output(filepath):
+            pass
+        return None
+
+    # See note on GTF format:
+    # > chromosome names can be given with or without the 'chr' prefix. Important note:
+    # > the seqname must be one used within Ensembl, i.e. a standard chromosome name or an Ensembl identifier
+    # > such as a scaffold ID, without any additional content such as species or assembly.
+    featureArr = df['feature'].values
+    isTranscript = featureArr == 'transcript'
+    isCDS = featureArr == 'CDS'
+    isGene = isCDS | (featureArr == 'ncRNA')
+    rowPos = np.arange(len(df))
+    idS = df['id'].map(str)
+
+    # GTF format uses 1-based start-inclusive end-inclusive.
+    gtfStart = df[startCol].values.astype(np.int64) + 1
+    gtfEnd = df[endCol].values.astype(np.int64)
+
+    # Main rows of all features, except transcripts when only pseudo-transcripts are used
+    isMain = ~isTranscript if usePseudoTranscriptOnly else np.ones(len(df), dtype=bool)
+    # GTF format excludes stop codon from CDS interval
+    # See http://mblab.wustl.edu/GTF22.html
+    mainEnd = np.where(isCDS, gtfEnd - 3, gtfEnd)
+    mainStart, mainEnd = np.minimum(gtfStart, mainEnd), np.maximum(gtfStart, mainEnd)
+    if usePseudoTranscriptOnly:
+        # Update the reference to the transcript id
+        transcriptIdS = 't' + idS
+    else:
+        transcriptIdS = idS.copy()
+        if not isTranscript.all():
+            transcriptIdS[~isTranscript] = df.loc[~isTranscript, transcriptIdCol].map(str)
+    mainAttributeS = 'transcript_id "' + transcriptIdS + '"'
+    mainAttributeS[isGene] = 'gene_id "' + idS[isGene] + '"; ' + mainAttributeS[isGene]
+    mainFeatureArr = np.where(featureArr == 'ncRNA', 'gene', featureArr)
+
+    mainDf = pd.DataFrame({'row':rowPos, 'sub':0, 'feature':mainFeatureArr, 'start':mainStart, 'end':mainEnd,
+                           'attribute':mainAttributeS.values})
+    frameList = [mainDf[isMain],
+                 # Exon rows of the CDS, with the same interval and attributes
+                 mainDf[isCDS & isMain].assign(sub=1, feature='exon')]
+
+    if usePseudoTranscriptOnly:
+        # We add a pseudo-transcript with the same coordinates as the CDS
+        # but including the stop codon
+        pseudoDf = pd.DataFrame({'row':rowPos, 'sub':2, 'feature':'transcript', 'start':gtfStart, 'end':gtfEnd,
+                                 'attribute':('transcript_id "t' + idS + '"').values})
+        frameList.append(pseudoDf[~isTranscript])
+
+    gtfDf = pd.concat(frameList, ignore_index=True)
+    gtfDf = gtfDf.iloc[np.lexsort((gtfDf['sub'].values, gtfDf['row'].values))]
+    gtfDf['chromosome'] = df[chromosomeCol].map(str).values[gtfDf['row'].values]
+    gtfDf['strand'] = df[strandCol].map(str).values[gtfDf['row'].values]
+
+    def build_lines(gtfDf):
+        lineS = gtfDf['chromosome'] + '\t.\t' + gtfDf['feature'] + '\t' + gtfDf['start'].astype(str) + '\t' + \
+            gtfDf['end'].astype(str) + '\t.\t' + gtfDf['strand'] + '\t.\t' + gtfDf['attribute']
+        return "".join([line + "\n" for line in lineS])
+
+    if filepath is None:
+        return build_lines(gtfDf)
+
+    with _open_text_output(filepath) as f:
+        for i in range(0, len(gtfDf), chunkSize):
+            f.write(build_lines(gtfDf.iloc[i:i + chunkSize]))
+    return None
 
 
 def extract_SeqFeature_Bio(annot, startCol='start', endCol='end', featureCol='feature',
@@ -628,6 +1068,11 @@ def extract_SeqFeature_Bio(annot, startCol='start', endCol='end', featureCol='fe
 
 def extract_dna_seq(annot, genomeBio, idCol='id', **kwargs):
     seqFeatureBio = extract_SeqFeature_Bio(annot, idCol=idCol, **kwargs)
+    if isinstance(genomeBio, PackedSequence):
+        # Only the feature location is decoded
+        location = seqFeatureBio.location
+        seq = genomeBio[int(location.start):int(location.end)]
+        return Seq(str(seq.reverse_complement() if location.strand == -1 else seq))
     return seqFeatureBio.extract(genomeBio).seq
 
 
@@ -641,6 +1086,133 @@ def extract_protein_seq(annotDf, genomeBio, idCol='id'):
         return None
 
 
+_dnaCodeLUT = np.full(256, 4, dtype=np.uint8)
+for _code, _letters in enumerate(['Aa', 'Cc', 'Gg', 'TtUu']):
+    for _letter in _letters:
+        _dnaCodeLUT[ord(_letter)] = _code
+
+# Codons in the order of the codon indices 0..63 (index = 16*base1 + 4*base2 + base3, with A, C, G, T -> 0, 1, 2, 3)
+codonList64 = [b1 + b2 + b3 for b1 in 'ACGT' for b2 in 'ACGT' for b3 in 'ACGT']
+
+
+def encode_dna_seq(seq):
+    """Encode a DNA sequence into a uint8 array, with A, C, G, T (or U) -> 0, 1, 2, 3 and any other letter -> 4."""
+    return _dnaCodeLUT[np.frombuffer(str(seq).encode('ascii'), dtype=np.uint8)]
+
+
+def codon_index_array(codes, frame=0):
+    """
+    Convert an encoded DNA sequence (see `encode_dna_seq`) into the array of codon indices 0..63
+    of its consecutive codons in the given frame, as in `codonList64`. Codons containing another
+    letter than A, C, G, T are given the index 64. Trailing partial codons are ignored.
+    """
+    nCodons = max(len(codes) - frame, 0) // 3
+    tripletArr = codes[frame:frame + 3*nCodons].reshape(-1, 3).astype(np.int16)
+    codonIdx = 16*tripletArr[:, 0] + 4*tripletArr[:, 1] + tripletArr[:, 2]
+    codonIdx[(tripletArr > 3).any(axis=1)] = 64
+    return codonIdx
+
+
+_translationLUTDict = {}
+
+
+def get_translation_lut(codonTable):
+    """
+    Return the lookup tables of a codon table (Biopython CodonTable or NCBI table id) indexed by codon index
+    (see `codonList64`): the amino acid letters as uint8 array (stop codons -> '*', index 64 -> 'X'),
+    and the boolean mask of start codons.
+    """
+    if not isinstance(codonTable, CodonTable.CodonTable):
+        codonTable = CodonTable.unambiguous_dna_by_id[int(codonTable)]
+    if codonTable.id is not None and codonTable.id in _translationLUTDict:
+        return _translationLUTDict[codonTable.id]
+
+    aaList = [codonTable.forward_table.get(codon, '*' if codon in codonTable.stop_codons else 'X')
+              for codon in codonList64] + ['X']
+    aaLUT = np.frombuffer("".join(aaList).encode('ascii'), dtype=np.uint8)
+    startLUT = np.array([codon in codonTable.start_codons for codon in codonList64] + [False])
+    if codonTable.id is not None:
+        _translationLUTDict[codonTable.id] = (aaLUT, startLUT)
+    return aaLUT, startLUT
+
+
+def _translate_dna_seq_biopython(seq, codonTable, cds, cdsFallback):
+    """Translate a sequence with Biopython, with the cds and fallback rules of `translate_dna_seq_batch`."""
+    if cds:
+        try:
+            return str(Seq(seq).translate(table=codonTable, cds=True))
+        except TranslationError:
+            if not cdsFallback:
+                return None
+    try:
+        return str(Seq(seq[:3*(len(seq) // 3)]).translate(table=codonTable, cds=False))
+    except TranslationError:
+        return None
+
+
+def translate_dna_seq_batch(seqList, codonTable=codonTableBioMPN, codonStartList=None, cds=True, cdsFallback=True):
+    """
+    Translate a list of DNA sequences at once, by encoding all sequences into codon indices and translating
+    them through the 64-entry lookup table of the codon table (Biopython CodonTable or NCBI table id).
+
+    codonStartList gives the optional `codon_start` qualifier (1-based, 1, 2 or 3) of each sequence:
+    translation starts at nucleotide codon_start - 1.
+
+    With cds=True, as in `Bio.Seq.translate`, a sequence is checked to be a complete CDS (length multiple of 3,
+    valid start codon, stop codon at the end and no in-frame stop codon), its start codon is translated as M
+    and the stop codon is dropped. Sequences failing the check are translated as cds=False if cdsFallback,
+    and set to None otherwise.
+
+    Sequences containing other letters than A, C, G, T/U (e.g. IUPAC ambiguity codes) are translated by
+    `Bio.Seq.translate` instead, with the same cds and fallback rules, such that ambiguous codons are resolved
+    as in Biopython (e.g. CTN -> L); they are set to None if Biopython cannot translate them.
+    Trailing partial codons are ignored. Returns a list of protein sequences (None for None sequences).
+    """
+    aaLUT, startLUT = get_translation_lut(codonTable)
+    if codonStartList is None:
+        codonStartList = [1]*len(seqList)
+
+    isNone = [seq is None for seq in seqList]
+    seqList = [str(seq)[codonStart - 1:] if seq is not None else '' for seq, codonStart in zip(seqList, codonStartList)]
+    seqLength = np.array([len(seq) for seq in seqList], dtype=np.int64)
+    nCodons = seqLength // 3
+    codonIdx = codon_index_array(encode_dna_seq("".join([seq[:3*n] for seq, n in zip(seqList, nCodons)])))
+    aaArr = aaLUT[codonIdx]
+    aaString = aaArr.tobytes().decode('ascii')
+
+    codonStart = np.concatenate([[0], np.cumsum(nCodons)[:-1]]).astype(np.int64)
+    codonEnd = codonStart + nCodons
+    invalidCumsum = np.concatenate([[0], np.cumsum(codonIdx == 64)])
+    hasInvalidCodon = invalidCumsum[codonEnd] > invalidCumsum[codonStart]
+    if cds:
+        isStop = np.concatenate([aaArr == ord('*'), [False]])
+        stopCumsum = np.concatenate([[0], np.cumsum(isStop)])
+        hasCodon = nCodons > 0
+        firstIdx = np.where(hasCodon, codonStart, len(codonIdx))
+        lastIdx = np.where(hasCodon, codonEnd - 1, len(codonIdx))
+        codonIdx65 = np.concatenate([codonIdx, [64]])
+        # Number of stop codons between the first and the last codon
+        nInternalStop = np.where(nCodons >= 2, stopCumsum[lastIdx] - stopCumsum[firstIdx + 1], 0)
+        isCDS = hasCodon & (seqLength % 3 == 0) & startLUT[codonIdx65[firstIdx]] & \
+                isStop[lastIdx] & (nInternalStop == 0)
+    else:
+        isCDS = np.zeros(len(seqList), dtype=bool)
+
+    proteinSeqList = []
+    for i in range(len(seqList)):
+        if isNone[i]:
+            proteinSeqList.append(None)
+        elif hasInvalidCodon[i]:
+            proteinSeqList.append(_translate_dna_seq_biopython(seqList[i], codonTable, cds, cdsFallback))
+        elif isCDS[i]:
+            proteinSeqList.append('M' + aaString[codonStart[i] + 1:codonEnd[i] - 1])
+        elif not cds or cdsFallback:
+            proteinSeqList.append(aaString[codonStart[i]:codonEnd[i]])
+        else:
+            proteinSeqList.append(None)
+    return proteinSeqList
+
+
 def extract_codons_list(seq, frame=0, checkLengthMultipleOf3=False, frameFromEnd=False):
     
     if len(seq) % 3 != 0 and checkLengthMultipleOf3:
@@ -669,8 +1241,12 @@ def find_ORFs(seqBio, codonTable, startCodons=['ATG', 'GTG', 'TTG'], verbose=0):
     [1] Hecht, A., Glasgow, J., Jaschke, P. R., Bawazer, L. A., Munson, M. S., Cochran, J. R., … Salit, M. (2017).
     Measurements of translation initiation from all 64 codons in E. coli. Nucleic Acids Research, 1–12.
     http://doi.org/10.1093/nar/gkx070
+
+    seqBio: Biopython Seq, or `PackedSequence` (decoded once).
     """
     
+    if isinstance(seqBio, PackedSequence):
+        seqBio = Seq(str(seqBio))
     ORFList = []
     
     for strand, seq in [(+1, seqBio), (-1, seqBio.reverse_complement())]:
@@ -743,6 +1319,516 @@ def find_ORFs(seqBio, codonTable, startCodons=['ATG', 'GTG', 'TTG'], verbose=0):
 
 
 
+_complementCodeLUT = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+
+def reverse_complement_codes(codes):
+    """Reverse complement an encoded DNA sequence (see `encode_dna_seq`)."""
+    return _complementCodeLUT[codes[::-1]]
+
+
+def triplet_index_array(codes):
+    """
+    Codon index 0..63 (see `codonList64`) of the triplet starting at every position of an encoded DNA
+    sequence, i.e. of the codons of all three frames at once. Triplets containing another letter than
+    A, C, G, T are given the index 64. The triplets are read through a sliding window view with stride 1.
+    """
+    if len(codes) < 3:
+        return np.array([], dtype=np.int64)
+    tripletArr = sliding_window_array(codes.astype(np.int64), 3)
+    tripletIdx = tripletArr @ np.array([16, 4, 1])
+    tripletIdx[(tripletArr > 3).any(axis=1)] = 64
+    return tripletIdx
+
+
+def kmer_index_array(codes, k):
+    """
+    Index 0..4**k - 1 of the k-mer starting at every position of an encoded DNA sequence (see `encode_dna_seq`),
+    with the same base order as `codonList64` for k = 3. K-mers containing another letter than A, C, G, T are
+    given the index 4**k.
+    """
+    if len(codes) < k:
+        return np.array([], dtype=np.int64)
+    kmerArr = sliding_window_array(codes.astype(np.int64), k)
+    kmerIdx = kmerArr @ (4**np.arange(k - 1, -1, -1))
+    kmerIdx[(kmerArr > 3).any(axis=1)] = 4**k
+    return kmerIdx
+
+
+# Unpacking table of the 2-bit packed sequences: byte -> 4 bases, the first base in the 2 most significant bits
+_unpackLUT = ((np.arange(256, dtype=np.uint8)[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3).astype(np.uint8)
+_codeLetterArr = np.frombuffer(b'ACGTN', dtype=np.uint8)
+
+
+class PackedSequence(object):
+    """
+    Compact DNA sequence, stored as a 2-bit packed numpy buffer (4 bases per byte) plus the intervals of N
+    (any letter other than A, C, G, T/U, e.g. IUPAC ambiguity codes, is stored as N and lower case is lost).
+
+    Slicing and reverse complement return views on the same buffer without copying it. The bases are only
+    decoded when needed, by `codes`, `str` or the k-mer and codon index methods.
+
+    seq: sequence string, Biopython Seq or SeqRecord, or encoded DNA sequence (see `encode_dna_seq`).
+    """
+
+    def __init__(self, seq):
+        if isinstance(seq, np.ndarray):
+            codes = seq.astype(np.uint8)
+        else:
+            codes = encode_dna_seq(_get_dna_string(seq))
+        isN = codes > 3
+        # Start and end of the runs of N
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], isN, [False]]).astype(np.int8)))
+        self._nStarts = edges[0::2].astype(np.int64)
+        self._nEnds = edges[1::2].astype(np.int64)
+
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = np.where(isN, 0, codes)
+        padded = padded.reshape(-1, 4)
+        self._packed = (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+        self._start = 0
+        self._end = len(codes)
+        self._strand = '+'
+
+    def _view(self, start, end, strand):
+        view = object.__new__(PackedSequence)
+        view._packed, view._nStarts, view._nEnds = self._packed, self._nStarts, self._nEnds
+        view._start, view._end, view._strand = start, end, strand
+        return view
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Only slices with step 1 are supported.")
+            stop = max(start, stop)
+            if self._strand == '+':
+                return self._view(self._start + start, self._start + stop, '+')
+            else:
+                return self._view(self._end - stop, self._end - start, '-')
+        i = range(len(self))[key]
+        return str(self[i:i + 1])
+
+    def __str__(self):
+        return _codeLetterArr[self.codes()].tobytes().decode('ascii')
+
+    def __repr__(self):
+        seq = str(self[:20]) + ('...' if len(self) > 20 else '')
+        return "PackedSequence('{}', length={})".format(seq, len(self))
+
+    @property
+    def nbytes(self):
+        """Memory size of the packed buffer and N intervals (shared by all views)."""
+        return self._packed.nbytes + self._nStarts.nbytes + self._nEnds.nbytes
+
+    def reverse_complement(self):
+        return self._view(self._start, self._end, '-' if self._strand == '+' else '+')
+
+    def codes(self):
+        """Encoded DNA sequence (see `encode_dna_seq`), with A, C, G, T -> 0, 1, 2, 3 and N -> 4."""
+        start, end = self._start, self._end
+        codes = _unpackLUT[self._packed[start // 4:-(-end // 4)]].ravel()[start % 4:start % 4 + end - start]
+        i0 = np.searchsorted(self._nEnds, start, side='right')
+        i1 = np.searchsorted(self._nStarts, end, side='left')
+        for nStart, nEnd in zip(self._nStarts[i0:i1], self._nEnds[i0:i1]):
+            codes[max(nStart, start) - start:min(nEnd, end) - start] = 4
+        if self._strand == '-':
+            codes = reverse_complement_codes(codes)
+        return codes
+
+    def codon_index_array(self, frame=0):
+        """Codon indices of the consecutive codons in the given frame (see `codon_index_array`)."""
+        return codon_index_array(self.codes(), frame=frame)
+
+    def triplet_index_array(self):
+        """Codon index of the triplet starting at every position (see `triplet_index_array`)."""
+        return triplet_index_array(self.codes())
+
+    def kmer_index_array(self, k):
+        """Index of the k-mer starting at every position (see `kmer_index_array`)."""
+        return kmer_index_array(self.codes(), k)
+
+
+class PackedGenome(Mapping):
+    """
+    Genome stored as a mapping of chromosome (record) id to `PackedSequence`, using 4 to 8 times less
+    memory than strings or Biopython records.
+
+    seqDict: dict (or other mapping, e.g. a PackedGenome) of chromosome id to sequence (string, Biopython Seq
+    or SeqRecord, or PackedSequence), or list of SeqRecords, whose ids are used.
+    """
+
+    def __init__(self, seqDict):
+        if not isinstance(seqDict, Mapping):
+            seqDict = {record.id:record for record in seqDict}
+        self._seqDict = {chromosome:seq if isinstance(seq, PackedSequence) else PackedSequence(seq)
+                         for chromosome, seq in seqDict.items()}
+
+    @classmethod
+    def from_file(cls, filepath, fileFormat='fasta'):
+        """Read a sequence file (gzip compressed if the suffix is .gz), packing one record at a time."""
+        with open_by_suffix(str(filepath)) as f:
+            return cls({record.id:PackedSequence(record) for record in SeqIO.parse(f, fileFormat)})
+
+    def __getitem__(self, chromosome):
+        return self._seqDict[chromosome]
+
+    def __iter__(self):
+        return iter(self._seqDict)
+
+    def __len__(self):
+        return len(self._seqDict)
+
+    def __repr__(self):
+        return "PackedGenome({})".format(', '.join('{}:{}'.format(chromosome, len(seq))
+                                                    for chromosome, seq in self._seqDict.items()))
+
+    @property
+    def nbytes(self):
+        return sum(seq.nbytes for seq in self._seqDict.values())
+
+    def extract(self, chromosome, start, end, strand='+'):
+        """Sequence view of a location in 0-based start-inclusive end-exclusive counting."""
+        seq = self._seqDict[chromosome][start:end]
+        return seq.reverse_complement() if strand == '-' else seq
+
+
+# Names of the shared memory blocks created (and not yet unlinked) by this process
+_ownedSharedMemoryNameSet = set()
+
+
+def _attach_shared_memory(name):
+    """Attach an existing shared memory block, without letting this process unlink it when it exits."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Before python 3.13, attaching registers the block to the resource tracker, which unlinks it when the
+        # process exits. Child processes of multiprocessing share the resource tracker of their parent, such
+        # that the registration is harmless there, but an independent process has to unregister the block.
+        # The process owning the block keeps its own registration, which is the same as the attaching one.
+        if multiprocessing.parent_process() is None and shm._name not in _ownedSharedMemoryNameSet:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedGenomeStore(object):
+    """
+    Genome sequences and annotation table published once in a shared memory block, such that the workers of
+    a process pool get zero-copy read-only numpy views instead of a pickled copy each.
+
+    The chromosomes are stored as 2-bit packed buffers (see `PackedSequence`). Numeric and boolean columns of
+    the annotation dataframe are stored as arrays (nullable columns as values plus mask), other columns as
+    utf-8 string buffers with offsets (missing values are read as None). A non-integer index of the annotation
+    dataframe is replaced by a range.
+
+    The process creating the store owns the block and unlinks it on `close` (or at the end of a with
+    block). Workers attach by the picklable `spec`, for instance through the pool initializer:
+
+        with SharedGenomeStore(genome, annotDf) as store:
+            with ProcessPoolExecutor(initializer=init_shared_genome_store_worker, initargs=(store.spec,)) as executor:
+                ...
+
+    and call `get_shared_genome_store()` in the task to get the attached store.
+
+    The views handed out by the store keep the memory mapped, and remain valid after the store is closed:
+
+    >>> with SharedGenomeStore({'chr1':'ACGTN'}, pd.DataFrame({'start':[0, 2]})) as store:
+    ...     annotDf = store.get_annotation_df()
+    >>> str(store.genome['chr1']), annotDf['start'].tolist()
+    ('ACGTN', [0, 2])
+
+    genome: `PackedGenome`, or anything accepted by `PackedGenome` (optional).
+    annotDf: annotation dataframe (optional).
+    """
+
+    def __init__(self, genome=None, annotDf=None):
+        arrayDict = {}
+        chromosomeList = []
+        if genome is not None:
+            if not isinstance(genome, PackedGenome):
+                genome = PackedGenome(genome)
+            for chromosome, seq in genome.items():
+                chromosomeList.append((chromosome, seq._start, seq._end, seq._strand))
+                arrayDict['seq/packed/' + chromosome] = seq._packed
+                arrayDict['seq/n_starts/' + chromosome] = seq._nStarts
+                arrayDict['seq/n_ends/' + chromosome] = seq._nEnds
+
+        # Each column is stored under its own prefix, such that column names cannot collide with other keys
+        annotColumnList = []
+        if annotDf is not None:
+            for col in annotDf.columns:
+                colS = annotDf[col]
+                if isinstance(colS.dtype, pd.api.extensions.ExtensionDtype) and colS.dtype.kind in 'biuf':
+                    # Nullable boolean, integer and float columns are stored as values plus mask
+                    annotColumnList.append((col, 'masked', str(colS.dtype)))
+                    arrayDict['annot/col/' + col] = colS.to_numpy(dtype=colS.dtype.numpy_dtype,
+                                                                  na_value=colS.dtype.numpy_dtype.type(0))
+                    arrayDict['annot/mask/' + col] = colS.isna().to_numpy()
+                    continue
+                values = colS.to_numpy()
+                if values.dtype.kind in 'biuf':
+                    annotColumnList.append((col, 'array', None))
+                    arrayDict['annot/col/' + col] = values
+                else:
+                    annotColumnList.append((col, 'string', None))
+                    isMissing = pd.isnull(values)
+                    encodedList = [b'' if missing else str(value).encode('utf-8')
+                                   for value, missing in zip(values, isMissing)]
+                    arrayDict['annot/col/' + col] = np.frombuffer(b''.join(encodedList), dtype=np.uint8)
+                    lengthArr = np.array([len(encoded) for encoded in encodedList], dtype=np.int64)
+                    arrayDict['annot/offsets/' + col] = np.concatenate([[0], np.cumsum(lengthArr)]).astype(np.int64)
+                    arrayDict['annot/mask/' + col] = isMissing.astype(bool)
+            arrayDict['annot/index'] = annotDf.index.to_numpy() if annotDf.index.dtype.kind in 'biu' \
+                else np.arange(len(annotDf))
+
+        # All arrays are copied in one block, at offsets aligned on 8 bytes
+        layoutDict = {}
+        offset = 0
+        for key, array in arrayDict.items():
+            layoutDict[key] = (offset, array.dtype.str, array.shape)
+            offset += -(-array.nbytes // 8) * 8
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        _ownedSharedMemoryNameSet.add(shm._name)
+        self._isOwner = True
+        self.spec = {'name':shm.name, 'layout':layoutDict, 'chromosomes':chromosomeList,
+                     'annotation_columns':annotColumnList}
+        self._map_shared_memory(shm, writeable=True)
+        for key, array in arrayDict.items():
+            self._get_array(key, writeable=True)[...] = array
+        self._build_views()
+
+    @classmethod
+    def attach(cls, spec):
+        """Attach to a store published by another process, given its `spec`."""
+        store = object.__new__(cls)
+        store._isOwner = False
+        store.spec = spec
+        store._map_shared_memory(_attach_shared_memory(spec['name']), writeable=False)
+        store._build_views()
+        return store
+
+    def _map_shared_memory(self, shm, writeable):
+        # The views are built on a separate memory map of the block, which is kept alive by the views themselves
+        # (numpy array bases), such that they remain valid after the store is closed and the block unlinked.
+        self._mmap = mmap.mmap(shm._fd, shm.size, access=mmap.ACCESS_WRITE if writeable else mmap.ACCESS_READ)
+        self._shm = shm
+        shm.close()
+
+    def _get_array(self, key, writeable=False):
+        offset, dtype, shape = self.spec['layout'][key]
+        dtype = np.dtype(dtype)
+        array = np.frombuffer(self._mmap, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        array.flags.writeable = writeable
+        return array
+
+    def _build_views(self):
+        seqDict = {}
+        for chromosome, start, end, strand in self.spec['chromosomes']:
+            seq = object.__new__(PackedSequence)
+            seq._packed = self._get_array('seq/packed/' + chromosome)
+            seq._nStarts = self._get_array('seq/n_starts/' + chromosome)
+            seq._nEnds = self._get_array('seq/n_ends/' + chromosome)
+            seq._start, seq._end, seq._strand = start, end, strand
+            seqDict[chromosome] = seq
+        self.genome = PackedGenome(seqDict)
+
+    @property
+    def annotation_columns(self):
+        return [col for col, _, _ in self.spec['annotation_columns']]
+
+    def get_annotation_array(self, col):
+        """
+        Read-only array of an annotation column: a zero-copy view for numeric columns (a pandas masked array
+        on zero-copy views for nullable columns), and an object array decoded from the shared string buffer
+        for the other columns.
+        """
+        colType, colDtype = {c:(t, d) for c, t, d in self.spec['annotation_columns']}[col]
+        if colType == 'array':
+            return self._get_array('annot/col/' + col)
+        if colType == 'masked':
+            values = self._get_array('annot/col/' + col)
+            mask = self._get_array('annot/mask/' + col)
+            maskedArrayClass = {'b':pd.arrays.BooleanArray, 'f':pd.arrays.FloatingArray}.get(values.dtype.kind,
+                                                                                           pd.arrays.IntegerArray)
+            return maskedArrayClass(values, mask, copy=False)
+        buffer = self._get_array('annot/col/' + col).tobytes()
+        offsets = self._get_array('annot/offsets/' + col)
+        isMissing = self._get_array('annot/mask/' + col)
+        return np.array([None if missing else buffer[start:end].decode('utf-8')
+                         for start, end, missing in zip(offsets[:-1], offsets[1:], isMissing)], dtype=object)
+
+    def get_annotation_df(self, columns=None):
+        """Annotation dataframe (numeric columns are built on the shared views without copy)."""
+        if columns is None:
+            columns = self.annotation_columns
+        return pd.DataFrame({col:self.get_annotation_array(col) for col in columns},
+                            index=self._get_array('annot/index'), columns=columns, copy=False)
+
+    def close(self):
+        """
+        Unlink the shared memory block if this process owns it. Processes which already attached the block, as
+        well as the views already handed out, keep working: the memory is only released when all of them are gone.
+        """
+        if self._isOwner and self._shm is not None:
+            self._shm.unlink()
+            _ownedSharedMemoryNameSet.discard(self._shm._name)
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_sharedGenomeStoreState = {}
+
+
+def init_shared_genome_store_worker(spec):
+    """Process pool initializer attaching the worker to a `SharedGenomeStore`."""
+    _sharedGenomeStoreState['store'] = SharedGenomeStore.attach(spec)
+
+
+def get_shared_genome_store():
+    """Return the `SharedGenomeStore` attached by `init_shared_genome_store_worker` in this worker."""
+    return _sharedGenomeStoreState['store']
+
+
+def _get_dna_string(seq):
+    """Return the sequence string of a sequence string, Biopython Seq or SeqRecord, or PackedSequence."""
+    if hasattr(seq, 'seq'):
+        seq = seq.seq
+    return str(seq)
+
+
+def _get_dna_codes(seq):
+    """
+    Return the encoded DNA sequence (see `encode_dna_seq`) of a sequence string, Biopython Seq or SeqRecord,
+    or PackedSequence.
+    """
+    if isinstance(seq, PackedSequence):
+        return seq.codes()
+    return encode_dna_seq(_get_dna_string(seq))
+
+
+def extract_dna_seq_batch(annotDf, genome, chromosomeCol='chromosome', startCol='start', endCol='end',
+                          strandCol='strand', asString=True):
+    """
+    Batch version of `extract_dna_seq`, extracting the DNA sequences of all the locations of an annotation
+    dataframe (0-based start-inclusive end-exclusive), reverse complemented on the '-' strand.
+
+    genome: `PackedGenome` or dict of chromosome id to sequence (string, Biopython Seq or SeqRecord, or
+    PackedSequence), or a single sequence, in which case the chromosome column is not used.
+    Non-packed sequences are converted once to a string per chromosome.
+    asString: if False, return `PackedSequence` views instead of strings (only for packed sequences).
+
+    Returns a Series aligned with the dataframe.
+    """
+    if isinstance(genome, Mapping):
+        chromosomeList = annotDf[chromosomeCol]
+    else:
+        genome = {None:genome}
+        chromosomeList = [None]*len(annotDf)
+
+    seqDict = {}
+    seqList = []
+    for chromosome, start, end, strand in zip(chromosomeList, annotDf[startCol], annotDf[endCol], annotDf[strandCol]):
+        if chromosome not in seqDict:
+            seq = genome[chromosome]
+            seqDict[chromosome] = seq if isinstance(seq, PackedSequence) else _get_dna_string(seq)
+        seq = seqDict[chromosome]
+        start, end = int(start), int(end)
+        if isinstance(seq, PackedSequence):
+            subSeq = seq[start:end]
+            if strand == '-':
+                subSeq = subSeq.reverse_complement()
+            if asString:
+                subSeq = str(subSeq)
+        else:
+            subSeq = seq[start:end]
+            if strand == '-':
+                subSeq = reverse_complement_string(subSeq)
+        seqList.append(subSeq)
+    return pd.Series(seqList, index=annotDf.index, dtype=object)
+
+
+def find_ORFs_df(seq, codonTable, startCodons=['ATG', 'GTG', 'TTG'], minLength=0, longestOnly=False,
+                 translate=False, verbose=0):
+    """
+    Find all putative open reading frames (ORFs) in the nucleotide sequence, with the same definition
+    as `find_ORFs`, but vectorized and returning a dataframe.
+
+    The sequence (string, Biopython Seq or SeqRecord) is encoded once. On each strand, the positions
+    of all stop and start codons are found at once with numpy, and every start codon is paired with the
+    next stop codon in the same frame by binary search.
+
+    minLength: minimum length of the ORF in nucleotides, including the stop codon.
+    longestOnly: keep only the first start codon before each stop codon, i.e. the longest ORF.
+    translate: add the protein sequence of the ORFs in column 'translation'. Translation can also be done
+    later on a subset of the ORFs with `translate_ORFs`.
+
+    Returns a dataframe with columns start, end (0-based start-inclusive end-exclusive), strand, frame
+    (relative to the start of the sequence on each strand), start_codon, stop_codon and length.
+    """
+    aaLUT, _ = get_translation_lut(codonTable)
+    isStopLUT = aaLUT == ord('*')
+    isStartLUT = np.array([codon in startCodons for codon in codonList64] + [False])
+    codonArr = np.array(codonList64 + [''], dtype=object)
+
+    codes = _get_dna_codes(seq)
+    seqLength = len(codes)
+
+    dfList = []
+    for strand, strandCodes in [('+', codes), ('-', reverse_complement_codes(codes))]:
+        tripletIdx = triplet_index_array(strandCodes)
+        stopPos = np.flatnonzero(isStopLUT[tripletIdx])
+        startPos = np.flatnonzero(isStartLUT[tripletIdx])
+        for frame in range(3):
+            frameStopPos = stopPos[stopPos % 3 == frame]
+            frameStartPos = startPos[startPos % 3 == frame]
+
+            # Pair each start codon with the next stop codon in frame
+            k = np.searchsorted(frameStopPos, frameStartPos, side='left')
+            hasStop = k < len(frameStopPos)
+            ORFStartPos = frameStartPos[hasStop]
+            ORFStopPos = frameStopPos[k[hasStop]]
+            if longestOnly:
+                _, firstIdx = np.unique(ORFStopPos, return_index=True)
+                ORFStartPos, ORFStopPos = ORFStartPos[firstIdx], ORFStopPos[firstIdx]
+            if verbose >= 2: print("strand", strand, "frame", frame, "nb of ORFs", len(ORFStartPos))
+
+            if strand == '+':
+                ORFStart, ORFEnd = ORFStartPos, ORFStopPos + 3
+            else:
+                # reverse location, including stop codon
+                ORFStart, ORFEnd = seqLength - 3 - ORFStopPos, seqLength - ORFStartPos
+            dfList.append(pd.DataFrame({'start':ORFStart, 'end':ORFEnd, 'strand':strand, 'frame':frame,
+                                        'start_codon':codonArr[tripletIdx[ORFStartPos]],
+                                        'stop_codon':codonArr[tripletIdx[ORFStopPos]]}))
+
+    ORFDf = pd.concat(dfList, ignore_index=True)
+    ORFDf['length'] = ORFDf['end'] - ORFDf['start']
+    ORFDf = ORFDf[ORFDf['length'] >= minLength].reset_index(drop=True)
+
+    if translate:
+        ORFDf['translation'] = translate_ORFs(ORFDf, seq, codonTable)
+    return ORFDf
+
+
+def translate_ORFs(ORFDf, seq, codonTable, startCol='start', endCol='end', strandCol='strand'):
+    """
+    Translate the ORFs of a dataframe (as returned by `find_ORFs_df`) found in the nucleotide sequence,
+    as CDS with the codon table (see `translate_dna_seq_batch`). Returns a Series aligned with the dataframe.
+    """
+    ORFSeqS = extract_dna_seq_batch(ORFDf, seq, startCol=startCol, endCol=endCol, strandCol=strandCol)
+    return pd.Series(translate_dna_seq_batch(list(ORFSeqS), codonTable=codonTable, cds=True),
+                     index=ORFDf.index, dtype=object)
+
+
 #====================================================================
 
 # ## RefSeq bacterial genomes database
@@ -790,108 +1876,265 @@ def import_genome_gbff_file(assemblySummaryRepDf, species_name=None, genome_acce
     return compressedGenomeFilename, organism_name, genome_accession
 
 
-def extract_compressed_genome_file(compressedGenomeFilename, compressedFolder, extractedFolder):
-    with gzip.GzipFile(os.path.join(compressedFolder,compressedGenomeFilename), mode='r') as genomeZipFile:
-        extractedGenomeFilename = re.match(r'(.+)\.gz', compressedGenomeFilename).group(1)
-        with open(os.path.join(extractedFolder, extractedGenomeFilename), 'wb') as file:
-            file.write(genomeZipFile.read())
+def extract_compressed_genome_file(compressedGenomeFilename, compressedFolder, extractedFolder, chunkSize=1024*1024):
+    """
+    Decompress a gzip compressed genome file (e.g. RefSeq `.gbff.gz`) into the extracted folder.
+    The file is decompressed in chunks of `chunkSize` bytes, with constant memory, into a temporary
+    file that is renamed at the end, such that an interrupted extraction does not leave a truncated file.
+    """
+    extractedGenomeFilename = re.match(r'(.+)\.gz', compressedGenomeFilename).group(1)
+    extractedFilepath = os.path.join(extractedFolder, extractedGenomeFilename)
+    try:
+        with gzip.open(os.path.join(compressedFolder, compressedGenomeFilename), mode='rb') as genomeZipFile:
+            with open(extractedFilepath + '.tmp', 'wb') as file:
+                shutil.copyfileobj(genomeZipFile, file, chunkSize)
+        os.replace(extractedFilepath + '.tmp', extractedFilepath)
+    finally:
+        # Remove the temporary file if the extraction failed
+        if os.path.exists(extractedFilepath + '.tmp'):
+            os.remove(extractedFilepath + '.tmp')
     return extractedGenomeFilename
 
 
+def _extract_compressed_genome_file_worker(args):
+    compressedGenomeFilename, compressedFolder, extractedFolder, overwrite, chunkSize = args
+    extractedGenomeFilename = re.match(r'(.+)\.gz', compressedGenomeFilename).group(1)
+    compressedFilepath = os.path.join(compressedFolder, compressedGenomeFilename)
+    extractedFilepath = os.path.join(extractedFolder, extractedGenomeFilename)
+    if (not overwrite and os.path.exists(extractedFilepath) and
+            os.path.getmtime(extractedFilepath) >= os.path.getmtime(compressedFilepath)):
+        return extractedGenomeFilename, False
+    extract_compressed_genome_file(compressedGenomeFilename, compressedFolder, extractedFolder, chunkSize)
+    return extractedGenomeFilename, True
+
+
+def extract_compressed_genome_files(compressedGenomeFilenameList, compressedFolder, extractedFolder, nJobs=4,
+                                    overwrite=False, chunkSize=1024*1024, verbose=1):
+    """
+    Batch version of `extract_compressed_genome_file`, decompressing many genome files concurrently.
+
+    Files are decompressed in chunks with constant memory by a pool of `nJobs` threads (zlib releases
+    the GIL while decompressing). Unless overwrite is True, files whose extracted file exists and is
+    newer than the compressed file are skipped.
+
+    Returns the list of extracted filenames, in the order of the input list.
+    """
+    taskList = [(compressedGenomeFilename, compressedFolder, extractedFolder, overwrite, chunkSize)
+                for compressedGenomeFilename in compressedGenomeFilenameList]
+    if nJobs == 1:
+        resultList = [_extract_compressed_genome_file_worker(task) for task in taskList]
+    else:
+        with ThreadPoolExecutor(max_workers=nJobs) as executor:
+            resultList = list(executor.map(_extract_compressed_genome_file_worker, taskList))
+    if verbose >= 1:
+        print("Nb of genome files extracted:", sum(extracted for _, extracted in resultList),
+              "skipped (up to date):", sum(not extracted for _, extracted in resultList))
+    return [extractedGenomeFilename for extractedGenomeFilename, _ in resultList]
+
+
+def open_compressed_genome_file(compressedGenomeFilename, compressedFolder):
+    """
+    Open a gzip compressed genome file as a streaming text file handle, which can be passed directly to
+    the GenBank parser (`iterate_genbank_file`, `convert_genbank_file_to_annotation_df`) without
+    extracting the file to disk.
+    """
+    return gzip.open(os.path.join(compressedFolder, compressedGenomeFilename), mode='rt')
+
+
+def _process_refseq_genome_worker(args):
+    genomeAccession, organismName, compressedGenomeFilename, compressedFolder, extractedFolder, outputFilepath, kwargs = args
+    try:
+        if extractedFolder is None:
+            with open_compressed_genome_file(compressedGenomeFilename, compressedFolder) as f:
+                annotDf = convert_genbank_file_to_annotation_df(f, verbose=0, **kwargs)
+        else:
+            extractedGenomeFilename, _ = _extract_compressed_genome_file_worker(
+                (compressedGenomeFilename, compressedFolder, extractedFolder, False, 1024*1024))
+            annotDf = convert_genbank_file_to_annotation_df(os.path.join(extractedFolder, extractedGenomeFilename),
+                                                            verbose=0, **kwargs)
+        annotDf.insert(0, 'organism_name', organismName)
+        annotDf.insert(0, 'assembly_accession', genomeAccession)
+        # Write to a temporary file first, such that an interrupted run never leaves a truncated output file
+        annotDf.to_parquet(outputFilepath + '.tmp', index=False)
+        os.replace(outputFilepath + '.tmp', outputFilepath)
+        return genomeAccession, len(annotDf), None
+    except Exception as e:
+        return genomeAccession, None, '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if os.path.exists(outputFilepath + '.tmp'):
+            os.remove(outputFilepath + '.tmp')
+
+
+def process_refseq_genomes(assemblySummaryRepDf, compressedFolder, outputFolder, extractDNASeq=False,
+                           extractProteinSeq=False, extractedFolder=None, nJobs=4, verbose=1):
+    """
+    Build the annotation table of every genome of the assembly summary dataframe (as returned by
+    `read_assemblySummary_file`), in a pool of nJobs processes.
+
+    For each genome, the compressed GBFF file is parsed directly from a streaming file handle (or, if an
+    extractedFolder is given, extracted there first), converted with `convert_genbank_to_annotation_df`
+    (optionally with DNA and protein sequences), and saved as `<outputFolder>/<assembly_accession>.parquet`
+    with the additional columns assembly_accession and organism_name (requires pyarrow or fastparquet).
+
+    Progress is checkpointed in `<outputFolder>/progress.json` after each genome, together with the options
+    extractDNASeq and extractProteinSeq. When the function is called again after an interruption, genomes
+    already done with the same options are skipped, and failed genomes (or done with other options) are redone.
+
+    Returns a dataframe indexed by assembly_accession with columns status ('done' or 'failed'), nb_rows,
+    filepath and error.
+    """
+    outputFolder = str(outputFolder)
+    os.makedirs(outputFolder, exist_ok=True)
+    if extractedFolder is not None:
+        extractedFolder = str(extractedFolder)
+        os.makedirs(extractedFolder, exist_ok=True)
+    progressFilepath = os.path.join(outputFolder, 'progress.json')
+    if os.path.exists(progressFilepath):
+        with open(progressFilepath) as f:
+            progressDict = json.load(f)
+    else:
+        progressDict = {}
+
+    def get_output_filepath(genomeAccession):
+        return os.path.join(outputFolder, genomeAccession + '.parquet')
+
+    def save_progress():
+        with open(progressFilepath + '.tmp', 'w') as f:
+            json.dump(progressDict, f, indent=1)
+        os.replace(progressFilepath + '.tmp', progressFilepath)
+
+    kwargs = {'extractDNASeq':extractDNASeq, 'extractProteinSeq':extractProteinSeq}
+    taskList = []
+    for genomeAccession, genome in assemblySummaryRepDf.iterrows():
+        progress = progressDict.get(genomeAccession)
+        if (progress is not None and progress['status'] == 'done' and progress.get('options') == kwargs and
+                os.path.exists(get_output_filepath(genomeAccession))):
+            continue
+        taskList.append((genomeAccession, genome['organism_name'], genome['compressedGenomeFilename'],
+                         str(compressedFolder), extractedFolder,
+                         get_output_filepath(genomeAccession), kwargs))
+    if verbose >= 1:
+        print("Nb of genomes:", len(assemblySummaryRepDf), "already done:", len(assemblySummaryRepDf) - len(taskList))
+
+    def update_progress(result):
+        genomeAccession, nRows, error = result
+        if error is None:
+            progressDict[genomeAccession] = {'status':'done', 'nb_rows':nRows, 'options':kwargs}
+        else:
+            progressDict[genomeAccession] = {'status':'failed', 'error':error}
+            if verbose >= 1: print("ERROR: genome", genomeAccession, error)
+        save_progress()
+        if verbose >= 2: print("Processed genome", genomeAccession)
+
+    if nJobs == 1:
+        for task in taskList:
+            update_progress(_process_refseq_genome_worker(task))
+    else:
+        with ProcessPoolExecutor(max_workers=nJobs) as executor:
+            futureList = [executor.submit(_process_refseq_genome_worker, task) for task in taskList]
+            for future in as_completed(futureList):
+                update_progress(future.result())
+
+    resultList = []
+    for genomeAccession in assemblySummaryRepDf.index:
+        progress = progressDict.get(genomeAccession, {'status':None})
+        resultList.append({'assembly_accession':genomeAccession,
+                           'status':progress['status'],
+                           'nb_rows':progress.get('nb_rows'),
+                           'filepath':get_output_filepath(genomeAccession) if progress['status'] == 'done' else None,
+                           'error':progress.get('error')})
+    resultDf = pd.DataFrame(resultList, columns=['assembly_accession', 'status', 'nb_rows', 'filepath', 'error'])
+    if verbose >= 1:
+        print("Nb of genomes done:", sum(resultDf['status'] == 'done'), "failed:", sum(resultDf['status'] == 'failed'))
+    return resultDf.set_index('assembly_accession')
+
+
+_refCodonTableDict = {}
+
+
 def build_refCodonTable(codonTableBio):
+    """
+    Build the reference codon table (as dataframe) of a Biopython codon table, with the codons grouped by
+    amino acid. Tables are cached by codon table id, and a copy of the cached table is returned.
+    """
+
+    if codonTableBio.id is not None and codonTableBio.id in _refCodonTableDict:
+        return _refCodonTableDict[codonTableBio.id].copy()
 
     # Group amino acids by physicochemical properties
     # Note: we drop the Selenocysteine U (very rare amino acid)
     aaTable = ['R', 'K', 'H', 'D', 'E', 'S', 'T', 'N', 'Q', 'C', 'G', 'P', 'A', 'I', 'L', 'M', 'F', 'W', 'Y', 'V']
 
-    # Build the reference codon table (as dataframe) using the codon table from the genome file
-    refCodonTableDf = pd.DataFrame(index=range(64), columns=['codon','aa','i','j','alphabetical_sorted_index','aa_groups_sorted_index'])
-    letters = ["T","C","A","G"]
-    i, j = 0, 0
-    k = 0
-    for k2, c2 in enumerate(letters):
-        for k1, c1 in enumerate(letters):
-            for k3, c3 in enumerate(letters):
-                i = 4*k1 + k3 + 1
-                j = 2*k2 + 1
-                codon = c1 + c2 + c3
-                refCodonTableDf.loc[k, 'alphabetical_sorted_index'] = k
-                refCodonTableDf.loc[k, 'codon'] = codon
-                refCodonTableDf.loc[k, 'i'] = i
-                refCodonTableDf.loc[k, 'j'] = j
-
-                # Add the amino acid
-                # Here we follow the rules defined in the codon table from the Biopython genome object
-                if codon in codonTableBio.stop_codons:
-                    refCodonTableDf.loc[k, 'aa'] = "*"
-                else:
-                    try:
-                        amino = codonTableBio.forward_table[codon]
-                    except KeyError:
-                        amino = "?"
-                    except TranslationError:
-                        amino = "?"
-                    # if codon in codonTableBio.start_codons:
-                    #     amino += "(s)"
-                    refCodonTableDf.loc[k, 'aa'] = amino
-                k += 1
-
+    # Codons in the order of the usual codon table representation: second letter, then first letter, then third letter
+    letters = np.array(["T", "C", "A", "G"], dtype=object)
+    k2, k1, k3 = [k.ravel() for k in np.meshgrid(range(4), range(4), range(4), indexing='ij')]
+    codonList = (letters[k1] + letters[k2] + letters[k3]).tolist()
+
+    def get_amino_acid(codon):
+        # Here we follow the rules defined in the codon table from the Biopython genome object
+        if codon in codonTableBio.stop_codons:
+            return "*"
+        try:
+            return codonTableBio.forward_table[codon]
+        except (KeyError, TranslationError):
+            return "?"
+
+    refCodonTableDf = pd.DataFrame({'codon':codonList,
+                                    'aa':[get_amino_acid(codon) for codon in codonList],
+                                    'i':4*k1 + k3 + 1,
+                                    'j':2*k2 + 1,
+                                    'alphabetical_sorted_index':np.arange(64)})
     refCodonTableDf.set_index('codon', inplace=True)
 
     # Group the synonymous codons together in the same order as they appear in the codon table,
     # and sort them following the same order as the amino acid table (physico-chemical properties)
-    grp = refCodonTableDf.groupby(['aa'], sort=False)
-
-    # Sort the group list
-    # Note: because we have several versions of the same aa in the codon table (ex: I and I(s)),
-    # we have to search for matching string in the group keys
     aaTable2 = aaTable + [aa for aa in refCodonTableDf['aa'].unique() if aa not in aaTable]
-    sortedGroups = \
-        [
-            [[key, value] for key, value in grp.groups.items() if key.startswith(aa)]
-            for aa in aaTable2
-        ]
-
-    # Flatten the nested list
-    sortedGroups = [element for sublist in sortedGroups for element in sublist]
+    aaRank = refCodonTableDf['aa'].map({aa:i for i, aa in enumerate(aaTable2)}).values
+    refCodonTableDf = refCodonTableDf.iloc[np.lexsort((refCodonTableDf['alphabetical_sorted_index'].values, aaRank))].copy()
 
-    # Sort the codon table by reassembling groups in the correct order
-    refCodonTableDf = pd.concat([grp.get_group(group[0]) for group in sortedGroups])
-
-    refCodonTableDf['aa_groups_sorted_index'] = refCodonTableDf.index.map(lambda codon: refCodonTableDf.index.get_loc(codon))
+    refCodonTableDf['aa_groups_sorted_index'] = np.arange(64)
+    if codonTableBio.id is not None:
+        _refCodonTableDict[codonTableBio.id] = refCodonTableDf.copy()
     return refCodonTableDf
 
 
 def sort_codon_index(df, refCodonTableDf, addAminoAcidLetterToIndex=True, addAminoAcidLetterAsColumn=False,
                      addEmptyRowBetweenGroups=False, addEmptyRowBetweenGroupsFillValue=np.nan, useULetter=True):
-    """Sort the codon index of the dataframe and group them by amino acid."""
+    """Sort the codon index of the dataframe and group them by amino acid.
+
+    The rows are reordered with a single positional take following the codon order of the reference
+    codon table, and the index labels are built column-wise. The input dataframe is not modified.
+    """
     
-    aaTable = refCodonTableDf.sort_values('aa_groups_sorted_index')['aa'].unique()
     # Sort codons following order defined in the reference codon table, grouping synomymous codons
-    sort_order = {codon:i for i, codon in
-                  enumerate(refCodonTableDf.sort_values(['aa_groups_sorted_index', 'alphabetical_sorted_index']).index)}
-    if len(df.index.unique().difference(refCodonTableDf.index)) > 0:
+    codonOrder = refCodonTableDf.sort_values(['aa_groups_sorted_index', 'alphabetical_sorted_index']).index
+    codonIndex = df.index.get_level_values(0)
+    if len(codonIndex.unique().difference(refCodonTableDf.index)) > 0:
         raise ValueError("DataFrame index contains a codon not found in the reference codon table index.")
-    
-    plotDf = df
-    plotDf['sort_index'] = plotDf.index.get_level_values(0).map(lambda x: sort_order.get(x))
-    plotDf = plotDf.sort_values('sort_index').drop('sort_index', axis=1)
+
+    plotDf = df.iloc[np.argsort(codonOrder.get_indexer(codonIndex), kind='stable')].copy()
     plotDf.index.name = 'codon'
     
-    aaDict = refCodonTableDf['aa'].to_dict()
-    plotDf['aa'] = plotDf.index.map(lambda x: aaDict[x])
+    codonIndex = plotDf.index.get_level_values(0)
+    aaArr = refCodonTableDf['aa'].reindex(codonIndex).values
+    plotDf['aa'] = aaArr
+    labelArr = np.array(codonIndex, dtype=object)
     if useULetter:
-        plotDf
+        labelArr = np.array([re.sub('T', 'U', codon) for codon in labelArr], dtype=object)
     if addAminoAcidLetterToIndex:
-        plotDf.index = plotDf.index.map(lambda x: '{}/{}'.format(refCodonTableDf.loc[x, 'aa'], x))
-    if useULetter:
-        plotDf.index = plotDf.index.map(lambda x: x[:-3] + re.sub('T', 'U', x[-3:]))
+        labelArr = aaArr.astype(object) + '/' + labelArr
+    if addAminoAcidLetterToIndex or useULetter:
+        plotDf.index = pd.Index(labelArr, name='codon')
     if addEmptyRowBetweenGroups:
-        dfDict = {}
-        for aa, group in plotDf.groupby('aa'):
-            df = group.copy().append(pd.Series(addEmptyRowBetweenGroupsFillValue, index=group.columns, name=''))
-            dfDict[aa] = df
-        plotDf = pd.concat([dfDict[aa] for aa in aaTable if aa in dfDict.keys()])
+        # Groups are contiguous after sorting, we add an empty row after each group
+        groupEndList = list(np.flatnonzero(aaArr[1:] != aaArr[:-1]) + 1) + [len(plotDf)]
+        emptyRowDf = pd.DataFrame(addEmptyRowBetweenGroupsFillValue, index=[''], columns=plotDf.columns)
+        dfList = []
+        groupStart = 0
+        for groupEnd in groupEndList:
+            dfList += [plotDf.iloc[groupStart:groupEnd], emptyRowDf]
+            groupStart = groupEnd
+        plotDf = pd.concat(dfList)
     if not addAminoAcidLetterAsColumn:
         plotDf = plotDf.drop('aa', axis=1)
 
@@ -899,6 +2142,8 @@ def sort_codon_index(df, refCodonTableDf, addAminoAcidLetterToIndex=True, addAmi
 
 
 def find_triplet_in_sequence_in_frames(seq, triplet):
+    if isinstance(seq, PackedSequence):
+        seq = str(seq)
     tripletMatch = []
     for frame in [0,1,2]:
         codonList = list(extract_codons_list(seq, frame=frame, frameFromEnd=True))
@@ -914,6 +2159,59 @@ def find_triplet_in_sequence_in_frames(seq, triplet):
     return tripletMatch
 
 
+def find_triplets_in_sequences(seqS, tripletList):
+    """
+    Batch version of `find_triplet_in_sequence_in_frames`, searching one or several triplets in the three
+    frames of many sequences at once.
+
+    All sequences are encoded into a single array (each followed by an N, such that no triplet overlaps two
+    sequences), and the codon index of the triplet starting at every position is computed through a
+    stride-1 view (see `triplet_index_array`). As in `find_triplet_in_sequence_in_frames`, frames are
+    counted from the end of the sequence, frame 0 being the frame of the last complete codon.
+
+    seqS: pandas Series of sequences (strings, Biopython Seq or SeqRecord, or PackedSequence, or list),
+    whose index is used as sequence id.
+    tripletList: triplet or list of triplets (case insensitive, U is read as T).
+
+    Returns a dataframe with columns seq_id, triplet, frame, codon_pos (index of the codon in the frame)
+    and nucleotide_pos (0-based position in the sequence), ordered by sequence and position.
+    """
+    if type(seqS) is not pd.Series:
+        seqS = pd.Series(seqS)
+    if isinstance(tripletList, str):
+        tripletList = [tripletList]
+    tripletList = list(dict.fromkeys(tripletList))
+
+    isTripletLUT = np.zeros(65, dtype=bool)
+    tripletArr = np.empty(65, dtype=object)
+    for triplet in tripletList:
+        tripletCodes = encode_dna_seq(triplet)
+        if len(tripletCodes) != 3 or (tripletCodes > 3).any():
+            raise ValueError("Invalid triplet: {}.".format(triplet))
+        codonIdx = 16*int(tripletCodes[0]) + 4*int(tripletCodes[1]) + int(tripletCodes[2])
+        isTripletLUT[codonIdx] = True
+        tripletArr[codonIdx] = triplet
+
+    codesList = [_get_dna_codes(seq) for seq in seqS]
+    seqLength = np.array([len(codes) for codes in codesList], dtype=np.int64)
+    seqOffset = np.concatenate([[0], np.cumsum(seqLength + 1)[:-1]]).astype(np.int64)
+
+    allCodes = np.full(int(np.sum(seqLength + 1)), 4, dtype=np.uint8)
+    for codes, offset in zip(codesList, seqOffset):
+        allCodes[offset:offset + len(codes)] = codes
+    tripletIdx = triplet_index_array(allCodes)
+    matchPos = np.flatnonzero(isTripletLUT[tripletIdx])
+    seqIdx = np.searchsorted(seqOffset, matchPos, side='right') - 1
+    nucleotidePos = matchPos - seqOffset[seqIdx]
+
+    return pd.DataFrame({'seq_id':seqS.index.values[seqIdx],
+                         'triplet':tripletArr[tripletIdx[matchPos]],
+                         'frame':(nucleotidePos - seqLength[seqIdx]) % 3,
+                         'codon_pos':nucleotidePos // 3,
+                         'nucleotide_pos':nucleotidePos},
+                        columns=['seq_id', 'triplet', 'frame', 'codon_pos', 'nucleotide_pos'])
+
+
 def convert_BED_coverage_dataframe(path=None, basename=None, file_plus_strand=None, file_minus_strand=None, verbose=1):
 
     if file_plus_strand is None:
@@ -950,6 +2248,74 @@ def convert_BED_coverage_dataframe(path=None, basename=None, file_plus_strand=No
     return covDf
 
 
+def _read_BED_coverage_file(filepath, dtype=np.float32):
+    """Read the position and coverage columns of a BED coverage file (ref, position, coverage) as numpy arrays."""
+    covDf = pd.read_csv(filepath, sep='\t', header=None, names=['ref', 'position', 'coverage'],
+                        usecols=['position', 'coverage'], dtype={'position':np.int64, 'coverage':dtype})
+    return covDf['position'].values, covDf['coverage'].values
+
+
+def load_BED_coverage_arrays(path=None, basename=None, file_plus_strand=None, file_minus_strand=None,
+                             dtype=np.float32, cache=True, mmap_mode='r', verbose=1):
+    """
+    Load the plus and minus strand coverage files of `convert_BED_coverage_dataframe` into a dense numpy
+    array of shape (2, genome length) indexed by 0-based position, with the plus strand coverage in row 0
+    and the minus strand coverage in row 1. Positions missing from the files have 0 coverage.
+
+    If cache, the array is saved as a `<basename>.coverage.<key>.<dtype>.npy` file beside the BED files on
+    first load, where key is a hash of the paths of both BED files. Later loads read the cache directly,
+    memory-mapped with `mmap_mode` (see numpy.load, None to load in memory), as long as it is more recent
+    than both BED files.
+    """
+
+    if file_plus_strand is None:
+        file_plus_strand = Path(path) / (basename + '.strandp_coverage.bed')
+    if file_minus_strand is None:
+        file_minus_strand = Path(path) / (basename + '.strandm_coverage.bed')
+
+    # Both BED files and the dtype are part of the cache file name, such that loads with another minus strand
+    # file or dtype do not share a cache
+    cacheKey = hashlib.sha1('\n'.join([os.path.abspath(str(file_plus_strand)),
+                                       os.path.abspath(str(file_minus_strand))]).encode()).hexdigest()[:12]
+    cacheFilepath = re.sub(r'(\.strandp_coverage)?\.bed$', '', str(file_plus_strand)) + \
+        '.coverage.{}.{}.npy'.format(cacheKey, np.dtype(dtype).name)
+    if cache and os.path.exists(cacheFilepath):
+        bedMTime = max(os.path.getmtime(str(file_plus_strand)), os.path.getmtime(str(file_minus_strand)))
+        if os.path.getmtime(cacheFilepath) >= bedMTime:
+            if verbose >= 2: print("Loading coverage from cache", cacheFilepath)
+            return np.load(cacheFilepath, mmap_mode=mmap_mode)
+
+    position_p, coverage_p = _read_BED_coverage_file(file_plus_strand, dtype=dtype)
+    position_m, coverage_m = _read_BED_coverage_file(file_minus_strand, dtype=dtype)
+
+    # Check if the genome coverage file is 0-based or 1-based
+    positionMin = min(position_p.min(), position_m.min())
+    if positionMin == 1:
+        if verbose >= 1: print("BED coverage file uses 1-based index. Converting to 0-based.")
+        position_p, position_m = position_p - 1, position_m - 1
+    elif positionMin == 0:
+        if verbose >= 1: print("BED coverage file uses 0-based index.")
+
+    covArr = np.zeros((2, max(position_p.max(), position_m.max()) + 1), dtype=dtype)
+    covArr[0, position_p] = coverage_p
+    covArr[1, position_m] = coverage_m
+    if verbose >= 1: print("Genome length:", covArr.shape[1])
+
+    if cache:
+        # Write to a temporary file first, such that an interrupted write never leaves a truncated cache file
+        tmpFilepath = '{}.{}.tmp'.format(cacheFilepath, os.getpid())
+        try:
+            with open(tmpFilepath, 'wb') as f:
+                np.save(f, covArr)
+            os.replace(tmpFilepath, cacheFilepath)
+        finally:
+            if os.path.exists(tmpFilepath):
+                os.remove(tmpFilepath)
+        if mmap_mode is not None:
+            return np.load(cacheFilepath, mmap_mode=mmap_mode)
+    return covArr
+
+
 def import_roesti_coverage_df(sampleDf, path=None,
                               covStrandPlusSuffix='.strandp_coverage.bed', covStrandMinusSuffix='.strandm_coverage.bed',
                               verbose=1):
@@ -1001,6 +2367,232 @@ def import_roesti_coverage_df(sampleDf, path=None,
     return rnaCovDf
 
 
+def _get_roesti_sample_path_and_name(sample, path=None):
+    """Return the folder and the file prefix of a sample of the sample dataframe."""
+    if path is None:
+        pathCol = "rna_processed_path"
+        if pathCol not in sample.index:
+            pathCol = "path"
+        path1 = Path(sample[pathCol])
+    else:
+        path1 = Path(str(path))
+
+    sampleNameCol = "rna_sample_name"
+    if sampleNameCol not in sample.index:
+        sampleNameCol = "sample_filename_prefix"
+    return path1, sample[sampleNameCol]
+
+
+def _load_coverage_sample_worker(args):
+    """
+    Load the coverage arrays of one sample, either cached beside its BED files or saved in the temporary
+    sample file, returns the genome length and reference name.
+    """
+    file_plus_strand, file_minus_strand, dtype, cacheSamples, sampleFilepath = args
+    covArr = load_BED_coverage_arrays(file_plus_strand=file_plus_strand, file_minus_strand=file_minus_strand,
+                                      dtype=dtype, cache=cacheSamples, verbose=0)
+    if not cacheSamples:
+        with open(sampleFilepath, 'wb') as f:
+            np.save(f, covArr)
+    with open(str(file_plus_strand)) as f:
+        ref = f.readline().split('\t')[0]
+    return covArr.shape[1], ref
+
+
+def _copy_coverage_sample_worker(args):
+    """Copy the loaded coverage arrays of one sample into its row of the coverage store."""
+    storeFilepath, iSample, file_plus_strand, file_minus_strand, dtype, cacheSamples, sampleFilepath = args
+    if cacheSamples:
+        covArr = load_BED_coverage_arrays(file_plus_strand=file_plus_strand, file_minus_strand=file_minus_strand,
+                                          dtype=dtype, cache=True, verbose=0)
+    else:
+        covArr = np.load(sampleFilepath, mmap_mode='r')
+    storeArr = np.load(storeFilepath, mmap_mode='r+')
+    storeArr[iSample, :, :covArr.shape[1]] = covArr
+    storeArr.flush()
+    return iSample
+
+
+class CoverageStore(object):
+    """
+    Strand-specific coverage of many samples in one array of shape (samples, 2, positions), with the
+    plus and minus strand coverage of each sample in strand rows 0 and 1, indexed by 0-based position.
+    The array is memory-mapped from the `<storePath>.npy` file, and the sample table (sample, replicate,
+    ref) is saved in `<storePath>.samples.csv`.
+
+    Build it from RNA-seq BED coverage files with `import_roesti_coverage_store`, and reopen it with
+    `CoverageStore.load(storePath)`.
+    """
+
+    def __init__(self, coverage, sampleDf):
+        self.coverage = coverage
+        self.sampleDf = sampleDf
+
+    @classmethod
+    def load(cls, storePath, mmap_mode='r'):
+        coverage = np.load(str(storePath) + '.npy', mmap_mode=mmap_mode)
+        sampleDf = pd.read_csv(str(storePath) + '.samples.csv')
+        return cls(coverage, sampleDf)
+
+    def __len__(self):
+        return len(self.sampleDf)
+
+    def get_sample_coverage(self, sample, replicate):
+        """Return the coverage array (2, positions) of one sample."""
+        iSample = np.flatnonzero((self.sampleDf['sample'] == sample) & (self.sampleDf['replicate'] == replicate))
+        if len(iSample) != 1:
+            raise ValueError("sample {} replicate {} not found in the coverage store.".format(sample, replicate))
+        return self.coverage[iSample[0]]
+
+    def to_dataframe(self):
+        """
+        Return the coverage as the dataframe of `import_roesti_coverage_df`: index (ref, position), and
+        columns (sample, replicate, coverage) with coverage_plus and coverage_minus for each sample.
+        Note that this copies the whole store in memory, and that positions without coverage are 0.
+        """
+        nSample, nStrand, nPosition = self.coverage.shape
+        index = pd.MultiIndex.from_arrays([np.repeat(self.sampleDf['ref'].iloc[0], nPosition), np.arange(nPosition)],
+                                          names=['ref', 'position'])
+        columns = pd.MultiIndex.from_arrays([np.repeat(self.sampleDf['sample'].values, 2),
+                                             np.repeat(self.sampleDf['replicate'].values, 2),
+                                             ['coverage_plus', 'coverage_minus']*nSample],
+                                            names=['sample', 'replicate', 'coverage'])
+        return pd.DataFrame(np.asarray(self.coverage).reshape(nSample*nStrand, nPosition).T,
+                            index=index, columns=columns)
+
+
+def import_roesti_coverage_store(sampleDf, storePath, path=None,
+                                 covStrandPlusSuffix='.strandp_coverage.bed',
+                                 covStrandMinusSuffix='.strandm_coverage.bed',
+                                 dtype=np.float32, nJobs=1, cacheSamples=False, verbose=1):
+    """
+    Import the strand-specific coverage of all the samples of the sample dataframe into a `CoverageStore`,
+    a memory-mapped array (samples, 2, positions) saved as `<storePath>.npy`. This replaces the merged
+    dataframe of `import_roesti_coverage_df`, which is still available with `CoverageStore.to_dataframe`.
+
+    Samples are loaded concurrently in a pool of nJobs processes with `load_BED_coverage_arrays`, saved in
+    temporary files beside the store, then copied into their row of the store. If cacheSamples, the coverage
+    of each sample is instead cached beside its BED files (see `load_BED_coverage_arrays`), to be reused
+    by later loads.
+    We assume that the coverage files of all samples are for a single reference sequence.
+    """
+
+    if verbose >= 2: print("sampleDf columns:", sampleDf.columns.tolist())
+    fileList = []
+    for i, sample in sampleDf.iterrows():
+        path1, sampleName = _get_roesti_sample_path_and_name(sample, path)
+        fileList.append((path1 / (sampleName + covStrandPlusSuffix), path1 / (sampleName + covStrandMinusSuffix)))
+
+    storeFilepath = str(storePath) + '.npy'
+    sampleFilepathList = ['{}.sample{}.tmp.npy'.format(storePath, iSample) for iSample in range(len(fileList))]
+    loadTaskList = [(file_plus_strand, file_minus_strand, dtype, cacheSamples, sampleFilepath)
+                    for (file_plus_strand, file_minus_strand), sampleFilepath in zip(fileList, sampleFilepathList)]
+    copyTaskList = [(storeFilepath, iSample) + loadTask for iSample, loadTask in enumerate(loadTaskList)]
+
+    executor = ProcessPoolExecutor(max_workers=nJobs) if nJobs > 1 else None
+    mapFunction = executor.map if executor is not None else map
+    try:
+        lengthRefList = list(mapFunction(_load_coverage_sample_worker, loadTaskList))
+        nPosition = max([length for length, ref in lengthRefList])
+        if verbose >= 1: print("Nb of samples:", len(fileList), "genome length:", nPosition)
+
+        storeArr = np.lib.format.open_memmap(storeFilepath, mode='w+', dtype=dtype, shape=(len(fileList), 2, nPosition))
+        del storeArr
+        for iSample in mapFunction(_copy_coverage_sample_worker, copyTaskList):
+            if verbose >= 2: print("Copied sample", iSample)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for sampleFilepath in sampleFilepathList:
+            if os.path.exists(sampleFilepath):
+                os.remove(sampleFilepath)
+
+    storeSampleDf = pd.DataFrame({'sample':sampleDf['sample'].values, 'replicate':sampleDf['replicate'].values,
+                                  'ref':[ref for length, ref in lengthRefList]})
+    storeSampleDf.to_csv(str(storePath) + '.samples.csv', index=False)
+    return CoverageStore.load(storePath)
+
+
+class CoverageIntervalQuery(object):
+    """
+    Total and mean coverage over batches of intervals, each computed in O(1) from the cumulative sums of the
+    coverage along the genome, precomputed once per sample and strand.
+
+    coverage: coverage array (2, positions) as returned by `load_BED_coverage_arrays`, a `CoverageStore`
+    (or its array (samples, 2, positions)), or the coverage dataframe of `convert_BED_coverage_dataframe`
+    (columns position, coverage_p, coverage_m).
+
+    Note that the cumulative sums are stored as float64, i.e. 8 bytes per sample, strand and position.
+
+    Example:
+    covQuery = CoverageIntervalQuery(load_BED_coverage_arrays(path, basename))
+    covQuery.query_annotation_df(annotDf, stat='mean')
+    """
+
+    def __init__(self, coverage):
+        self.sampleDf = None
+        if isinstance(coverage, CoverageStore):
+            self.sampleDf = coverage.sampleDf
+            coverage = coverage.coverage
+        elif isinstance(coverage, pd.DataFrame):
+            position = coverage['position'].values.astype(np.int64)
+            covArr = np.zeros((2, position.max() + 1))
+            covArr[0, position] = coverage['coverage_p'].values
+            covArr[1, position] = coverage['coverage_m'].values
+            coverage = covArr
+        coverage = np.asarray(coverage)
+        if coverage.ndim == 2:
+            coverage = coverage[np.newaxis]
+
+        nSample, nStrand, nPosition = coverage.shape
+        self.nPosition = nPosition
+        self._cumsum = np.zeros((nSample, nStrand, nPosition + 1), dtype=np.float64)
+        np.cumsum(coverage, axis=-1, out=self._cumsum[:, :, 1:])
+
+    def query(self, start, end, strand=None):
+        """
+        Total coverage over intervals (0-based start-inclusive end-exclusive), clipped to the genome.
+        strand: array of '+' or '-' per interval; intervals with another strand value (or strand None) get the
+        sum of both strands. Returns an array (samples, intervals).
+        """
+        start = np.clip(np.asarray(start, dtype=np.int64), 0, self.nPosition)
+        end = np.clip(np.asarray(end, dtype=np.int64), 0, self.nPosition)
+        totalPlus = self._cumsum[:, 0, end] - self._cumsum[:, 0, start]
+        totalMinus = self._cumsum[:, 1, end] - self._cumsum[:, 1, start]
+        if strand is None:
+            return totalPlus + totalMinus
+        strand = np.asarray(strand, dtype=object)
+        return np.where(strand == '+', totalPlus, np.where(strand == '-', totalMinus, totalPlus + totalMinus))
+
+    def query_annotation_df(self, annotDf, stat='mean', startCol='start', endCol='end', strandCol='strand',
+                            strand_specific=True):
+        """
+        Coverage statistic ('sum' or 'mean') over each annotation of the dataframe (0-based start-inclusive
+        end-exclusive), on the annotation strand if strand_specific and on both strands otherwise.
+        Annotations with missing coordinates get NaN.
+
+        Returns a dataframe with the index of the annotation dataframe, and one column per sample
+        (sample, replicate) for a coverage store, or a single column 'coverage_sum' or 'coverage_mean'.
+        """
+        if stat not in ['sum', 'mean']:
+            raise ValueError("stat should be 'sum' or 'mean'.")
+        start, end, isMissing = _get_coordinate_arrays(annotDf, startCol, endCol)
+        strand = annotDf[strandCol].values if strand_specific else None
+        covArr = self.query(start, end, strand)
+        if stat == 'mean':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                covArr = covArr / (np.clip(end, 0, self.nPosition) - np.clip(start, 0, self.nPosition))
+        covArr[:, isMissing] = np.nan
+
+        if self.sampleDf is not None:
+            columns = pd.MultiIndex.from_frame(self.sampleDf[['sample', 'replicate']])
+        elif covArr.shape[0] == 1:
+            columns = ['coverage_' + stat]
+        else:
+            columns = None
+        return pd.DataFrame(covArr.T, index=annotDf.index, columns=columns)
+
+
 def import_roesti_expression_df(sampleDf, path=None, verbose=1):
 
     dfList = []
@@ -1042,6 +2634,83 @@ def import_roesti_expression_df(sampleDf, path=None, verbose=1):
     return rnaDf
 
 
+def _read_roesti_expression_file(args):
+    filepath, sampleName, replicate = args
+    df = pd.read_csv(filepath, index_col=0, dtype={'ref':str, 'id':str, 'strand':str})
+    df['sample'] = sampleName
+    df['replicate'] = replicate
+    return df
+
+
+def import_roesti_expression_df_cached(sampleDf, path=None, cacheFilepath=None, nThreads=8, verbose=1):
+    """
+    Same as `import_roesti_expression_df`, but the `<sample>.CDS_values.csv` files are read concurrently
+    in a pool of nThreads threads, and the combined table uses compact dtypes: categorical sample, ref,
+    id and strand columns, and float32 values. Coordinate columns (start_*, end_*) are kept exact, as
+    nullable Int64 if they contain missing values.
+
+    If a cacheFilepath is given, the combined table is saved there in parquet format (requires pyarrow
+    or fastparquet), together with the modification times of the source files, the sample and replicate
+    labels and the dtypes in `<cacheFilepath>.json`. Later calls read the parquet file directly, as long
+    as all of these are unchanged.
+    """
+
+    taskList = []
+    for i, sample in sampleDf.iterrows():
+        if path is None:
+            pathCol = "path" if "path" in sample.index else "rna_processed_path"
+            path1 = Path(sample[pathCol])
+        else:
+            path1 = Path(str(path))
+        sampleNameCol = "sample_filename_prefix" if "sample_filename_prefix" in sample.index else "rna_sample_name"
+        taskList.append((str(path1 / (sample[sampleNameCol] + '.CDS_values.csv')), sample['sample'], sample['replicate']))
+
+    categoryColList = ['sample', 'ref', 'id', 'strand']
+    floatDtype = np.float32
+    # The cache is valid for the same source files (and modification times), sample labels and dtypes.
+    # The key goes through json such that it compares equal to the key read from the sidecar file.
+    cacheKeyDict = {'files':{filepath:os.path.getmtime(filepath) for filepath, _, _ in taskList},
+                    'samples':[list(task) for task in taskList],
+                    'dtypes':{'category':categoryColList, 'float':np.dtype(floatDtype).name, 'coordinate':'Int64'}}
+    cacheKeyDict = json.loads(json.dumps(cacheKeyDict, default=str))
+    if cacheFilepath is not None and os.path.exists(str(cacheFilepath)) and os.path.exists(str(cacheFilepath) + '.json'):
+        with open(str(cacheFilepath) + '.json') as f:
+            cachedKeyDict = json.load(f)
+        if cachedKeyDict == cacheKeyDict:
+            if verbose >= 1: print("Loading expression table from cache", cacheFilepath)
+            return pd.read_parquet(str(cacheFilepath))
+
+    with ThreadPoolExecutor(max_workers=nThreads) as executor:
+        dfList = list(executor.map(_read_roesti_expression_file, taskList))
+
+    rnaDf = pd.concat(dfList, sort=True)
+    # reorder the columns to make it nicer ;)
+    cols = rnaDf.columns
+    startCol = [c for c in cols if 'start_' in c][0]
+    endCol = [c for c in cols if 'end_' in c][0]
+    firstcols = ['sample', 'replicate', 'ref', 'id', 'strand', startCol, endCol]
+    cols = firstcols + [c for c in cols if not c in firstcols]
+    rnaDf = rnaDf[cols]
+
+    for col in categoryColList:
+        rnaDf[col] = rnaDf[col].astype('category')
+    # float32 only holds integers exactly up to 2^24, coordinates made float by missing values are converted back
+    # to (nullable) integers instead
+    coordColList = [col for col in rnaDf.columns if re.search(r'(start|end)_', col)]
+    for col in coordColList:
+        if rnaDf[col].dtype == np.float64 and (rnaDf[col].dropna() % 1 == 0).all():
+            rnaDf[col] = rnaDf[col].astype('Int64')
+    floatColList = [col for col in rnaDf.columns if rnaDf[col].dtype == np.float64 and col not in coordColList]
+    rnaDf[floatColList] = rnaDf[floatColList].astype(floatDtype)
+    if verbose >= 1: print("Nb of samples:", len(taskList), "nb of rows:", len(rnaDf))
+
+    if cacheFilepath is not None:
+        rnaDf.to_parquet(str(cacheFilepath))
+        with open(str(cacheFilepath) + '.json', 'w') as f:
+            json.dump(cacheKeyDict, f)
+    return rnaDf
+
+
 def overlap_1D(start1, end1, start2, end2):
     return max(0, min(end1, end2) - max(start1, start2))
 
@@ -1081,6 +2750,8 @@ def find_annotations_in_region(annotDf, region_start, region_end, region_strand=
     Note: we use a very naive implementation which is slow.
     For faster algorithm, we could use the implementation of BEDtools, but we would have
     to create BED files first. For small annotation dataframe this is fast enough though.
+    When querying many regions against the same annotation, build an `AnnotationIndex` once
+    and use its `query` method instead.
     
     start and end should be 0-based inclusive-exclusive (biopython)
     """
@@ -1099,3 +2770,257 @@ def find_annotations_in_region(annotDf, region_start, region_end, region_strand=
                                  startCol=startCol, endCol=endCol, strandCol=strandCol, strand_specific=strand_specific)
         overlapList.append({'id':annotId, 'overlap_type':annot_location, 'overlap_length':overlap, 'strand':strand})
     return overlapList
+
+
+def _classify_overlap(overlap, annotLength, regionLength):
+    """Vectorized version of the overlap classification of `annot_region_overlap`."""
+    overlap = np.asarray(overlap)
+    conditions = [overlap == 0, overlap < annotLength, overlap == annotLength, overlap == regionLength]
+    choices = np.array(['no_overlap', 'partial', 'inside', 'full'], dtype=object)
+    return np.select(conditions, choices, default=None)
+
+
+def _build_nclist(starts, ends):
+    """
+    Build a nested containment list from arrays of interval starts and ends.
+
+    Returns the node order (indices into the input arrays) in which every sublist is stored
+    contiguously, the sublist id of the children of each node (-1 if none), and the
+    start and end position of each sublist in the node order. Sublist 0 is the top-level list.
+    """
+    order = np.lexsort((-ends, starts))
+    parent = np.full(len(starts), -1, dtype=np.int64)
+    stack = []
+    for i in order:
+        # Intervals are sorted by start, i is contained in the top of the stack if it ends before it
+        while stack and ends[stack[-1]] < ends[i]:
+            stack.pop()
+        parent[i] = stack[-1] if stack else -1
+        stack.append(i)
+
+    childrenDict = defaultdict(list)
+    for i in order:
+        childrenDict[parent[i]].append(i)
+
+    nodeList = []
+    listStart, listEnd = [], []
+    sublistDict = {}
+    queue = deque([-1])
+    while queue:
+        node = queue.popleft()
+        children = childrenDict.get(node, [])
+        sublistDict[node] = len(listStart)
+        listStart.append(len(nodeList))
+        nodeList.extend(children)
+        listEnd.append(len(nodeList))
+        queue.extend(child for child in children if child in childrenDict)
+
+    nodeOrder = np.array(nodeList, dtype=np.int64)
+    nodeSublist = np.array([sublistDict.get(node, -1) for node in nodeList], dtype=np.int64)
+    return nodeOrder, nodeSublist, np.array(listStart, dtype=np.int64), np.array(listEnd, dtype=np.int64)
+
+
+class AnnotationIndex(object):
+    """
+    Strand-aware overlap index of an annotation dataframe, built once and queried many times.
+
+    The annotations of each (chromosome, strand) group are stored as a nested containment list
+    (NCList) [1]: intervals are sorted by start and the intervals contained in another interval are
+    moved to the sublist of their container. In each sublist both starts and ends are sorted,
+    such that the first overlapping annotation is found by binary search and a query costs
+    O(log n + k) for k overlapping annotations, instead of the linear scan of
+    `find_annotations_in_region`.
+
+    start and end should be 0-based inclusive-exclusive (biopython). Annotations with missing
+    coordinates are not indexed.
+
+    [1] Alekseyenko, A. V., & Lee, C. J. (2007). Nested Containment List (NCList): a new algorithm for
+    accelerating interval query of genome alignment and interval databases. Bioinformatics, 23(11), 1386–1393.
+    http://doi.org/10.1093/bioinformatics/btl647
+
+    Example:
+    annotIndex = AnnotationIndex(annotDf)
+    annotIndex.query(1000, 2000, region_strand='+')
+    """
+
+    def __init__(self, annotDf, startCol='start', endCol='end', strandCol='strand', chromosomeCol=None):
+        self.startCol = startCol
+        self.endCol = endCol
+        self.strandCol = strandCol
+        self.chromosomeCol = chromosomeCol
+
+        df = annotDf[annotDf[startCol].notnull() & annotDf[endCol].notnull()]
+        self._ids = df.index.values
+        self._starts = df[startCol].values.astype(np.int64)
+        self._ends = df[endCol].values.astype(np.int64)
+        self._strands = df[strandCol].values
+
+        keyDf = pd.DataFrame({'chromosome':df[chromosomeCol].values if chromosomeCol is not None else '',
+                              'strand':self._strands})
+        self._groups = {}
+        for key, rowIdx in keyDf.groupby(['chromosome', 'strand'], sort=False, dropna=False).indices.items():
+            rowIdx = np.asarray(rowIdx, dtype=np.int64)
+            nodeOrder, nodeSublist, listStart, listEnd = \
+                _build_nclist(self._starts[rowIdx], self._ends[rowIdx])
+            rowIdx = rowIdx[nodeOrder]
+            self._groups[key] = {'rowIdx':rowIdx, 'starts':self._starts[rowIdx], 'ends':self._ends[rowIdx],
+                                 'sublist':nodeSublist, 'listStart':listStart, 'listEnd':listEnd}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _query_group(self, group, region_start, region_end):
+        starts, ends, sublist = group['starts'], group['ends'], group['sublist']
+        listStart, listEnd = group['listStart'], group['listEnd']
+        hitList = []
+        stack = [0]
+        while stack:
+            listId = stack.pop()
+            lo, hi = listStart[listId], listEnd[listId]
+            # First annotation of the sublist ending after the region start
+            k = lo + np.searchsorted(ends[lo:hi], region_start, side='right')
+            while k < hi and starts[k] < region_end:
+                hitList.append(k)
+                if sublist[k] >= 0:
+                    stack.append(sublist[k])
+                k += 1
+        return group['rowIdx'][hitList]
+
+    def query_index(self, region_start, region_end, region_strand=None, chromosome=None, strand_specific=True):
+        """
+        Return the row positions (in the indexed annotation dataframe, after dropping annotations
+        with missing coordinates) of the annotations overlapping the region, in annotation order.
+        """
+        if strand_specific:
+            if region_strand not in ['+', '-']:
+                raise ValueError("region_strand should be '+' or '-'")
+        if region_start >= region_end:
+            return np.array([], dtype=np.int64)
+
+        rowIdxList = [self._query_group(group, region_start, region_end)
+                      for (chrom, strand), group in self._groups.items()
+                      if (chromosome is None or self.chromosomeCol is None or chrom == chromosome) and
+                         (not strand_specific or strand == region_strand)]
+        if len(rowIdxList) == 0:
+            return np.array([], dtype=np.int64)
+        rowIdx = np.sort(np.concatenate(rowIdxList))
+        # Zero-length annotations strictly inside the region do not overlap it
+        return rowIdx[np.minimum(self._ends[rowIdx], region_end) - np.maximum(self._starts[rowIdx], region_start) > 0]
+
+    def query(self, region_start, region_end, region_strand=None, chromosome=None, strand_specific=True):
+        """
+        Find the annotations overlapping a region, with the same classification as `find_annotations_in_region`.
+
+        Contrary to `find_annotations_in_region`, only overlapping annotations are returned
+        ('no_overlap' entries are omitted). If the index was built with a chromosome column and
+        chromosome is None, all chromosomes are searched.
+
+        start and end should be 0-based inclusive-exclusive (biopython)
+        """
+        if region_start == region_end:
+            return []
+        rowIdx = self.query_index(region_start, region_end, region_strand=region_strand, chromosome=chromosome,
+                                  strand_specific=strand_specific)
+        starts, ends = self._starts[rowIdx], self._ends[rowIdx]
+        overlap = np.minimum(ends, region_end) - np.maximum(starts, region_start)
+        overlapType = _classify_overlap(overlap, ends - starts, region_end - region_start)
+        return [{'id':annotId, 'overlap_type':annot_location, 'overlap_length':int(length), 'strand':strand}
+                for annotId, annot_location, length, strand
+                in zip(self._ids[rowIdx], overlapType, overlap, self._strands[rowIdx])]
+
+
+def _expand_ranges(lo, hi):
+    """For arrays of half-open ranges [lo, hi), return the range number and the value of every element in the ranges."""
+    counts = hi - lo
+    rangeIdx = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.cumsum(counts) - counts
+    values = np.arange(counts.sum()) - np.repeat(offsets - lo, counts)
+    return rangeIdx, values
+
+
+def find_annotation_overlaps(regionDf, annotDf, startCol='start', endCol='end', strandCol='strand',
+                             chromosomeCol=None, strand_specific=True):
+    """
+    Find all overlapping (region, annotation) pairs between a dataframe of regions and an annotation dataframe.
+
+    Batch equivalent of calling `find_annotations_in_region` for each region, with the same overlap classification,
+    but only the overlapping pairs are returned. Both dataframes should use the same column names, and regions
+    and annotations are only compared within the same chromosome (if chromosomeCol is given) and strand
+    (if strand_specific).
+
+    Pairs are found with a sort-and-search over numpy arrays: an annotation overlaps a region if either the annotation
+    starts inside the region, or the region starts strictly inside the annotation. Both cases are range searches
+    in a sorted array of starts, such that the cost is O((N + M) log(N + M) + k) for k overlapping pairs.
+
+    start and end should be 0-based inclusive-exclusive (biopython)
+
+    Returns a dataframe with one row per overlapping pair and columns region_id, id (annotation id),
+    overlap_type, overlap_length and strand (annotation strand), sorted by region and annotation order.
+
+    Zero-length annotations and empty regions never overlap:
+
+    >>> annotDf = pd.DataFrame({'start':[10, 12], 'end':[10, 30], 'strand':['+', '+']}, index=['a', 'b'])
+    >>> regionDf = pd.DataFrame({'start':[10], 'end':[20], 'strand':['+']}, index=['r'])
+    >>> find_annotation_overlaps(regionDf, annotDf)[['region_id', 'id', 'overlap_length']].values.tolist()
+    [['r', 'b', 8]]
+    """
+    if strand_specific:
+        if not regionDf[strandCol].isin(['+', '-']).all():
+            raise ValueError("region strands should be '+' or '-'")
+
+    regionDf = regionDf[regionDf[startCol].notnull() & regionDf[endCol].notnull()]
+    annotDf = annotDf[annotDf[startCol].notnull() & annotDf[endCol].notnull()]
+    regionStart = regionDf[startCol].values.astype(np.int64)
+    regionEnd = regionDf[endCol].values.astype(np.int64)
+    annotStart = annotDf[startCol].values.astype(np.int64)
+    annotEnd = annotDf[endCol].values.astype(np.int64)
+
+    def group_indices(df):
+        keyDf = pd.DataFrame({'chromosome':df[chromosomeCol].values if chromosomeCol is not None else '',
+                              'strand':df[strandCol].values if strand_specific else ''},
+                             index=range(len(df)))
+        return keyDf.groupby(['chromosome', 'strand'], sort=False, dropna=False).indices
+
+    annotGroups = group_indices(annotDf)
+    regionIdxList, annotIdxList = [], []
+    for key, regionIdx in group_indices(regionDf).items():
+        annotIdx = annotGroups.get(key)
+        if annotIdx is None:
+            continue
+
+        # Annotations starting inside the region
+        annotOrder = annotIdx[np.argsort(annotStart[annotIdx], kind='stable')]
+        annotStartSorted = annotStart[annotOrder]
+        lo = np.searchsorted(annotStartSorted, regionStart[regionIdx], side='left')
+        hi = np.maximum(np.searchsorted(annotStartSorted, regionEnd[regionIdx], side='left'), lo)
+        k, pos = _expand_ranges(lo, hi)
+        regionIdxList.append(regionIdx[k])
+        annotIdxList.append(annotOrder[pos])
+
+        # Regions starting strictly inside the annotation
+        regionOrder = regionIdx[np.argsort(regionStart[regionIdx], kind='stable')]
+        regionStartSorted = regionStart[regionOrder]
+        lo = np.searchsorted(regionStartSorted, annotStart[annotIdx], side='right')
+        # (empty for zero-length annotations, hi is clipped such that the range is not negative)
+        hi = np.maximum(np.searchsorted(regionStartSorted, annotEnd[annotIdx], side='left'), lo)
+        k, pos = _expand_ranges(lo, hi)
+        regionIdxList.append(regionOrder[pos])
+        annotIdxList.append(annotIdx[k])
+
+    regionIdx = np.concatenate(regionIdxList) if len(regionIdxList) > 0 else np.array([], dtype=np.int64)
+    annotIdx = np.concatenate(annotIdxList) if len(annotIdxList) > 0 else np.array([], dtype=np.int64)
+    order = np.lexsort((annotIdx, regionIdx))
+    regionIdx, annotIdx = regionIdx[order], annotIdx[order]
+
+    overlap = np.minimum(regionEnd[regionIdx], annotEnd[annotIdx]) - np.maximum(regionStart[regionIdx], annotStart[annotIdx])
+    # Drop empty regions and zero-length annotations
+    isOverlapping = overlap > 0
+    regionIdx, annotIdx, overlap = regionIdx[isOverlapping], annotIdx[isOverlapping], overlap[isOverlapping]
+
+    overlapDf = pd.DataFrame({'region_id':regionDf.index.values[regionIdx],
+                              'id':annotDf.index.values[annotIdx],
+                              'overlap_type':_classify_overlap(overlap, annotEnd[annotIdx] - annotStart[annotIdx],
+                                                               regionEnd[regionIdx] - regionStart[regionIdx]),
+                              'overlap_length':overlap,
+                              'strand':annotDf[strandCol].values[annotIdx]})
+    return overlapDf
@@ -1,9 +1,10 @@
 import argparse
 from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from numpy import log, exp
-from mwTools.bio import extract_codons_list
-from mwTools.stats import jensen_shannon_div
+from mwTools.bio import encode_dna_seq, codon_index_array, codonList64
 
 
 
@@ -35,7 +36,126 @@ def split_6_codons_synonymous_families(aaCodonDict):
 
 
 
+def compute_codon_count_matrix(seqList, checkLengthMultipleOf3=True, includeInvalid=False):
+    """
+    Count the codons (frame 0, trailing partial codon ignored) of each sequence, in one pass over all sequences.
+
+    The sequences are encoded and concatenated, their codons mapped to the codon indices 0..63 of `codonList64`,
+    and counted with a single bincount. Codons with other letters than A, C, G, T (or U) are invalid, and counted
+    in an additional last column if includeInvalid is True. With checkLengthMultipleOf3, sequences whose length
+    is not a multiple of 3 are skipped (row of zeros), as in `extract_codons_list`.
+
+    Returns an (n_sequences x 64) int64 array (x 65 with includeInvalid).
+    """
+    seqList = [str(seq) for seq in seqList]
+    seqLength = np.array([len(seq) for seq in seqList], dtype=np.int64)
+    isValid = np.ones(len(seqList), dtype=bool)
+    if checkLengthMultipleOf3:
+        isValid = seqLength % 3 == 0
+        for _ in range(int(np.sum(~isValid))):
+            print("ERROR: seq length is not multiple of 3.")
+    nCodons = np.where(isValid, seqLength // 3, 0)
+
+    codonIdx = codon_index_array(encode_dna_seq("".join([seq[:3*n] for seq, n in zip(seqList, nCodons)])))
+    seqIdx = np.repeat(np.arange(len(seqList)), nCodons)
+    countMatrix = np.bincount(65*seqIdx + codonIdx, minlength=65*len(seqList)).reshape(len(seqList), 65)
+    if not includeInvalid:
+        countMatrix = countMatrix[:, :64]
+    return countMatrix
+
+
+_codonIndexDict = {codon:i for i, codon in enumerate(codonList64)}
+
+
+def convert_codon_dict_to_array(codonDict):
+    """
+    Convert a per-family codon dictionary (such as fij or wij of `compute_codon_usage`) to a vector over the
+    64 codon indices of `codonList64`, with NaN for the codons of families set to None and codons in no family.
+    """
+    codonArr = np.full(64, np.nan)
+    for aa, valueDict in codonDict.items():
+        if valueDict is not None:
+            for codon, value in valueDict.items():
+                codonArr[_codonIndexDict[codon]] = value
+    return codonArr
+
+
+class CodonUsage(Mapping):
+    """
+    Codon usage of a set of sequences, computed lazily from the 64 codon counts (see `compute_codon_count_matrix`).
+
+    Mapping with the keys of the former dictionary of `compute_codon_usage`: codonFreq, synCodonCount, fij, wij,
+    codonDatabase and codonCount. Each entry is only computed when first accessed.
+    """
+
+    _keyList = ['codonFreq', 'synCodonCount', 'fij', 'wij', 'codonDatabase', 'codonCount']
+
+    def __init__(self, codonCountArr, aaCodonDict, correctWijZeroCounts=0.01, nInvalidCodons=0):
+        self.codonCountArr = np.asarray(codonCountArr, dtype=np.int64)
+        self.aaCodonDict = aaCodonDict
+        self.correctWijZeroCounts = correctWijZeroCounts
+        self.nInvalidCodons = nInvalidCodons
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._keyList:
+            raise KeyError(key)
+        if key not in self._cache:
+            self._cache[key] = getattr(self, '_compute_' + key)()
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._keyList)
+
+    def __len__(self):
+        return len(self._keyList)
+
+    def _compute_codonCount(self):
+        return Counter({codon:int(count) for codon, count in zip(codonList64, self.codonCountArr) if count > 0})
+
+    def _compute_codonFreq(self):
+        nCodons = self.codonCountArr.sum() + self.nInvalidCodons
+        return {codon:count/nCodons for codon, count in self['codonCount'].items()}
+
+    def _compute_synCodonCount(self):
+        codonCount = self['codonCount']
+        return {aa:{synCodon:codonCount[synCodon] for synCodon in synCodonList}
+                for aa, synCodonList in self.aaCodonDict.items()}
+
+    def _compute_fij(self):
+        # f_ij, frequency of codon j in synonymous family i
+        fijDict = dict()
+        for aa, synCodonCount in self['synCodonCount'].items():
+            nSynCodons = sum(synCodonCount.values())
+            fijDict[aa] = {codon:count/nSynCodons for codon, count in synCodonCount.items()} if nSynCodons > 0 else None
+        return fijDict
+
+    def _compute_wij(self):
+        wijDict = dict()
+        for aa, fij in self['fij'].items():
+            if fij is not None:
+                wij = {codon:(freq/max(fij.values())) for codon, freq in fij.items()}
+                if self.correctWijZeroCounts > 0:
+                    wij = {codon:(w if w > 0 else self.correctWijZeroCounts) for codon, w in wij.items()}
+            else:
+                wij = None
+            wijDict[aa] = wij
+        return wijDict
+
+    def _compute_codonDatabase(self):
+        codonCount = self['codonCount']
+        codonDatabase = ''
+        for i, (codon, freq) in enumerate(self['codonFreq'].items(), 1):
+            codonDatabase += '{} {:f}({:d})'.format(codon, freq, codonCount[codon])
+            codonDatabase += '\n' if i % 4 == 0 else ' '
+        return codonDatabase
+
+
 def compute_codon_usage(seq, aaCodonDict, correctWijZeroCounts=0.01, checkLengthMultipleOf3=True, verbose=0):
+    """
+    Codon usage of a sequence or of a list (or Series) of sequences, as a lazy `CodonUsage` mapping.
+    The codons of all sequences are counted at once with `compute_codon_count_matrix`.
+    """
 
     if type(seq) is pd.Series:
         seqList = seq.tolist()
@@ -44,55 +164,14 @@ def compute_codon_usage(seq, aaCodonDict, correctWijZeroCounts=0.01, checkLength
     else:
         seqList = [seq]
 
-    # Concatenate list of codons for all sequences
-    codonListFinal = []
-    for seq in seqList:
-        codonList = extract_codons_list(seq, checkLengthMultipleOf3=checkLengthMultipleOf3)
-        if codonList is not None:
-            for codon in codonList:
-                codonListFinal.append(codon)
-    codonList = codonListFinal
-    codonCount = Counter(codonList)
-    codonFreq = {codon:count/sum(codonCount.values()) for codon, count in codonCount.items()}
-    
-    # Compute f_ij, frequency of codon j in synonymous family i
-    synCodonCountDict = dict()
-    fijDict = dict()
-    wijDict = dict()
-    for aa, synCodonList in aaCodonDict.items():
-        if verbose >= 2: print(aa, synCodonList)
-        synCodonCount = {synCodon:codonCount[synCodon] for synCodon in synCodonList}
-        synCodonCountDict.update({aa: synCodonCount})
-        if verbose >= 2: print(synCodonCount)
-        
-        if sum(synCodonCount.values()) > 0:
-            fij = {codon:count/sum(synCodonCount.values()) for codon, count in synCodonCount.items()}
-        else:
-            fij = None
-        fijDict.update({aa:fij})
-        if verbose >= 2: print(fij)
-
-        if fij is not None:
-            wij = {codon:(freq/max(fij.values())) for codon, freq in fij.items()}
-            if correctWijZeroCounts > 0:
-                wij = {codon:(w if w > 0 else correctWijZeroCounts) for codon, w in wij.items()}
-        else:
-            wij = None
-        wijDict.update({aa:wij})
-        if verbose >= 2: print(wij)
-        
-    i = 1
-    codonDatabase = ''
-    for codon, freq in codonFreq.items():
-        codonDatabase += '{} {:f}({:d})'.format(codon, freq, codonCount[codon])
-        if i % 4 == 0:
-            codonDatabase += '\n'
-        else:
-            codonDatabase += ' '
-        i += 1
-    
-    return {'codonFreq':codonFreq, 'synCodonCount':synCodonCountDict,
-            'fij':fijDict, 'wij':wijDict, 'codonDatabase':codonDatabase, 'codonCount':codonCount}
+    countArr = compute_codon_count_matrix(seqList, checkLengthMultipleOf3=checkLengthMultipleOf3,
+                                          includeInvalid=True).sum(axis=0)
+    codonUsage = CodonUsage(countArr[:64], aaCodonDict, correctWijZeroCounts=correctWijZeroCounts,
+                            nInvalidCodons=int(countArr[64]))
+    if verbose >= 2:
+        print("fij", codonUsage['fij'])
+        print("wij", codonUsage['wij'])
+    return codonUsage
 
 
 def compute_codon_usage_dict(seq, aaCodonDict, checkLengthMultipleOf3, verbose):
@@ -113,85 +192,164 @@ def compute_codon_usage_series(seqQueryS, aaCodonDict, correctWijZeroCounts=0.01
     return codonDf
 
 
-def _compute_metric_seq(seq, fijRef, aaCodonDict, checkLengthMultipleOf3=True, verbose=1):
+def _get_family_codon_pairs(aaCodonDict, aaList):
+    """Family index and codon index of all the (family, codon) pairs of the families in aaList."""
+    pairList = [(i, _codonIndexDict[codon]) for i, aa in enumerate(aaList) for codon in aaCodonDict[aa]]
+    famIdx = np.array([i for i, _ in pairList], dtype=np.int64)
+    codonIdx = np.array([codonIdx for _, codonIdx in pairList], dtype=np.int64)
+    famMatrix = np.zeros((len(pairList), len(aaList)))
+    famMatrix[np.arange(len(pairList)), famIdx] = 1
+    return famIdx, codonIdx, famMatrix
+
+
+def compute_CAI_batch(countMatrix, wijRefArr, aaCodonDict, aaList):
     """
-    Compute a single metric value for one query sequence against one reference codon usage.
+    CAI of many query sequences at once, given their codon count matrix
+    (see `compute_codon_count_matrix`) and the reference wij as a vector over the 64 codon indices
+    (see `convert_codon_dict_to_array`).
+
+    The query fij of all families in aaList are computed on the matrix, and the CAI is the exponential
+    of the fij-weighted mean of ln(wij), over the families with counts in the query and the codons with
+    wij > 0 in the reference.
     """
+    countMatrix = np.atleast_2d(countMatrix).astype(np.float64)
+    famIdx, codonIdx, famMatrix = _get_family_codon_pairs(aaCodonDict, aaList)
+    count = countMatrix[:, codonIdx]
+    famSum = (count @ famMatrix)[:, famIdx]
+    wij = wijRefArr[codonIdx]
+    isUsed = (wij > 0)[None, :] & (famSum > 0)
+    fij = np.where(isUsed, count / np.where(famSum > 0, famSum, 1), 0.0)
+    sum1 = fij @ np.log(np.where(wij > 0, wij, 1.0))
+    sum2 = fij.sum(axis=1)
+    return np.where(sum2 != 0, np.exp(sum1 / np.where(sum2 != 0, sum2, 1)), 0.0)
 
-    codonUsage = compute_codon_usage(seq, aaCodonDict=aaCodonDict,
-                                     checkLengthMultipleOf3=checkLengthMultipleOf3, verbose=1)
-    fij = codonUsage['fij']
-    if verbose >= 2: print("### _compute_metric_seq")
-    if verbose >= 2: print("fij", fij)
-    if verbose >= 2: print("fijRef", fijRef)
-
-    # We drop out the aa families for which have no codons either
-    # in the query sequence or in the ref. sequence.
-    # for these we add 0.5, which would be the expected distance for
-    # random sequences (?)
-    metric = 0.0
-    for aa, f in fij.items():
-        fRef = fijRef[aa]
-        if f is None or fRef is None:
-            metric += 0.5
-        else:
-            fVector = [f[key] for key in f.keys() & fRef.keys()]
-            fRefVector = [fRef[key] for key in f.keys() & fRef.keys()]
-            if verbose >= 2: print("fVector", fVector)
-            if verbose >= 2: print("fRefVector", fRefVector)
-            JSD = jensen_shannon_div(fVector, fRefVector)
-            if verbose >= 2: print("JSD", JSD)
-            metric += sum(fVector)*JSD
-    if verbose >= 2: print("metric", metric)
 
-    return metric
+def _normalize_family_fij(fij, famIdx, famMatrix):
+    """Normalize fij (..., n_pairs) to sum 1 in each family, returning also the sums before normalization."""
+    fijSum = fij @ famMatrix
+    return fij / np.where(fijSum > 0, fijSum, 1)[..., famIdx], fijSum
 
 
-def _compute_CAI(seq, wijRef, aaList, aaCodonDict, checkLengthMultipleOf3=True, verbose=1):
+def _compute_JSD_metric(P, PSum, PValid, Q, QValid, famMatrix):
     """
-    Compute a single CAI value for one query sequence against one reference codon usage.
+    Family-weighted Jensen-Shannon metric between the normalized query fij P and reference fij Q, of shape
+    (..., n_pairs) and broadcastable. PSum, PValid and QValid are of shape (..., n_families).
     """
+    M = 0.5*(P + Q)
+    # Jensen-Shannon divergence (in bits) of each family, with 0*log(0) = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        KLTerm = np.where(P > 0, P*np.log2(P/M), 0.0) + np.where(Q > 0, Q*np.log2(Q/M), 0.0)
+    JSD = 0.5*(KLTerm @ famMatrix)
+    return np.where(PValid & QValid, PSum*JSD, 0.5).sum(axis=-1)
+
 
-    codonUsage = compute_codon_usage(seq, aaCodonDict=aaCodonDict,
-                                     checkLengthMultipleOf3=checkLengthMultipleOf3, verbose=1)
-    fij = codonUsage['fij']
-    if verbose >= 2: print("### _compute_CAI")
-    if verbose >= 2: print("fij:", fij)
-    if verbose >= 2: print("wijRef:", wijRef)
-
-    sum1 = 0
-    for aa in aaList:
-        # This should not be necessary, we already filtered above for aa families with 0 counts in the ref. set.
-        # if wijRef[aa] is not None:
-        if True:
-            for codon in wijRef[aa].keys():
-                # We exclude codons which have 0 counts in the ref. set.
-                if fij[aa] is not None and wijRef[aa][codon] > 0:
-                    if verbose >= 2: print(aa, codon, "fij:", fij[aa][codon], "wij:", wijRef[aa][codon], "ln(wij)", log(wijRef[aa][codon]))
-                    sum1 += fij[aa][codon]*log(wijRef[aa][codon])
-                else:
-                    if verbose  >= 2: print("skipped codon", aa, codon)
-    if verbose >= 2: print("sum1:", sum1)
-
-    sum2 = 0
-    for aa in aaList:
-        # if wijRef[aa] is not None:
-        if True:
-            for codon in wijRef[aa].keys():
-                if fij[aa] is not None and wijRef[aa][codon] > 0:
-                    sum2 += fij[aa][codon]
-    if verbose >= 2: print("sum2:", sum2)
-
-    CAI = exp(sum1/sum2) if sum2 != 0 else 0.0
-    if verbose >= 2: print("CAI:", CAI)
-
-    return CAI
+def _compute_family_fij(countMatrix, famIdx, codonIdx, famMatrix):
+    """Normalized fij of the codon count matrix over the (family, codon) pairs, with their sums and family validity."""
+    count = np.atleast_2d(countMatrix).astype(np.float64)[:, codonIdx]
+    famCount = count @ famMatrix
+    P, PSum = _normalize_family_fij(count / np.where(famCount > 0, famCount, 1)[:, famIdx], famIdx, famMatrix)
+    return P, PSum, famCount > 0
+
+
+def compute_metric_batch(countMatrix, fijRefArr, aaCodonDict):
+    """
+    Metric of many query sequences at once, given their codon count matrix
+    (see `compute_codon_count_matrix`) and the reference fij as a vector over the 64 codon indices
+    (see `convert_codon_dict_to_array`).
+
+    The metric is the sum over all synonymous families of the Jensen-Shannon divergence between the
+    query and reference fij, weighted by the sum of the query fij, and 0.5 for the families without
+    counts in the query or in the reference.
+    """
+    famIdx, codonIdx, famMatrix = _get_family_codon_pairs(aaCodonDict, list(aaCodonDict.keys()))
+    P, PSum, PValid = _compute_family_fij(countMatrix, famIdx, codonIdx, famMatrix)
+    QValid = (np.isnan(fijRefArr[codonIdx]) @ famMatrix) == 0
+    Q, _ = _normalize_family_fij(np.nan_to_num(fijRefArr[codonIdx])[None, :], famIdx, famMatrix)
+    return _compute_JSD_metric(P, PSum, PValid, Q, QValid[None, :], famMatrix)
+
+
+_pairwiseMetricWorkerState = {}
+
+
+def _init_pairwise_metric_worker(P, PSum, PValid, famMatrix, blockSize):
+    _pairwiseMetricWorkerState.update({'P':P, 'PSum':PSum, 'PValid':PValid, 'famMatrix':famMatrix,
+                                       'blockSize':blockSize})
+
+
+def _compute_pairwise_metric_worker(rowRange):
+    """Condensed pairwise metric of the rows i0 <= i < i1 against all columns j < i, computed by blocks of columns."""
+    i0, i1 = rowRange
+    state = _pairwiseMetricWorkerState
+    P, PSum, PValid, famMatrix, blockSize = [state[key] for key in ['P', 'PSum', 'PValid', 'famMatrix', 'blockSize']]
+    metricArr = np.empty(i1*(i1 - 1)//2 - i0*(i0 - 1)//2)
+    rowIdx = np.arange(i0, i1)
+    for j0 in range(0, i1 - 1, blockSize):
+        j1 = min(j0 + blockSize, i1 - 1)
+        # Rows i are the references, columns j the queries
+        blockMetric = _compute_JSD_metric(P[None, j0:j1], PSum[None, j0:j1], PValid[None, j0:j1],
+                                          P[i0:i1, None], PValid[i0:i1, None], famMatrix)
+        ii, jj = np.meshgrid(rowIdx, np.arange(j0, j1), indexing='ij')
+        isLower = jj < ii
+        metricArr[(ii*(ii - 1)//2 + jj - i0*(i0 - 1)//2)[isLower]] = blockMetric[isLower]
+    return metricArr
+
+
+def compute_pairwise_metric(countMatrix, aaCodonDict, blockSize=256, filepath=None, nJobs=1, verbose=1):
+    """
+    Family-weighted Jensen-Shannon metric (see `compute_metric_batch`) between all pairs of sequences,
+    given their codon count matrix (see `compute_codon_count_matrix`).
+
+    The fij of all sequences are computed once, and the metrics computed by blocks of blockSize x blockSize
+    pairs. Blocks of rows are processed in parallel in a pool of nJobs processes, each receiving the fij
+    matrix once.
+
+    Returns the condensed lower triangle as a 1D array, in which the metric of query j against reference i
+    (j < i) is at position i*(i-1)/2 + j. If a filepath is given, the array is a memory-mapped .npy file.
+    """
+    famIdx, codonIdx, famMatrix = _get_family_codon_pairs(aaCodonDict, list(aaCodonDict.keys()))
+    P, PSum, PValid = _compute_family_fij(countMatrix, famIdx, codonIdx, famMatrix)
+    n = len(P)
+    nPairs = n*(n - 1)//2
+    if filepath is not None:
+        metricArr = np.lib.format.open_memmap(str(filepath), mode='w+', dtype=np.float64, shape=(nPairs,))
+    else:
+        metricArr = np.empty(nPairs)
+
+    rowRangeList = [(i0, min(i0 + blockSize, n)) for i0 in range(1, n, blockSize)]
+
+    def store_blocks(blockMetricList):
+        # The blocks of rows i0 <= i < i1 are contiguous in the condensed array
+        for k, ((i0, i1), blockMetricArr) in enumerate(zip(rowRangeList, blockMetricList)):
+            metricArr[i0*(i0 - 1)//2:i1*(i1 - 1)//2] = blockMetricArr
+            if verbose >= 2: print("row block #", k + 1, "/", len(rowRangeList))
+
+    initArgs = (P, PSum, PValid, famMatrix, blockSize)
+    if nJobs == 1:
+        # The worker state is cleared afterwards, such that the fij matrix is not kept alive in this process
+        _init_pairwise_metric_worker(*initArgs)
+        try:
+            store_blocks(map(_compute_pairwise_metric_worker, rowRangeList))
+        finally:
+            _pairwiseMetricWorkerState.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=nJobs, initializer=_init_pairwise_metric_worker,
+                                 initargs=initArgs) as executor:
+            store_blocks(executor.map(_compute_pairwise_metric_worker, rowRangeList))
+
+    if filepath is not None:
+        metricArr.flush()
+    return metricArr
 
 
 def compute_CAI_df(seqQueryS2, seqRef, seqRefIndex, aaList0, aaCodonDict, method, codonUsageRef=None,
-                   checkLengthMultipleOf3=True, verbose=1):
+                   checkLengthMultipleOf3=True, queryCountMatrix=None, queryIndex=None, verbose=1):
     """
     Compute the CAI and metric for a series of query sequences against one reference codon usage.
+
+    The codons of all query sequences are counted at once (or given as queryCountMatrix, see
+    `compute_codon_count_matrix`), and the CAI and metric of all queries are computed on the count
+    matrix with `compute_CAI_batch` and `compute_metric_batch`.
+    If both queryCountMatrix and queryIndex are given, seqQueryS2 is not used and can be None.
     """
     if codonUsageRef is None:
         # Correct wij for zero counts to a value of 0.01, in order to avoid
@@ -225,29 +383,51 @@ def compute_CAI_df(seqQueryS2, seqRef, seqRefIndex, aaList0, aaCodonDict, method
             if verbose >= 1:
                 print("WARNING: we have some codons in {} families with zero counts in the reference set, the CAI will be unreliable.".format(",".join(zeroCountCodonList)))
 
+    if queryCountMatrix is None:
+        queryCountMatrix = compute_codon_count_matrix(list(seqQueryS2), checkLengthMultipleOf3=checkLengthMultipleOf3)
     if method in ['avg_query_vs_avg_ref']:
-        caiDf = pd.DataFrame({'CAI':[_compute_CAI(seqQueryS2, wijRef, aaList=aaList, aaCodonDict=aaCodonDict,
-                                                  checkLengthMultipleOf3=checkLengthMultipleOf3, verbose=verbose)],
-                              'metric':[_compute_metric_seq(seqQueryS2, fijRef, aaCodonDict=aaCodonDict,
-                                                            checkLengthMultipleOf3=checkLengthMultipleOf3, verbose=verbose)]})
+        queryCountMatrix = queryCountMatrix.sum(axis=0, keepdims=True)
+
+    CAIArr = compute_CAI_batch(queryCountMatrix, convert_codon_dict_to_array(wijRef), aaCodonDict, aaList)
+    metricArr = compute_metric_batch(queryCountMatrix, convert_codon_dict_to_array(fijRef), aaCodonDict)
+    if method in ['avg_query_vs_avg_ref']:
+        caiDf = pd.DataFrame({'CAI':CAIArr, 'metric':metricArr})
     else:
-        caiDf = seqQueryS2.apply(lambda x: pd.Series({'CAI':_compute_CAI(x, wijRef, aaList=aaList, aaCodonDict=aaCodonDict,
-                                                                         checkLengthMultipleOf3=checkLengthMultipleOf3,
-                                                                         verbose=verbose),
-                                                      'metric':_compute_metric_seq(x, fijRef, aaCodonDict=aaCodonDict,
-                                                                                   checkLengthMultipleOf3=checkLengthMultipleOf3,
-                                                                                   verbose=verbose),
-                                                      'ref_index':seqRefIndex
-                                                      }))
+        if queryIndex is None:
+            queryIndex = seqQueryS2.index
+        caiDf = pd.DataFrame({'CAI':CAIArr, 'metric':metricArr, 'ref_index':seqRefIndex}, index=queryIndex)
     return caiDf
 
 
+def _compute_CAI_df_list(refItemList, queryIndex, queryCountMatrix, aaList, aaCodonDict, method,
+                         checkLengthMultipleOf3, verbose):
+    """CAI dataframes of all queries, given by their codon count matrix, against each reference of the list."""
+    return [compute_CAI_df(None, seqRef, seqRefIndex, aaList0=aaList, aaCodonDict=aaCodonDict, method=method,
+                           checkLengthMultipleOf3=checkLengthMultipleOf3, queryCountMatrix=queryCountMatrix,
+                           queryIndex=queryIndex, verbose=verbose)
+            for seqRefIndex, seqRef in refItemList]
+
+
+_CAIWorkerState = {}
+
+
+def _init_CAI_worker(queryIndex, queryCountMatrix, aaList, aaCodonDict, method, checkLengthMultipleOf3, verbose):
+    _CAIWorkerState.update({'queryIndex':queryIndex, 'queryCountMatrix':queryCountMatrix, 'aaList':aaList,
+                            'aaCodonDict':aaCodonDict, 'method':method,
+                            'checkLengthMultipleOf3':checkLengthMultipleOf3, 'verbose':verbose})
+
+
+def _compute_CAI_worker(refItemList):
+    """`_compute_CAI_df_list` in a pool worker, with the shared inputs set by `_init_CAI_worker`."""
+    return _compute_CAI_df_list(refItemList, **_CAIWorkerState)
+
+
 def compute_CAI(seqQueryS, seqRefS, aaCodonDict, codonUsageRef=None,
                 method='all_query_vs_avg_ref',
                 excludeSeqNotMultipleOf3=True,
                 computeAvgQueryCAI=False, computeAllQueryToAllRef=False, computeAllQueryToAllQuery=False,
                 split6codonsSynonymousFamilies=True, exclude1CodonFamilies=True,
-                verbose=1):
+                nJobs=1, blockSize=256, pairwiseMetricFilepath=None, returnCondensedMetric=False, verbose=1):
     """
     Calculate the Codon Adaptation Index (CAI) of a genome compared to a reference set of highly expressed genes.
     The method here is that described by Xia, X. (2007). An improved implementation of codon adaptation index.
@@ -263,6 +443,18 @@ def compute_CAI(seqQueryS, seqRefS, aaCodonDict, codonUsageRef=None,
      'C': ['TGT', 'TGC'], ...}
      
     Note that aaCodonDict will be automatically splitted into the correct codons groups.
+
+    The codons of the query sequences are counted once. With method all_query_vs_all_ref, the references are
+    distributed in chunks to a pool of nJobs processes, each receiving the query codon count matrix and codon
+    dictionary once; results are concatenated in the order of the references.
+
+    With method all_query_vs_all_query, the metric between all pairs of queries is computed blockwise
+    (blocks of blockSize x blockSize pairs, in a pool of nJobs processes) by `compute_pairwise_metric`,
+    optionally into a memory-mapped .npy file pairwiseMetricFilepath. By default the result is expanded to a
+    long-format dataframe with one row per pair, which for many queries (50M rows for 10k queries) is much larger
+    than the condensed array. With returnCondensedMetric=True, the condensed array (see `compute_pairwise_metric`,
+    memory-mapped if pairwiseMetricFilepath is given) is returned as is, together with the index of the
+    queries, which labels both the rows i and columns j of the lower triangle.
     """
     
 
@@ -328,30 +520,34 @@ def compute_CAI(seqQueryS, seqRefS, aaCodonDict, codonUsageRef=None,
     caiDfList = []
     if method in ['all_query_vs_all_query']:
         if seqRefS is not None:
-            print("ERROR: With method all_query_vs_all_query reference set has to be None.")
-        else:
-            caiDfList = []
-            n = len(seqQueryS2)
-            for i, (name, seqS_i) in enumerate(seqQueryS2.iteritems()):
-                if i > 0:
-                    seqS_i2 = pd.Series([seqS_i], index=[name])
-                    seqS_j = seqQueryS2.iloc[:i]
-                    if verbose >= 1: print("query seq #", i, "/", n, "len(seq_j):", len(seqS_j))
-                    if verbose >= 2:
-                        print("seqS_i2:\n", seqS_i2, '\n')
-                        print(seqS_i2.index.tolist(), '\n')
-                        print("seqS_j:\n", seqS_j, '\n')
-                    caiDf = compute_CAI_df(seqS_j, seqS_i2, seqS_i2.index[0], aaList0=aaList, aaCodonDict=aaCodonDict,
-                                           method=method, checkLengthMultipleOf3=excludeSeqNotMultipleOf3, verbose=verbose)
-                    caiDf = caiDf.drop('CAI', axis=1)
-                    caiDfList.append(caiDf)
-            caiDf2 = pd.concat(caiDfList)
-            
+            raise ValueError("With method all_query_vs_all_query reference set has to be None.")
+        # The codons of all queries are counted once, and the metric of each query j against each query i > j
+        # (as reference) is computed blockwise in the condensed lower triangle order i*(i-1)/2 + j.
+        n = len(seqQueryS2)
+        countMatrix = compute_codon_count_matrix(list(seqQueryS2), checkLengthMultipleOf3=excludeSeqNotMultipleOf3)
+        metricArr = compute_pairwise_metric(countMatrix, aaCodonDict, blockSize=blockSize,
+                                            filepath=pairwiseMetricFilepath, nJobs=nJobs, verbose=verbose)
+        if returnCondensedMetric:
+            return metricArr, seqQueryS2.index
+        refIdx = np.repeat(np.arange(n), np.arange(n))
+        queryIdx = np.arange(len(metricArr)) - refIdx*(refIdx - 1)//2
+        caiDf2 = pd.DataFrame({'metric':metricArr, 'ref_index':seqQueryS2.index.values[refIdx]},
+                              index=seqQueryS2.index[queryIdx])
+
     else:
-        for seqRefIndex, seqRef in seqRefSuperList.iteritems():
-            caiDf = compute_CAI_df(seqQueryS2, seqRef, seqRefIndex, aaList0=aaList, aaCodonDict=aaCodonDict,
-                                   method=method, checkLengthMultipleOf3=excludeSeqNotMultipleOf3, verbose=verbose)
-            caiDfList.append(caiDf)
+        # The codons of the queries are counted once for all references
+        queryCountMatrix = compute_codon_count_matrix(list(seqQueryS2), checkLengthMultipleOf3=excludeSeqNotMultipleOf3)
+        refItemList = list(seqRefSuperList.items())
+        initArgs = (seqQueryS2.index, queryCountMatrix, aaList, aaCodonDict, method, excludeSeqNotMultipleOf3, verbose)
+        if nJobs == 1 or method not in ['all_query_vs_all_ref']:
+            caiDfList = _compute_CAI_df_list(refItemList, *initArgs)
+        else:
+            # Chunks of references are distributed to the workers, which receive the shared inputs once
+            chunkSize = max(1, -(-len(refItemList) // (4*nJobs)))
+            chunkList = [refItemList[i:i + chunkSize] for i in range(0, len(refItemList), chunkSize)]
+            with ProcessPoolExecutor(max_workers=nJobs, initializer=_init_CAI_worker, initargs=initArgs) as executor:
+                caiDfList = [caiDf for caiDfChunk in executor.map(_compute_CAI_worker, chunkList)
+                             for caiDf in caiDfChunk]
 
         if method in ['all_query_vs_avg_ref', 'avg_query_vs_avg_ref']:
             caiDf2 = caiDfList[0]
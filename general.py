@@ -164,7 +164,7 @@ def open_by_suffix(filename):
     if Path(filename).suffix == '.gz':
         return gzip.open(filename, 'rt')
     elif Path(filename).suffix == '.bz2':
-        return bz2.BZ2file(filename, 'rt')
+        return bz2.open(filename, 'rt')
     else:
         return open(filename, 'r')
 
@@ -348,3 +348,18 @@ def slugify(value, allow_unicode=False):
     value = re.sub(r'[^\w\s-]', '', value)
     return re.sub(r'[-\s]+', '-', value).strip('-_')
 
+
+
+def executor_map_bounded(executor, func, iterable, maxPending):
+    """
+    Same as `executor.map(func, iterable)` for a concurrent.futures executor, but keeps at most `maxPending`
+    tasks in flight, such that a large or lazy iterable (e.g. records parsed from a file) is consumed
+    progressively instead of being submitted all at once. Results are yielded in input order.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= maxPending:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
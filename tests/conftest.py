@@ -0,0 +1,15 @@
+import importlib.util
+import os
+import sys
+
+# The modules of the repository are imported as the mwTools package. The repository directory itself is
+# removed from the path, since its modules (e.g. pandas.py) would shadow the top-level packages.
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != repoDir]
+
+if 'mwTools' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('mwTools', os.path.join(repoDir, '__init__.py'),
+                                                  submodule_search_locations=[repoDir])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['mwTools'] = module
+    spec.loader.exec_module(module)
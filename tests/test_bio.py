@@ -0,0 +1,1178 @@
+import gzip
+import os
+import re
+import textwrap
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from Bio import SeqIO
+from Bio.Data import CodonTable
+from Bio.Data.CodonTable import TranslationError
+from Bio.Seq import Seq
+from Bio.SeqFeature import SeqFeature, FeatureLocation
+from Bio.SeqRecord import SeqRecord
+
+from mwTools import bio
+
+
+def make_genbank_record(recordId='NC_000001.1', length=3000, nCDS=20, seed=0):
+    """Random genome record with CDS features made of valid ORFs on both strands."""
+    rng = np.random.default_rng(seed)
+    seq = list(rng.choice(list('ACGT'), length))
+    featureList = [SeqFeature(FeatureLocation(0, length, strand=1), type='source', qualifiers={'organism':['Test']})]
+    for i in range(nCDS):
+        start = 100*i
+        cds = 'ATG' + ''.join(rng.choice(['GCT', 'AAA', 'TTT', 'GGC', 'CTG'], 20)) + 'TAA'
+        strand = 1 if i % 2 == 0 else -1
+        if strand == -1:
+            cds = str(Seq(cds).reverse_complement())
+        seq[start:start + len(cds)] = list(cds)
+        featureList.append(SeqFeature(FeatureLocation(start, start + len(cds), strand=strand), type='CDS',
+                                      qualifiers={'locus_tag':['T{}'.format(i)], 'transl_table':['11']}))
+    record = SeqRecord(Seq(''.join(seq)), id=recordId, name=recordId.split('.')[0], description='test',
+                       annotations={'molecule_type':'DNA', 'organism':'Test'})
+    record.features = featureList
+    return record
+
+
+def write_compressed_genbank_file(filepath, recordList):
+    with gzip.open(str(filepath), 'wt') as f:
+        SeqIO.write(recordList, f, 'genbank')
+
+
+def test_process_refseq_genomes_creates_extracted_folder(tmp_path):
+    compressedFolder = tmp_path / 'compressed'
+    compressedFolder.mkdir()
+    write_compressed_genbank_file(compressedFolder / 'GCF_1_genomic.gbff.gz', [make_genbank_record()])
+    assemblySummaryDf = pd.DataFrame({'organism_name':['Test'], 'compressedGenomeFilename':['GCF_1_genomic.gbff.gz']},
+                                     index=pd.Index(['GCF_1'], name='assembly_accession'))
+    extractedFolder = tmp_path / 'extracted' / 'new'
+
+    resultDf = bio.process_refseq_genomes(assemblySummaryDf, compressedFolder, tmp_path / 'output',
+                                          extractProteinSeq=True, extractDNASeq=True,
+                                          extractedFolder=extractedFolder, nJobs=1, verbose=0)
+
+    assert resultDf.loc['GCF_1', 'status'] == 'done'
+    assert os.listdir(str(extractedFolder)) == ['GCF_1_genomic.gbff']
+    annotDf = pd.read_parquet(str(tmp_path / 'output' / 'GCF_1.parquet'))
+    assert (annotDf['feature'] == 'CDS').sum() == 20
+
+
+
+def test_process_refseq_genomes_resumes(tmp_path, capsys):
+    compressedFolder = tmp_path / 'compressed'
+    compressedFolder.mkdir()
+    recordDict = {'GCF_{}'.format(i):make_genbank_record('NC_{}.1'.format(i), seed=i) for i in range(3)}
+    for genomeAccession in ['GCF_0', 'GCF_1']:
+        write_compressed_genbank_file(compressedFolder / (genomeAccession + '_genomic.gbff.gz'),
+                                      [recordDict[genomeAccession]])
+    assemblySummaryDf = pd.DataFrame({'organism_name':['Org0', 'Org1', 'Org2'],
+                                      'compressedGenomeFilename':[genomeAccession + '_genomic.gbff.gz'
+                                                                  for genomeAccession in recordDict]},
+                                     index=pd.Index(list(recordDict), name='assembly_accession'))
+    outputFolder = tmp_path / 'output'
+
+    resultDf = bio.process_refseq_genomes(assemblySummaryDf, compressedFolder, outputFolder, nJobs=2)
+    assert resultDf['status'].tolist() == ['done', 'done', 'failed']
+    assert resultDf.loc['GCF_2', 'error'].startswith('FileNotFoundError')
+    assert 'already done: 0' in capsys.readouterr().out
+    for i, genomeAccession in enumerate(['GCF_0', 'GCF_1']):
+        expectedDf = bio.convert_genbank_to_annotation_df(recordDict[genomeAccession], verbose=0).reset_index(drop=True)
+        expectedDf.insert(0, 'organism_name', 'Org{}'.format(i))
+        expectedDf.insert(0, 'assembly_accession', genomeAccession)
+        pd.testing.assert_frame_equal(pd.read_parquet(resultDf.loc[genomeAccession, 'filepath']), expectedDf,
+                                      check_dtype=False)
+        assert resultDf.loc[genomeAccession, 'nb_rows'] == len(expectedDf)
+
+    # Only the failed genome is redone
+    write_compressed_genbank_file(compressedFolder / 'GCF_2_genomic.gbff.gz', [recordDict['GCF_2']])
+    mTimeList = [os.path.getmtime(resultDf.loc[genomeAccession, 'filepath']) for genomeAccession in ['GCF_0', 'GCF_1']]
+    resultDf = bio.process_refseq_genomes(assemblySummaryDf, compressedFolder, outputFolder, nJobs=1)
+    assert resultDf['status'].tolist() == ['done']*3
+    assert 'already done: 2' in capsys.readouterr().out
+    assert [os.path.getmtime(resultDf.loc[genomeAccession, 'filepath'])
+            for genomeAccession in ['GCF_0', 'GCF_1']] == mTimeList
+
+    # Genomes whose output file is missing, or done with other options, are redone
+    os.remove(resultDf.loc['GCF_0', 'filepath'])
+    bio.process_refseq_genomes(assemblySummaryDf, compressedFolder, outputFolder, nJobs=1)
+    assert 'already done: 2' in capsys.readouterr().out
+    resultDf = bio.process_refseq_genomes(assemblySummaryDf, compressedFolder, outputFolder, extractDNASeq=True,
+                                          extractProteinSeq=True, nJobs=1)
+    assert 'already done: 0' in capsys.readouterr().out
+    assert pd.read_parquet(resultDf.loc['GCF_1', 'filepath'])['protein_seq'].notnull().sum() == 20
+    assert sorted(os.listdir(str(outputFolder))) == ['GCF_0.parquet', 'GCF_1.parquet', 'GCF_2.parquet',
+                                                     'progress.json']
+
+def write_BED_coverage_file(filepath, positionList, coverageList, ref='NC_000001.1'):
+    pd.DataFrame({'ref':ref, 'position':positionList, 'coverage':coverageList}).to_csv(
+        str(filepath), sep='\t', header=False, index=False)
+
+
+def test_load_BED_coverage_arrays_cache_depends_on_minus_strand_file(tmp_path):
+    write_BED_coverage_file(tmp_path / 's.strandp_coverage.bed', [1, 2, 3], [1, 2, 3])
+    write_BED_coverage_file(tmp_path / 'a.strandm_coverage.bed', [1, 2, 3], [4, 5, 6])
+    write_BED_coverage_file(tmp_path / 'b.strandm_coverage.bed', [1, 2, 3], [7, 8, 9])
+
+    covArrList = [bio.load_BED_coverage_arrays(file_plus_strand=tmp_path / 's.strandp_coverage.bed',
+                                               file_minus_strand=tmp_path / '{}.strandm_coverage.bed'.format(name),
+                                               verbose=0)
+                  for name in ['a', 'b', 'a', 'b']]
+
+    for covArr, minusCoverage in zip(covArrList, [[4, 5, 6], [7, 8, 9]]*2):
+        np.testing.assert_array_equal(covArr, [[1, 2, 3], minusCoverage])
+    assert len([filename for filename in os.listdir(str(tmp_path)) if filename.endswith('.npy')]) == 2
+
+
+def test_load_BED_coverage_arrays_interrupted_cache_write(tmp_path, monkeypatch):
+    write_BED_coverage_file(tmp_path / 's.strandp_coverage.bed', [0, 1], [1, 2])
+    write_BED_coverage_file(tmp_path / 's.strandm_coverage.bed', [0, 1], [3, 4])
+
+    def failing_save(f, arr):
+        f.write(b'\x93NUMPY')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(np, 'save', failing_save)
+    with pytest.raises(KeyboardInterrupt):
+        bio.load_BED_coverage_arrays(path=tmp_path, basename='s', verbose=0)
+    monkeypatch.undo()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['s.strandm_coverage.bed', 's.strandp_coverage.bed']
+    np.testing.assert_array_equal(bio.load_BED_coverage_arrays(path=tmp_path, basename='s', verbose=0),
+                                  [[1, 2], [3, 4]])
+
+
+def test_import_roesti_coverage_store_does_not_write_beside_BED_files(tmp_path):
+    bedFolder = tmp_path / 'bed'
+    bedFolder.mkdir()
+    for i in range(2):
+        write_BED_coverage_file(bedFolder / 'S{}.strandp_coverage.bed'.format(i), [1, 2, 3], [i, 2, 3])
+        write_BED_coverage_file(bedFolder / 'S{}.strandm_coverage.bed'.format(i), [1, 2], [4, i])
+    sampleDf = pd.DataFrame({'sample':['a', 'b'], 'replicate':[1, 1], 'path':str(bedFolder),
+                             'sample_filename_prefix':['S0', 'S1']})
+    bedFilenameList = sorted(os.listdir(str(bedFolder)))
+    os.chmod(str(bedFolder), 0o555)
+    try:
+        store = bio.import_roesti_coverage_store(sampleDf, tmp_path / 'store', verbose=0)
+    finally:
+        os.chmod(str(bedFolder), 0o755)
+
+    assert sorted(os.listdir(str(bedFolder))) == bedFilenameList
+    assert sorted(os.listdir(str(tmp_path))) == ['bed', 'store.npy', 'store.samples.csv']
+    np.testing.assert_array_equal(store.get_sample_coverage('b', 1), [[1, 2, 3], [4, 1, 0]])
+
+
+def make_annotation_df():
+    return pd.DataFrame({'chromosome':['chr1', 'chr1', 'chr2', 'chr1'], 'id':['g1', 'g2', 'g3', 't1'],
+                         'feature':['CDS', 'ncRNA', 'CDS', 'transcript'], 'strand':['+', '-', '-', '+'],
+                         'start':[10, 0, 5, 10], 'end':[40, 20, 35, 50],
+                         'transcript_id_unique':['t1', 't2', 't3', 't1']})
+
+
+def test_convert_annotation_df_to_bed():
+    # Expected output of the previous row-wise implementation
+    assert bio.convert_annotation_df_to_bed(make_annotation_df()) == \
+        'chr1\t0\t20\tg2\t0\t-\nchr2\t5\t35\tg3\t0\t-\nchr1\t10\t40\tg1\t0\t+\nchr1\t10\t50\tt1\t0\t+\n'
+    assert bio.convert_annotation_df_to_bed(make_annotation_df(), combineFeatureAndId=True) == \
+        'chr1\t0\t20\tncRNA;g2\t0\t-\nchr2\t5\t35\tCDS;g3\t0\t-\nchr1\t10\t40\tCDS;g1\t0\t+\n' \
+        'chr1\t10\t50\ttranscript;t1\t0\t+\n'
+
+
+def test_convert_annotation_df_to_bed_empty(tmp_path):
+    annotDf = make_annotation_df().iloc[:0]
+    assert bio.convert_annotation_df_to_bed(annotDf) == ''
+    assert bio.convert_annotation_df_to_bed(annotDf, bedFormat='bed12') == ''
+    bio.convert_annotation_df_to_bed(annotDf, filepath=tmp_path / 'annot.bed')
+    assert (tmp_path / 'annot.bed').read_text() == ''
+
+
+def test_convert_annotation_df_to_gtf():
+    # Expected output of the previous row-wise implementation
+    assert bio.convert_annotation_df_to_gtf(make_annotation_df()) == \
+        'chr1\t.\tgene\t1\t20\t.\t-\t.\tgene_id "g2"; transcript_id "t2"\n' \
+        'chr1\t.\tCDS\t11\t37\t.\t+\t.\tgene_id "g1"; transcript_id "t1"\n' \
+        'chr1\t.\texon\t11\t37\t.\t+\t.\tgene_id "g1"; transcript_id "t1"\n' \
+        'chr1\t.\ttranscript\t11\t50\t.\t+\t.\ttranscript_id "t1"\n' \
+        'chr2\t.\tCDS\t6\t32\t.\t-\t.\tgene_id "g3"; transcript_id "t3"\n' \
+        'chr2\t.\texon\t6\t32\t.\t-\t.\tgene_id "g3"; transcript_id "t3"\n'
+    assert bio.convert_annotation_df_to_gtf(make_annotation_df(), usePseudoTranscriptOnly=True) == \
+        'chr1\t.\tgene\t1\t20\t.\t-\t.\tgene_id "g2"; transcript_id "tg2"\n' \
+        'chr1\t.\ttranscript\t1\t20\t.\t-\t.\ttranscript_id "tg2"\n' \
+        'chr1\t.\tCDS\t11\t37\t.\t+\t.\tgene_id "g1"; transcript_id "tg1"\n' \
+        'chr1\t.\texon\t11\t37\t.\t+\t.\tgene_id "g1"; transcript_id "tg1"\n' \
+        'chr1\t.\ttranscript\t11\t40\t.\t+\t.\ttranscript_id "tg1"\n' \
+        'chr2\t.\tCDS\t6\t32\t.\t-\t.\tgene_id "g3"; transcript_id "tg3"\n' \
+        'chr2\t.\texon\t6\t32\t.\t-\t.\tgene_id "g3"; transcript_id "tg3"\n' \
+        'chr2\t.\ttranscript\t6\t35\t.\t-\t.\ttranscript_id "tg3"\n'
+
+
+def test_convert_annotation_df_to_gtf_empty(tmp_path):
+    assert bio.convert_annotation_df_to_gtf(make_annotation_df().iloc[:0]) == ''
+    assert bio.convert_annotation_df_to_gtf(make_annotation_df(), featureToIncludeList=['tRNA']) == ''
+    bio.convert_annotation_df_to_gtf(make_annotation_df().iloc[:0], filepath=tmp_path / 'annot.gtf')
+    assert (tmp_path / 'annot.gtf').read_text() == ''
+
+
+
+def make_random_export_annotation_df(n=200, seed=0):
+    """Random annotations with distinct coordinates, some of them given with start > end."""
+    rng = np.random.default_rng(seed)
+    start = rng.permutation(n)*10
+    end = start + rng.integers(3, 300, n)
+    isSwapped = np.arange(n) % 13 == 0
+    return pd.DataFrame({'chromosome':rng.choice(['chr1', 'chr2', 'plasmid'], n), 'id':['g{}'.format(i) for i in range(n)],
+                         'feature':rng.choice(['CDS', 'ncRNA', 'transcript', 'tRNA'], n),
+                         'strand':rng.choice(['+', '-'], n), 'start':np.where(isSwapped, end, start),
+                         'end':np.where(isSwapped, start, end), 'transcript_id_unique':['t{}'.format(i) for i in range(n)]},
+                        index=pd.Index(['r{}'.format(i) for i in range(n)], name='row'))
+
+
+def convert_annotation_df_to_bed_rowwise(df, combineFeatureAndId=False):
+    """Previous row-wise implementation of convert_annotation_df_to_bed."""
+    bedString = ""
+    for _, annot in df.sort_values(by=['start', 'end', 'strand']).iterrows():
+        bedId = "{};{}".format(annot['feature'], annot['id']) if combineFeatureAndId else annot['id']
+        bedStart, bedEnd = sorted([int(annot['start']), int(annot['end'])])
+        bedString += "{}\t{}\t{}\t{}\t{:d}\t{}\n".format(annot['chromosome'], bedStart, bedEnd, bedId, 0,
+                                                          annot['strand'])
+    return bedString
+
+
+def convert_annotation_df_to_gtf_rowwise(df, featureToIncludeList=None, usePseudoTranscriptOnly=False):
+    """Previous row-wise implementation of convert_annotation_df_to_gtf."""
+    def format_line(annot, feature, start, end, attDict):
+        return "{}\t.\t{}\t{}\t{}\t.\t{}\t.\t{}\n".format(
+            annot['chromosome'], feature, start, end, annot['strand'],
+            "; ".join('{} "{}"'.format(key, value) for key, value in attDict.items()))
+
+    gtfString = ""
+    for _, annot in df.sort_values(by=['chromosome', 'start', 'end', 'strand']).iterrows():
+        feature = annot['feature']
+        if featureToIncludeList is not None and feature not in featureToIncludeList:
+            continue
+        start, end = int(annot['start']) + 1, int(annot['end'])
+        if feature == 'transcript' and not usePseudoTranscriptOnly:
+            attDict = {'transcript_id':annot['id']}
+        elif feature == 'CDS':
+            attDict = {'gene_id':annot['id'], 'transcript_id':annot['transcript_id_unique']}
+            end -= 3
+        elif feature == 'ncRNA':
+            feature = 'gene'
+            attDict = {'gene_id':annot['id'], 'transcript_id':annot['transcript_id_unique']}
+        else:
+            attDict = {'transcript_id':annot['transcript_id_unique']}
+        if annot['feature'] != 'transcript' and usePseudoTranscriptOnly:
+            attDict['transcript_id'] = 't' + annot['id']
+        if start > end:
+            start, end = end, start
+        if annot['feature'] != 'transcript' or not usePseudoTranscriptOnly:
+            gtfString += format_line(annot, feature, start, end, attDict)
+        if annot['feature'] == 'CDS':
+            gtfString += format_line(annot, 'exon', start, end, attDict)
+        if annot['feature'] != 'transcript' and usePseudoTranscriptOnly:
+            gtfString += format_line(annot, 'transcript', int(annot['start']) + 1, int(annot['end']),
+                                     {'transcript_id':'t' + annot['id']})
+    return gtfString
+
+
+@pytest.mark.parametrize('combineFeatureAndId', [False, True])
+def test_convert_annotation_df_to_bed_as_rowwise(tmp_path, combineFeatureAndId):
+    annotDf = make_random_export_annotation_df()
+    expected = convert_annotation_df_to_bed_rowwise(annotDf, combineFeatureAndId=combineFeatureAndId)
+    assert bio.convert_annotation_df_to_bed(annotDf, combineFeatureAndId=combineFeatureAndId) == expected
+    bio.convert_annotation_df_to_bed(annotDf, combineFeatureAndId=combineFeatureAndId,
+                                     filepath=tmp_path / 'annot.bed.gz', chunkSize=7)
+    with gzip.open(str(tmp_path / 'annot.bed.gz'), 'rt') as f:
+        assert f.read() == expected
+    # The index is used as id when there is no id column
+    assert bio.convert_annotation_df_to_bed(annotDf.drop(columns='id'), idCol='row') == \
+        convert_annotation_df_to_bed_rowwise(annotDf.assign(id=annotDf.index))
+
+
+@pytest.mark.parametrize('featureToIncludeList', [None, ['CDS', 'tRNA']])
+@pytest.mark.parametrize('usePseudoTranscriptOnly', [False, True])
+def test_convert_annotation_df_to_gtf_as_rowwise(tmp_path, featureToIncludeList, usePseudoTranscriptOnly):
+    annotDf = make_random_export_annotation_df()
+    expected = convert_annotation_df_to_gtf_rowwise(annotDf, featureToIncludeList=featureToIncludeList,
+                                                    usePseudoTranscriptOnly=usePseudoTranscriptOnly)
+    assert bio.convert_annotation_df_to_gtf(annotDf, featureToIncludeList=featureToIncludeList,
+                                            usePseudoTranscriptOnly=usePseudoTranscriptOnly) == expected
+    with open(str(tmp_path / 'annot.gtf'), 'w') as f:
+        bio.convert_annotation_df_to_gtf(annotDf, featureToIncludeList=featureToIncludeList,
+                                         usePseudoTranscriptOnly=usePseudoTranscriptOnly, filepath=f, chunkSize=7)
+    assert (tmp_path / 'annot.gtf').read_text() == expected
+
+def test_import_roesti_expression_df_cached_keeps_coordinates_exact(tmp_path):
+    # Coordinates above 2**24 are not exactly representable in float32
+    pd.DataFrame({'ref':'chr1', 'id':['g1', 'g2'], 'strand':['+', '-'], 'start_cds':[123456789, np.nan],
+                  'end_cds':[123456790, 16777217], 'tpm':[0.5, 1.5]}).to_csv(str(tmp_path / 'S0.CDS_values.csv'))
+    pd.DataFrame({'ref':'chr1', 'id':['g1'], 'strand':['+'], 'start_cds':[123456789], 'end_cds':[123456790],
+                  'tpm':[2.5]}).to_csv(str(tmp_path / 'S1.CDS_values.csv'))
+    sampleDf = pd.DataFrame({'sample':['a', 'b'], 'replicate':[1, 1], 'path':str(tmp_path),
+                             'sample_filename_prefix':['S0', 'S1']})
+
+    for i in range(2):
+        rnaDf = bio.import_roesti_expression_df_cached(sampleDf, cacheFilepath=tmp_path / 'cache.parquet',
+                                                       nThreads=2, verbose=0)
+        assert rnaDf['start_cds'].tolist() == [123456789, pd.NA, 123456789]
+        assert rnaDf['end_cds'].tolist() == [123456790, 16777217, 123456790]
+        assert rnaDf['tpm'].dtype == np.float32
+
+
+def test_convert_df_to_fasta_wraps_as_textwrap():
+    seqList = ['ACGT'*40, 'AC-GT'*30, 'ACGT ACGT'*20, '', 'M'*70]
+    df = pd.DataFrame({'seq':seqList, 'name':['a', 'b', None, 'd', 'e'], 'n':[1, 2, 3, 4, 5]})
+    # Expected output of the previous row-wise implementation
+    expectedRecordList = ['>{}|{}\n{}'.format('' if pd.isnull(name) else name, n, textwrap.fill(seq, 70))
+                          for seq, name, n in zip(seqList, df['name'], df['n'])]
+
+    assert bio.convert_df_to_fasta(df, 'seq', idColList=['name', 'n']) == '\n'.join(expectedRecordList)
+    assert bio.convert_df_to_fasta(df, 'seq', wrap_sequence=False).split('\n')[1::2] == seqList
+
+
+
+def test_write_df_to_fasta_as_convert_df_to_fasta(tmp_path):
+    rng = np.random.default_rng(0)
+    seqList = [''.join(rng.choice(list('ACDEFGHIKLMNPQRSTVWY'), length)) for length in rng.integers(0, 300, 50)]
+    df = pd.DataFrame({'seq':seqList, 'name':['p{}'.format(i) for i in range(50)], 'n':np.arange(50)},
+                      index=pd.Index(['r{}'.format(i) for i in range(50)], name='row'))
+    fastaString = bio.convert_df_to_fasta(df, 'seq', idColList=['name', 'n'])
+
+    assert bio.write_df_to_fasta(df, 'seq', tmp_path / 'seq.fasta.gz', idColList=['name', 'n'], chunkSize=7) == 50
+    with gzip.open(str(tmp_path / 'seq.fasta.gz'), 'rt') as f:
+        assert f.read() == fastaString + '\n'
+    with gzip.open(str(tmp_path / 'seq.fasta.gz'), 'rt') as f:
+        assert [(record.id, str(record.seq)) for record in SeqIO.parse(f, 'fasta')] == \
+            [('p{}|{}'.format(i, i), seq) for i, seq in enumerate(seqList)]
+    with open(str(tmp_path / 'seq.fasta'), 'w') as f:
+        bio.write_df_to_fasta(df, 'seq', f, wrap_sequence=False)
+    assert (tmp_path / 'seq.fasta').read_text() == \
+        ''.join('>r{}\n{}\n'.format(i, seq) for i, seq in enumerate(seqList))
+
+    # A series is a single record
+    assert bio.convert_df_to_fasta(df.iloc[3], 'seq', idColList=['name']) == '>p3\n' + textwrap.fill(seqList[3], 70)
+
+
+def test_convert_df_to_fasta_empty(tmp_path, capsys):
+    df = pd.DataFrame({'seq':[], 'name':[]})
+    assert bio.convert_df_to_fasta(df, 'seq') is None
+    assert 'length zero' in capsys.readouterr().out
+    assert bio.write_df_to_fasta(df, 'seq', tmp_path / 'seq.fasta') == 0
+    assert (tmp_path / 'seq.fasta').read_text() == ''
+
+# find_ORFs translates the frames with a trailing partial codon
+@pytest.mark.filterwarnings('ignore::Bio.BiopythonWarning')
+def test_packed_sequence_in_single_sequence_functions():
+    record = make_genbank_record()
+    packedSeq = bio.PackedSequence(record)
+    codonTable = CodonTable.unambiguous_dna_by_id[11]
+
+    annot = pd.Series({'id':'T1', 'feature':'CDS', 'strand':'-', 'start':100, 'end':166})
+    assert bio.extract_dna_seq(annot, packedSeq) == bio.extract_dna_seq(annot, record)
+    assert bio.extract_protein_seq(annot, packedSeq) == bio.extract_protein_seq(annot, record)
+    ORFList = bio.find_ORFs(packedSeq[:1000], codonTable)
+    assert [(str(ORF.location), str(ORF.qualifiers['translation'])) for ORF in ORFList] == \
+        [(str(ORF.location), str(ORF.qualifiers['translation'])) for ORF in bio.find_ORFs(record.seq[:1000], codonTable)]
+    assert bio.find_triplet_in_sequence_in_frames(packedSeq[:200], 'ATG') == \
+        bio.find_triplet_in_sequence_in_frames(str(record.seq[:200]), 'ATG')
+    assert bio.pretty_print_mRNA(packedSeq[:100], 1, 90, 4, 40, '+') == \
+        bio.pretty_print_mRNA(record[:100], 1, 90, 4, 40, '+')
+
+
+def test_packed_genome_from_mapping():
+    packedGenome = bio.PackedGenome([make_genbank_record('NC_1.1'), make_genbank_record('NC_2.1', seed=1)])
+    packedGenome2 = bio.PackedGenome(packedGenome)
+    assert list(packedGenome2) == ['NC_1.1', 'NC_2.1']
+    assert str(packedGenome2['NC_2.1']) == str(packedGenome['NC_2.1'])
+
+
+def make_random_annotation_df(n, seed=0, length=2000):
+    """Random annotations, with nested, zero-length and missing intervals."""
+    rng = np.random.default_rng(seed)
+    start = rng.integers(0, length, n)
+    end = start + rng.choice([0, 1, 5, 50, 500], n)
+    annotDf = pd.DataFrame({'chromosome':rng.choice(['chr1', 'chr2'], n), 'start':start.astype(float),
+                            'end':end.astype(float), 'strand':rng.choice(['+', '-'], n)},
+                           index=['a{}'.format(i) for i in range(n)])
+    annotDf.iloc[::17, annotDf.columns.get_loc('start')] = np.nan
+    return annotDf
+
+
+def find_annotations_in_region_overlapping(annotDf, start, end, strand, strand_specific=True):
+    return [annot for annot in bio.find_annotations_in_region(annotDf, start, end, strand,
+                                                              strand_specific=strand_specific)
+            if annot['overlap_type'] not in ['no_overlap', None]]
+
+
+def test_annotation_index_query_as_find_annotations_in_region():
+    annotDf = make_random_annotation_df(300)
+    regionDf = make_random_annotation_df(60, seed=1)
+    annotIndex = bio.AnnotationIndex(annotDf)
+    for strand_specific in [True, False]:
+        for region in regionDf.dropna().itertuples():
+            assert annotIndex.query(int(region.start), int(region.end), region.strand,
+                                    strand_specific=strand_specific) == \
+                find_annotations_in_region_overlapping(annotDf, region.start, region.end, region.strand,
+                                                       strand_specific=strand_specific)
+
+
+def test_annotation_index_by_chromosome():
+    annotDf = make_random_annotation_df(300)
+    annotIndex = bio.AnnotationIndex(annotDf, chromosomeCol='chromosome')
+    chr2Df = annotDf[annotDf['chromosome'] == 'chr2']
+    assert annotIndex.query(100, 900, '+', chromosome='chr2') == \
+        find_annotations_in_region_overlapping(chr2Df, 100, 900, '+')
+
+
+def test_annotation_index_empty():
+    annotIndex = bio.AnnotationIndex(make_random_annotation_df(10).iloc[:0])
+    assert len(annotIndex) == 0
+    assert annotIndex.query(0, 100, '+') == []
+    assert bio.AnnotationIndex(make_random_annotation_df(10)).query(50, 50, '+') == []
+
+
+def test_find_annotation_overlaps_as_find_annotations_in_region():
+    annotDf = make_random_annotation_df(300)
+    regionDf = make_random_annotation_df(60, seed=1)
+    for strand_specific in [True, False]:
+        overlapDf = bio.find_annotation_overlaps(regionDf, annotDf, strand_specific=strand_specific)
+        expectedList = [dict(annot, region_id=region.Index)
+                        for region in regionDf.dropna().itertuples()
+                        for annot in find_annotations_in_region_overlapping(annotDf, region.start, region.end,
+                                                                            region.strand, strand_specific)]
+        assert overlapDf[['region_id', 'id', 'overlap_type', 'overlap_length', 'strand']].to_dict('records') == \
+            [{key:row[key] for key in ['region_id', 'id', 'overlap_type', 'overlap_length', 'strand']}
+             for row in expectedList]
+
+
+def test_find_annotation_overlaps_by_chromosome():
+    annotDf = make_random_annotation_df(300)
+    regionDf = make_random_annotation_df(60, seed=1).dropna()
+    overlapDf = bio.find_annotation_overlaps(regionDf, annotDf, chromosomeCol='chromosome')
+    regionChromosomeS = regionDf.loc[overlapDf['region_id'], 'chromosome'].values
+    assert (annotDf.loc[overlapDf['id'], 'chromosome'].values == regionChromosomeS).all()
+    assert len(overlapDf) == sum(len(bio.find_annotation_overlaps(regionDf[regionDf['chromosome'] == chromosome],
+                                                                  annotDf[annotDf['chromosome'] == chromosome]))
+                                 for chromosome in ['chr1', 'chr2'])
+
+
+def test_find_annotation_overlaps_empty():
+    annotDf = make_random_annotation_df(50)
+    columnList = ['region_id', 'id', 'overlap_type', 'overlap_length', 'strand']
+    assert bio.find_annotation_overlaps(annotDf.iloc[:0], annotDf).columns.tolist() == columnList
+    assert len(bio.find_annotation_overlaps(annotDf.iloc[:0], annotDf)) == 0
+    assert len(bio.find_annotation_overlaps(annotDf, annotDf.iloc[:0])) == 0
+
+
+def make_wetlab_coordinate_df():
+    return pd.DataFrame({'start':[1, 20, np.nan, 5], 'end':[10, 11, 3, 5], 'strand':[1, -1, '+', '-'],
+                         'id':['a', 'b', 'c', 'd']})
+
+
+def apply_row_conversion(df, convert_function, **kwargs):
+    rowList = [convert_function(row, **kwargs) for _, row in df.iterrows()]
+    return [(row['start'], row['end'], row['strand']) for row in rowList]
+
+
+def get_coordinate_tuples(df):
+    return [tuple(None if pd.isnull(value) else value for value in row)
+            for row in zip(df['start'], df['end'], df['strand'])]
+
+
+@pytest.mark.parametrize('detect_strand', [False, True])
+def test_convert_index_1b_inc_inc_to_0b_inc_exc_df(detect_strand):
+    df = make_wetlab_coordinate_df()
+    convertedDf = bio.convert_index_1b_inc_inc_to_0b_inc_exc_df(df, detect_strand=detect_strand)
+    assert get_coordinate_tuples(convertedDf) == \
+        apply_row_conversion(df, bio.convert_index_1b_inc_inc_to_0b_inc_exc, detect_strand=detect_strand)
+    assert convertedDf['id'].tolist() == df['id'].tolist()
+
+
+def test_convert_index_1b_inc_inc_to_0b_inc_inc_df():
+    df = make_wetlab_coordinate_df()
+    assert get_coordinate_tuples(bio.convert_index_1b_inc_inc_to_0b_inc_inc_df(df)) == \
+        apply_row_conversion(df, bio.convert_index_1b_inc_inc_to_0b_inc_inc)
+
+
+def test_convert_index_0b_inc_exc_to_1b_inc_inc_df():
+    df = pd.DataFrame({'start':[0, 10, np.nan], 'end':[10, 20, 5], 'strand':['+', '-', '+']})
+    assert get_coordinate_tuples(bio.convert_index_0b_inc_exc_to_1b_inc_inc_df(df)) == \
+        apply_row_conversion(df, bio.convert_index_0b_inc_exc_to_1b_inc_inc)
+    with pytest.raises(ValueError):
+        bio.convert_index_0b_inc_exc_to_1b_inc_inc_df(pd.DataFrame({'start':[5], 'end':[5], 'strand':['+']}))
+
+
+def test_convert_index_df_empty():
+    df = make_wetlab_coordinate_df().iloc[:0]
+    for convert_function in [bio.convert_index_1b_inc_inc_to_0b_inc_exc_df, bio.convert_index_0b_inc_exc_to_1b_inc_inc_df,
+                             bio.convert_index_1b_inc_inc_to_0b_inc_inc_df]:
+        convertedDf = convert_function(df)
+        assert len(convertedDf) == 0
+        assert convertedDf.columns.tolist() == df.columns.tolist()
+
+
+def translate_biopython(seq, codonTable, cds=True, cdsFallback=True):
+    """Translation of the previous implementation, one sequence at a time with Biopython."""
+    if seq is None:
+        return None
+    if cds:
+        try:
+            return str(Seq(seq).translate(table=codonTable, cds=True))
+        except TranslationError:
+            if not cdsFallback:
+                return None
+    try:
+        with warnings.catch_warnings():
+            # Partial codon warning
+            warnings.simplefilter('ignore')
+            return str(Seq(seq).translate(table=codonTable, cds=False))
+    except TranslationError:
+        return None
+
+
+def make_translation_seq_list(seed=0):
+    rng = np.random.default_rng(seed)
+    def random_codons(n):
+        return ''.join(rng.choice(['GCT', 'AAA', 'TTT', 'GGC', 'CTG', 'TGA', 'TGG'], n))
+    seqList = ['ATG' + random_codons(20).replace('TGA', 'TCA') + 'TAA',    # CDS
+               'GTG' + random_codons(10).replace('TGA', 'TCA') + 'TAG',    # Alternative start codon
+               'ATG' + random_codons(20) + 'TAA',                          # Internal stop codons (TGA in table 11)
+               'ATG' + random_codons(10).replace('TGA', 'TCA') + 'TAAC',   # Length not multiple of 3
+               'atgaaatttggctaa',                                          # Lower case
+               'ATGCTNAAATAA', 'ATGNNNTAA', 'CTNCTNA', 'ATGAAA-TAA',       # Ambiguous and invalid letters
+               'ATG', 'TAA', 'AT', '', None]
+    return seqList + [random_codons(15) for i in range(10)]
+
+
+@pytest.mark.parametrize('codonTable', [11, 4, bio.codonTableBioMPN])
+@pytest.mark.parametrize('cds, cdsFallback', [(True, True), (True, False), (False, True)])
+def test_translate_dna_seq_batch_as_biopython(codonTable, cds, cdsFallback):
+    seqList = make_translation_seq_list()
+    assert bio.translate_dna_seq_batch(seqList, codonTable=codonTable, cds=cds, cdsFallback=cdsFallback) == \
+        [translate_biopython(seq, codonTable, cds=cds, cdsFallback=cdsFallback) for seq in seqList]
+
+
+def test_translate_dna_seq_batch_codon_start():
+    seqList = make_translation_seq_list()
+    codonStartList = [1 + i % 3 for i in range(len(seqList))]
+    assert bio.translate_dna_seq_batch(seqList, codonTable=11, codonStartList=codonStartList) == \
+        [translate_biopython(seq[codonStart - 1:] if seq is not None else None, 11)
+         for seq, codonStart in zip(seqList, codonStartList)]
+
+
+def test_translate_dna_seq_batch_empty():
+    assert bio.translate_dna_seq_batch([], codonTable=11) == []
+    assert bio.translate_dna_seq_batch([None, ''], codonTable=11) == [None, '']
+
+
+def get_ORF_tuples(ORFList):
+    return sorted((int(ORF.location.start), int(ORF.location.end), '+' if ORF.location.strand == 1 else '-',
+                   str(ORF.qualifiers['start_codon']), str(ORF.qualifiers['stop_codon']),
+                   str(ORF.qualifiers['translation'])) for ORF in ORFList)
+
+
+@pytest.mark.filterwarnings('ignore::Bio.BiopythonWarning')
+@pytest.mark.parametrize('length', [0, 2, 3, 300, 301, 302])
+def test_find_ORFs_df_as_find_ORFs(length):
+    seq = ''.join(np.random.default_rng(length).choice(list('ACGT'), length))
+    codonTable = CodonTable.unambiguous_dna_by_id[11]
+    ORFDf = bio.find_ORFs_df(seq, codonTable, translate=True)
+    assert sorted(zip(ORFDf['start'], ORFDf['end'], ORFDf['strand'], ORFDf['start_codon'], ORFDf['stop_codon'],
+                      ORFDf['translation'])) == get_ORF_tuples(bio.find_ORFs(Seq(seq), codonTable))
+    assert ORFDf.columns.tolist() == ['start', 'end', 'strand', 'frame', 'start_codon', 'stop_codon', 'length',
+                                      'translation']
+
+
+def test_find_ORFs_df_longest_only():
+    seq = ''.join(np.random.default_rng(0).choice(list('ACGT'), 3000))
+    ORFDf = bio.find_ORFs_df(seq, 11)
+    longestORFDf = bio.find_ORFs_df(bio.PackedSequence(seq), 11, longestOnly=True, minLength=30)
+    # The longest ORF of each stop codon is the one with the first start codon
+    stopKeyS = ORFDf['strand'] + ORFDf['start'].where(ORFDf['strand'] == '-', ORFDf['end']).astype(str)
+    expectedDf = ORFDf.loc[ORFDf.groupby(stopKeyS)['length'].idxmax()]
+    expectedDf = expectedDf[expectedDf['length'] >= 30]
+    assert sorted(zip(longestORFDf['start'], longestORFDf['end'], longestORFDf['strand'])) == \
+        sorted(zip(expectedDf['start'], expectedDf['end'], expectedDf['strand']))
+
+
+@pytest.mark.parametrize('nJobs', [1, 2])
+def test_convert_genbank_file_to_annotation_df(tmp_path, nJobs):
+    recordList = [make_genbank_record('NC_1.1'), make_genbank_record('NC_2.1', seed=1)]
+    write_compressed_genbank_file(tmp_path / 'genome.gbff.gz', recordList)
+    expectedDf = pd.concat([bio.convert_genbank_to_annotation_df(record, True, True, verbose=0)
+                            for record in recordList], ignore_index=True)
+
+    annotDf = bio.convert_genbank_file_to_annotation_df(tmp_path / 'genome.gbff.gz', True, True, nJobs=nJobs,
+                                                        maxPendingRecords=1, verbose=0)
+    pd.testing.assert_frame_equal(annotDf, expectedDf)
+    CDSDf = annotDf[annotDf['feature'] == 'CDS']
+    assert CDSDf['protein_seq'].tolist() == [str(Seq(seq).translate(table=11, cds=True)) for seq in CDSDf['DNA_seq']]
+    assert len(CDSDf) == 40
+    with bio.open_compressed_genome_file('genome.gbff.gz', tmp_path) as f:
+        pd.testing.assert_frame_equal(bio.convert_genbank_file_to_annotation_df(f, True, True, verbose=0), expectedDf)
+
+
+def test_convert_genbank_file_to_annotation_df_empty(tmp_path):
+    (tmp_path / 'empty.gbff').write_text('')
+    annotDf = bio.convert_genbank_file_to_annotation_df(tmp_path / 'empty.gbff', verbose=0)
+    assert len(annotDf) == 0
+    assert annotDf.columns.tolist() == bio._annotationDfColumnList
+
+
+def find_motif_context_tuples(seqS, motifList, nUp, nDown, onlyFirstMatch=False):
+    tupleList = []
+    for seqId, seq in seqS.items():
+        for motif in motifList:
+            positionList = [match.start() for match in re.finditer(motif, seq)]
+            contextList = bio.find_motif_context_in_sequence(seq, motif, nUp, nDown, onlyFirstMatch=onlyFirstMatch)
+            tupleList.extend((seqId, motif, position, context)
+                             for position, context in zip(positionList, contextList))
+    return tupleList
+
+
+@pytest.mark.parametrize('onlyFirstMatch', [False, True])
+@pytest.mark.parametrize('nJobs', [1, 2])
+def test_find_motif_context_batch_as_find_motif_context_in_sequence(onlyFirstMatch, nJobs):
+    rng = np.random.default_rng(0)
+    seqS = pd.Series([''.join(rng.choice(list('PAGK'), rng.integers(0, 80))) for i in range(50)] + ['PPPPPP', 'P'],
+                     index=['seq{}'.format(i) for i in range(52)])
+    # Nested and overlapping literal motifs, and a regular expression
+    motifList = ['PP', 'PPP', 'GPP', 'AK', 'P[AG]P']
+
+    motifDf = bio.find_motif_context_batch(seqS, motifList + ['PP'], 4, 3, onlyFirstMatch=onlyFirstMatch,
+                                           nJobs=nJobs, chunkSize=7)
+    assert list(motifDf.itertuples(index=False, name=None)) == \
+        find_motif_context_tuples(seqS, motifList, 4, 3, onlyFirstMatch=onlyFirstMatch)
+    assert motifDf.columns.tolist() == ['sequence_id', 'motif', 'position', 'context']
+    assert bio._motifWorkerState == {}
+
+
+def test_find_motif_context_batch_empty():
+    assert len(bio.find_motif_context_batch([], ['PP'], 4, 3)) == 0
+    assert len(bio.find_motif_context_batch(['', 'AAA'], ['PP'], 4, 3)) == 0
+    with pytest.raises(ValueError):
+        bio.find_motif_context_batch(['AAA'], [''], 4, 3)
+
+
+def make_CDS_df(n=20, seed=0):
+    rng = np.random.default_rng(seed)
+    proteinLength = rng.integers(1, 60, n)
+    start = rng.integers(0, 10000, n)
+    return pd.DataFrame({'start':start, 'end':start + 3*proteinLength + 3,
+                         'strand':np.where(np.arange(n) % 2 == 0, '+', '-'),
+                         'protein_seq':[''.join(rng.choice(list('ACDEFGHIKLMNPQRSTVWY'), length))
+                                        for length in proteinLength]})
+
+
+@pytest.mark.parametrize('window', [(0, 1), (5, 8), (100, 100)])
+def test_get_context_window_batch_as_get_context_window(window):
+    windowContextUp, windowContextDown = window
+    CDSDf = make_CDS_df()
+    rng = np.random.default_rng(1)
+    CDSIndex = rng.integers(0, len(CDSDf), 200)
+    codonPos = rng.integers(0, CDSDf['protein_seq'].str.len().to_numpy()[CDSIndex])
+    expectedDf = pd.DataFrame([bio.get_context_window(pos, CDSDf.iloc[i], windowContextUp, windowContextDown)
+                               for pos, i in zip(codonPos, CDSIndex)])
+
+    contextDf = bio.get_context_window_batch(codonPos, CDSDf, windowContextUp, windowContextDown, CDSIndex=CDSIndex)
+    pd.testing.assert_frame_equal(contextDf, expectedDf, check_dtype=False)
+    alignedContextDf = bio.get_context_window_batch(codonPos, CDSDf.iloc[CDSIndex], windowContextUp, windowContextDown)
+    pd.testing.assert_frame_equal(alignedContextDf, contextDf)
+
+    charContextDf, charMatrix = bio.get_context_window_batch(codonPos, CDSDf, windowContextUp, windowContextDown,
+                                                             CDSIndex=CDSIndex, asCharMatrix=True)
+    pd.testing.assert_frame_equal(charContextDf, contextDf.drop(columns='context_window_protein_seq'))
+    assert charMatrix.shape == (len(codonPos), windowContextUp + windowContextDown)
+    for row, context, posInContext in zip(charMatrix, contextDf['context_window_protein_seq'],
+                                          contextDf['codon_pos_in_context']):
+        padUp = windowContextUp - posInContext
+        assert row.tobytes().decode() == ('-'*padUp + context).ljust(windowContextUp + windowContextDown, '-')
+
+
+def test_get_context_window_batch_empty():
+    CDSDf = make_CDS_df()
+    contextDf = bio.get_context_window_batch([], CDSDf, 5, 8, CDSIndex=[])
+    assert len(contextDf) == 0
+    contextDf, charMatrix = bio.get_context_window_batch([], CDSDf.iloc[:0], 5, 8, asCharMatrix=True)
+    assert len(contextDf) == 0
+    assert charMatrix.shape == (0, 13)
+    with pytest.raises(ValueError):
+        bio.get_context_window_batch([0, 1], CDSDf, 5, 8)
+
+
+def build_refCodonTable_loop(codonTableBio):
+    """Reference codon table, built codon by codon and grouped by amino acid."""
+    aaTable = ['R', 'K', 'H', 'D', 'E', 'S', 'T', 'N', 'Q', 'C', 'G', 'P', 'A', 'I', 'L', 'M', 'F', 'W', 'Y', 'V']
+    letters = ['T', 'C', 'A', 'G']
+    rowList = []
+    for k2, c2 in enumerate(letters):
+        for k1, c1 in enumerate(letters):
+            for k3, c3 in enumerate(letters):
+                codon = c1 + c2 + c3
+                if codon in codonTableBio.stop_codons:
+                    aa = '*'
+                else:
+                    aa = codonTableBio.forward_table.get(codon, '?')
+                rowList.append((codon, aa, 4*k1 + k3 + 1, 2*k2 + 1, len(rowList)))
+    aaTable2 = aaTable + [aa for aa in dict.fromkeys(row[1] for row in rowList) if aa not in aaTable]
+    return [row for aa in aaTable2 for row in rowList if row[1] == aa]
+
+
+@pytest.mark.parametrize('codonTableBio', [CodonTable.unambiguous_dna_by_id[11], CodonTable.unambiguous_dna_by_id[4],
+                                           bio.codonTableBioMPN])
+def test_build_refCodonTable_as_loop(codonTableBio):
+    refCodonTableDf = bio.build_refCodonTable(codonTableBio)
+    assert list(zip(refCodonTableDf.index, refCodonTableDf['aa'], refCodonTableDf['i'], refCodonTableDf['j'],
+                    refCodonTableDf['alphabetical_sorted_index'])) == build_refCodonTable_loop(codonTableBio)
+    assert refCodonTableDf['aa_groups_sorted_index'].tolist() == list(range(64))
+
+    # The cached table is not modified through the returned copy
+    refCodonTableDf['aa'] = '?'
+    assert list(bio.build_refCodonTable(codonTableBio)['aa']) == [row[1] for row in build_refCodonTable_loop(codonTableBio)]
+
+
+@pytest.mark.parametrize('addAminoAcidLetterToIndex', [False, True])
+@pytest.mark.parametrize('useULetter', [False, True])
+def test_sort_codon_index(addAminoAcidLetterToIndex, useULetter):
+    refCodonTableDf = bio.build_refCodonTable(CodonTable.unambiguous_dna_by_id[11])
+    rng = np.random.default_rng(0)
+    codonArr = rng.permutation(refCodonTableDf.index.values)[:50]
+    df = pd.DataFrame({'count':rng.random(50)}, index=pd.Index(codonArr, name='codon'))
+    dfCopy = df.copy()
+
+    sortedDf = bio.sort_codon_index(df, refCodonTableDf, addAminoAcidLetterToIndex=addAminoAcidLetterToIndex,
+                                    addAminoAcidLetterAsColumn=True, useULetter=useULetter)
+    pd.testing.assert_frame_equal(df, dfCopy)
+    expectedCodonList = [codon for codon in refCodonTableDf.index if codon in set(codonArr)]
+    aaDict = refCodonTableDf['aa'].to_dict()
+    expectedLabelList = [codon.replace('T', 'U') if useULetter else codon for codon in expectedCodonList]
+    if addAminoAcidLetterToIndex:
+        expectedLabelList = [aaDict[codon] + '/' + label for codon, label in zip(expectedCodonList, expectedLabelList)]
+    assert sortedDf.index.tolist() == expectedLabelList
+    assert sortedDf.index.name == 'codon'
+    assert sortedDf['count'].tolist() == df['count'].loc[expectedCodonList].tolist()
+    assert sortedDf['aa'].tolist() == [aaDict[codon] for codon in expectedCodonList]
+
+
+def test_sort_codon_index_empty_row_between_groups():
+    refCodonTableDf = bio.build_refCodonTable(CodonTable.unambiguous_dna_by_id[11])
+    df = pd.DataFrame({'count':np.arange(64.)}, index=refCodonTableDf.index[::-1])
+    sortedDf = bio.sort_codon_index(df, refCodonTableDf, addEmptyRowBetweenGroups=True,
+                                    addEmptyRowBetweenGroupsFillValue=-1.)
+    aaList = list(dict.fromkeys(refCodonTableDf['aa']))
+    expectedLabelList = []
+    for aa in aaList:
+        expectedLabelList += [aa + '/' + codon.replace('T', 'U')
+                              for codon in refCodonTableDf.index[refCodonTableDf['aa'] == aa]] + ['']
+    assert sortedDf.index.tolist() == expectedLabelList
+    assert (sortedDf.loc[[''], 'count'] == -1.).all()
+    assert sortedDf.columns.tolist() == ['count']
+
+    with pytest.raises(ValueError):
+        bio.sort_codon_index(pd.DataFrame({'count':[1.]}, index=['XYZ']), refCodonTableDf)
+
+
+def find_triplet_tuples(seqS, tripletList):
+    tupleList = []
+    for seqId, seq in seqS.items():
+        for triplet in tripletList:
+            for frame, matchList in enumerate(bio.find_triplet_in_sequence_in_frames(str(seq), triplet)):
+                tupleList.extend((seqId, triplet, frame, match['codon_pos'], match['nucleotide_pos'])
+                                 for match in matchList)
+    return sorted(tupleList, key=lambda t: (list(seqS.index).index(t[0]), t[4]))
+
+
+def test_find_triplets_in_sequences_as_find_triplet_in_sequence_in_frames():
+    rng = np.random.default_rng(0)
+    seqList = [''.join(rng.choice(list('ACGT'), length)) for length in list(range(8)) + [50, 51, 52, 300]]
+    seqList += ['ATGNATGAT', 'ATGTAAATG']
+    seqS = pd.Series(seqList, index=['seq{}'.format(i) for i in range(len(seqList))])
+    tripletList = ['ATG', 'TAA', 'TGA']
+
+    tripletDf = bio.find_triplets_in_sequences(seqS, tripletList + ['ATG'])
+    assert list(tripletDf.itertuples(index=False, name=None)) == find_triplet_tuples(seqS, tripletList)
+    assert tripletDf.columns.tolist() == ['seq_id', 'triplet', 'frame', 'codon_pos', 'nucleotide_pos']
+
+    # Sequences as Seq, PackedSequence or lower case, and a single triplet
+    otherSeqS = pd.Series([Seq(seqList[-4]), bio.PackedSequence(seqList[-3]), seqList[-2].lower()], index=seqS.index[-4:-1])
+    tripletDf = bio.find_triplets_in_sequences(otherSeqS, 'ATG')
+    assert list(tripletDf.itertuples(index=False, name=None)) == find_triplet_tuples(seqS.iloc[-4:-1], ['ATG'])
+
+
+def test_find_triplets_in_sequences_empty():
+    assert len(bio.find_triplets_in_sequences([], ['ATG'])) == 0
+    assert len(bio.find_triplets_in_sequences(['', 'AT', 'CCC'], ['ATG'])) == 0
+    for triplet in ['AT', 'ATGA', 'ANG']:
+        with pytest.raises(ValueError):
+            bio.find_triplets_in_sequences(['ATG'], triplet)
+
+
+@pytest.mark.parametrize('nJobs', [1, 2])
+def test_extract_compressed_genome_files(tmp_path, capsys, nJobs):
+    compressedFolder, extractedFolder = tmp_path / 'compressed', tmp_path / 'extracted'
+    compressedFolder.mkdir()
+    extractedFolder.mkdir()
+    contentDict = {}
+    for i in range(3):
+        filename = 'GCF_{}.gbff'.format(i)
+        contentDict[filename] = os.urandom(3000 + 1000*i)
+        with gzip.open(str(compressedFolder / (filename + '.gz')), 'wb') as f:
+            f.write(contentDict[filename])
+    compressedFilenameList = [filename + '.gz' for filename in contentDict]
+
+    filenameList = bio.extract_compressed_genome_files(compressedFilenameList, compressedFolder, extractedFolder,
+                                                       nJobs=nJobs, chunkSize=1000)
+    assert filenameList == list(contentDict)
+    assert sorted(os.listdir(extractedFolder)) == sorted(contentDict)
+    for filename, content in contentDict.items():
+        assert (extractedFolder / filename).read_bytes() == content
+    assert 'extracted: 3 skipped (up to date): 0' in capsys.readouterr().out
+
+    # Up to date files are skipped, unless the compressed file is newer or overwrite is True
+    os.utime(extractedFolder / 'GCF_0.gbff', (0, 0))
+    (extractedFolder / 'GCF_1.gbff').write_bytes(b'')
+    assert bio.extract_compressed_genome_files(compressedFilenameList, compressedFolder, extractedFolder,
+                                               nJobs=nJobs) == filenameList
+    assert 'extracted: 1 skipped (up to date): 2' in capsys.readouterr().out
+    assert (extractedFolder / 'GCF_0.gbff').read_bytes() == contentDict['GCF_0.gbff']
+    assert (extractedFolder / 'GCF_1.gbff').read_bytes() == b''
+    bio.extract_compressed_genome_files(compressedFilenameList, compressedFolder, extractedFolder, nJobs=nJobs,
+                                        overwrite=True, verbose=0)
+    assert (extractedFolder / 'GCF_1.gbff').read_bytes() == contentDict['GCF_1.gbff']
+    assert sorted(os.listdir(extractedFolder)) == sorted(contentDict)
+
+
+def test_extract_compressed_genome_file_interrupted(tmp_path):
+    (tmp_path / 'GCF_0.gbff.gz').write_bytes(gzip.compress(b'LOCUS' * 1000)[:-20])
+    with pytest.raises(EOFError):
+        bio.extract_compressed_genome_file('GCF_0.gbff.gz', tmp_path, tmp_path)
+    assert os.listdir(tmp_path) == ['GCF_0.gbff.gz']
+    assert bio.extract_compressed_genome_files([], tmp_path, tmp_path, verbose=0) == []
+
+
+def get_interval_coverage(covArr, annotDf, stat, strand_specific=True):
+    """Coverage statistic over each annotation, computed on the slice of the coverage array. Annotations
+    without strand get the coverage of both strands."""
+    valueList = []
+    for start, end, strand in zip(annotDf['start'], annotDf['end'], annotDf['strand']):
+        if pd.isnull(start) or pd.isnull(end):
+            valueList.append(np.nan)
+            continue
+        covSlice = covArr[:, int(start):int(end)]
+        if strand_specific and strand in ['+', '-']:
+            covSlice = covSlice[0 if strand == '+' else 1]
+        value = covSlice.sum()
+        if stat == 'mean':
+            value = value / covSlice.shape[-1] if covSlice.shape[-1] > 0 else np.nan
+        valueList.append(value)
+    return np.array(valueList)
+
+
+@pytest.mark.parametrize('stat', ['sum', 'mean'])
+@pytest.mark.parametrize('strand_specific', [False, True])
+def test_coverage_interval_query_as_coverage_slices(stat, strand_specific):
+    rng = np.random.default_rng(0)
+    covArrList = [rng.integers(0, 100, (2, 1500)).astype(np.float32) for i in range(3)]
+    annotDf = make_random_annotation_df(300)
+    annotDf.iloc[5, annotDf.columns.get_loc('strand')] = None
+
+    covDf = bio.CoverageIntervalQuery(covArrList[0]).query_annotation_df(annotDf, stat=stat,
+                                                                         strand_specific=strand_specific)
+    assert covDf.columns.tolist() == ['coverage_' + stat]
+    assert covDf.index.equals(annotDf.index)
+    np.testing.assert_allclose(covDf['coverage_' + stat],
+                               get_interval_coverage(covArrList[0], annotDf, stat, strand_specific=strand_specific))
+
+    # Coverage store with several samples
+    store = bio.CoverageStore(np.stack(covArrList), pd.DataFrame({'sample':['a', 'a', 'b'], 'replicate':[1, 2, 1],
+                                                                  'ref':'NC_000001.1'}))
+    storeCovDf = bio.CoverageIntervalQuery(store).query_annotation_df(annotDf, stat=stat,
+                                                                      strand_specific=strand_specific)
+    assert storeCovDf.columns.tolist() == [('a', 1), ('a', 2), ('b', 1)]
+    np.testing.assert_allclose(storeCovDf[('a', 1)], covDf['coverage_' + stat])
+    for covArr, column in zip(covArrList, storeCovDf.columns):
+        np.testing.assert_allclose(storeCovDf[column], bio.CoverageIntervalQuery(covArr).query_annotation_df(
+            annotDf, stat=stat, strand_specific=strand_specific)['coverage_' + stat])
+
+
+def test_coverage_interval_query_from_coverage_dataframe():
+    rng = np.random.default_rng(0)
+    position = np.sort(rng.choice(np.arange(1, 1000), 300, replace=False))
+    covDf = pd.DataFrame({'position':position, 'coverage_p':rng.integers(0, 100, 300),
+                          'coverage_m':rng.integers(0, 100, 300)})
+    covArr = np.zeros((2, 1000))
+    covArr[0, position] = covDf['coverage_p']
+    covArr[1, position] = covDf['coverage_m']
+    start = rng.integers(-10, 1000, 50)
+    end = start + rng.integers(0, 100, 50)
+    strand = rng.choice(['+', '-'], 50)
+
+    totalArr = bio.CoverageIntervalQuery(covDf).query(start, end, strand)
+    assert totalArr.shape == (1, 50)
+    np.testing.assert_allclose(totalArr[0], bio.CoverageIntervalQuery(covArr).query(start, end, strand)[0])
+    np.testing.assert_allclose(totalArr[0], [covArr[0 if s == '+' else 1, max(a, 0):b].sum()
+                                             for a, b, s in zip(start, end, strand)])
+    assert bio.CoverageIntervalQuery(covArr).query([], []).shape == (1, 0)
+    with pytest.raises(ValueError):
+        bio.CoverageIntervalQuery(covArr).query_annotation_df(make_random_annotation_df(10), stat='median')
+
+
+def make_shared_store_annotation_df():
+    annotDf = make_random_annotation_df(40)
+    annotDf['length'] = (annotDf['end'] - annotDf['start']).astype('Float64')
+    annotDf['n_reads'] = pd.array([None if i % 5 == 0 else i for i in range(40)], dtype='Int64')
+    annotDf['is_pseudo'] = np.arange(40) % 3 == 0
+    annotDf['name'] = [None if i % 7 == 0 else 'gène{}'.format(i) for i in range(40)]
+    return annotDf.reset_index(drop=True)
+
+
+def _shared_genome_store_task(args):
+    chromosome, start, end, col = args
+    store = bio.get_shared_genome_store()
+    return str(store.genome[chromosome][start:end]), list(store.get_annotation_array(col))
+
+
+def test_shared_genome_store_round_trip():
+    genome = {'chr1':''.join(np.random.default_rng(0).choice(list('ACGT'), 1003)) + 'NNNNA', 'chr2':'GATTACA'}
+    annotDf = make_shared_store_annotation_df()
+
+    with bio.SharedGenomeStore(genome, annotDf) as store:
+        sharedAnnotDf = store.get_annotation_df()
+        attachedStore = bio.SharedGenomeStore.attach(store.spec)
+        for seqStore in [store, attachedStore]:
+            assert {chromosome:str(seq) for chromosome, seq in seqStore.genome.items()} == genome
+    assert store.annotation_columns == annotDf.columns.tolist()
+    pd.testing.assert_frame_equal(sharedAnnotDf, annotDf, check_dtype=False, check_index_type=False)
+    for col in ['start', 'length', 'n_reads', 'is_pseudo']:
+        assert sharedAnnotDf[col].dtype == annotDf[col].dtype
+    assert [value for value in store.get_annotation_array('name') if pd.isnull(value)] == [None]*6
+
+    # The views remain valid after the store is closed, and are read-only
+    assert str(store.genome['chr1'][1000:1008]) == genome['chr1'][1000:1008]
+    pd.testing.assert_frame_equal(attachedStore.get_annotation_df(), sharedAnnotDf)
+    with pytest.raises(ValueError):
+        attachedStore.get_annotation_array('start')[0] = 1.
+    attachedStore.close()
+
+
+def test_shared_genome_store_in_process_pool():
+    genome = {'chr1':''.join(np.random.default_rng(0).choice(list('ACGTN'), 5000))}
+    annotDf = make_shared_store_annotation_df()
+    taskList = [('chr1', start, start + 100, col)
+                for start, col in zip(range(0, 4000, 500), ['start', 'n_reads', 'name', 'is_pseudo']*2)]
+
+    with bio.SharedGenomeStore(genome, annotDf) as store:
+        with ProcessPoolExecutor(max_workers=2, initializer=bio.init_shared_genome_store_worker,
+                                 initargs=(store.spec,)) as executor:
+            resultList = list(executor.map(_shared_genome_store_task, taskList))
+    for (chromosome, start, end, col), (seq, valueList) in zip(taskList, resultList):
+        assert seq == genome[chromosome][start:end]
+        pd.testing.assert_series_equal(pd.Series(valueList, dtype=annotDf[col].dtype), annotDf[col],
+                                       check_names=False)
+
+
+def test_shared_genome_store_empty():
+    with bio.SharedGenomeStore() as store:
+        assert len(store.genome) == 0
+        assert store.annotation_columns == []
+    with bio.SharedGenomeStore({'chr1':''}, make_shared_store_annotation_df().iloc[:0]) as store:
+        assert str(store.genome['chr1']) == ''
+        assert len(store.get_annotation_df()) == 0
+
+
+def make_dna_seq_with_N(length=1000, seed=0):
+    """Random sequence with runs of N, IUPAC codes, lower case and U letters."""
+    rng = np.random.default_rng(seed)
+    seq = rng.choice(list('ACGT'), length)
+    for start in rng.integers(0, length, 10):
+        seq[start:start + rng.integers(1, 10)] = 'N'
+    seq[rng.integers(0, length, 5)] = 'R'
+    seq[0], seq[-1] = 'N', 'N'
+    seq[200:300] = [letter.lower() for letter in seq[200:300]]
+    seq[np.flatnonzero(seq == 'T')[:5]] = 'U'
+    return ''.join(seq)
+
+
+def get_packed_string(seq):
+    """String as stored by PackedSequence: upper case, U as T, and other letters as N."""
+    return re.sub('[^ACGT]', 'N', seq.upper().replace('U', 'T'))
+
+
+def test_packed_sequence_as_string():
+    seq = make_dna_seq_with_N()
+    expectedSeq = get_packed_string(seq)
+    packedSeq = bio.PackedSequence(seq)
+    assert str(packedSeq) == expectedSeq
+    assert len(packedSeq) == len(seq)
+    assert str(bio.PackedSequence(Seq(seq))) == expectedSeq
+    assert str(bio.PackedSequence(bio.encode_dna_seq(seq))) == expectedSeq
+
+    rng = np.random.default_rng(1)
+    for i in range(200):
+        start, end = sorted(rng.integers(-20, len(seq) + 20, 2))
+        subSeq = packedSeq[start:end]
+        assert str(subSeq) == expectedSeq[start:end]
+        expectedRC = str(Seq(expectedSeq[start:end]).reverse_complement())
+        assert str(subSeq.reverse_complement()) == expectedRC
+        # Slices of reverse complement views
+        a, b = sorted(rng.integers(0, len(expectedRC) + 1, 2))
+        assert str(subSeq.reverse_complement()[a:b]) == expectedRC[a:b]
+        assert str(subSeq.reverse_complement().reverse_complement()) == expectedSeq[start:end]
+    assert packedSeq[5] == expectedSeq[5]
+    assert packedSeq[-1] == expectedSeq[-1]
+    assert packedSeq.reverse_complement()[0] == str(Seq(expectedSeq[-1]).reverse_complement())
+    assert packedSeq.nbytes < len(seq)
+    with pytest.raises(ValueError):
+        packedSeq[::2]
+
+
+def test_packed_sequence_index_arrays():
+    seq = get_packed_string(make_dna_seq_with_N(300))
+    packedSeq = bio.PackedSequence(seq)[7:290].reverse_complement()
+    seq = str(Seq(seq[7:290]).reverse_complement())
+    baseDict = {base:i for i, base in enumerate('ACGT')}
+
+    def get_kmer_index(kmer):
+        return 4**len(kmer) if 'N' in kmer else int(''.join(str(baseDict[base]) for base in kmer), 4)
+
+    np.testing.assert_array_equal(packedSeq.codes(), [baseDict.get(base, 4) for base in seq])
+    for k in [1, 3, 5]:
+        np.testing.assert_array_equal(packedSeq.kmer_index_array(k),
+                                      [get_kmer_index(seq[i:i + k]) for i in range(len(seq) - k + 1)])
+    np.testing.assert_array_equal(packedSeq.triplet_index_array(), packedSeq.kmer_index_array(3))
+    for frame in range(3):
+        np.testing.assert_array_equal(packedSeq.codon_index_array(frame),
+                                      [get_kmer_index(seq[i:i + 3]) for i in range(frame, len(seq) - 2, 3)])
+        assert [bio.codonList64[i] for i in packedSeq.codon_index_array(frame) if i < 64] == \
+            [codon for codon in bio.extract_codons_list(seq, frame) if len(codon) == 3 and 'N' not in codon]
+    assert len(bio.PackedSequence('')) == 0
+    assert str(bio.PackedSequence('')) == ''
+    assert len(bio.PackedSequence('AC').kmer_index_array(3)) == 0
+
+
+def test_extract_dna_seq_batch_as_extract_dna_seq(tmp_path):
+    recordList = [make_genbank_record('NC_1.1'), make_genbank_record('NC_2.1', seed=1)]
+    recordDict = {record.id:record for record in recordList}
+    annotDf = make_random_annotation_df(100, length=2500).dropna()
+    annotDf['chromosome'] = np.where(np.arange(len(annotDf)) % 2 == 0, 'NC_1.1', 'NC_2.1')
+    expectedS = pd.Series([str(bio.extract_dna_seq(annot, recordDict[annot['chromosome']]))
+                           for _, annot in annotDf.iterrows()], index=annotDf.index, dtype=object)
+
+    with open(str(tmp_path / 'genome.fasta'), 'w') as f:
+        SeqIO.write(recordList, f, 'fasta')
+    packedGenome = bio.PackedGenome.from_file(tmp_path / 'genome.fasta')
+    for genome in [recordDict, {chromosome:str(record.seq) for chromosome, record in recordDict.items()}, packedGenome]:
+        pd.testing.assert_series_equal(bio.extract_dna_seq_batch(annotDf, genome), expectedS)
+    viewS = bio.extract_dna_seq_batch(annotDf, packedGenome, asString=False)
+    assert all(isinstance(seq, bio.PackedSequence) for seq in viewS)
+    assert viewS.map(str).tolist() == expectedS.tolist()
+    assert [str(packedGenome.extract(*location)) for location in
+            zip(annotDf['chromosome'], annotDf['start'].astype(int), annotDf['end'].astype(int), annotDf['strand'])] == \
+        expectedS.tolist()
+
+    # Single sequence
+    chr1Df = annotDf[annotDf['chromosome'] == 'NC_1.1']
+    pd.testing.assert_series_equal(bio.extract_dna_seq_batch(chr1Df, packedGenome['NC_1.1']), expectedS[chr1Df.index])
+    assert len(bio.extract_dna_seq_batch(annotDf.iloc[:0], packedGenome)) == 0
+
+
+def write_random_BED_coverage_files(path, basename, length, seed=0, firstPosition=1):
+    """Plus and minus strand BED coverage files, with gaps and a different extent on each strand."""
+    rng = np.random.default_rng(seed)
+    for suffix, n in [('.strandp_coverage.bed', length), ('.strandm_coverage.bed', length - 10)]:
+        position = np.sort(rng.choice(np.arange(firstPosition, firstPosition + n), n // 2, replace=False))
+        position[0] = firstPosition
+        write_BED_coverage_file(path / (basename + suffix), position, rng.integers(0, 1000, n // 2))
+
+
+@pytest.mark.parametrize('firstPosition', [0, 1])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_load_BED_coverage_arrays_as_convert_BED_coverage_dataframe(tmp_path, firstPosition, dtype):
+    write_random_BED_coverage_files(tmp_path, 's', 500, firstPosition=firstPosition)
+    covDf = bio.convert_BED_coverage_dataframe(path=tmp_path, basename='s', verbose=0)
+    expectedArr = np.zeros((2, covDf['position'].max() + 1))
+    expectedArr[0, covDf['position']] = covDf['coverage_p']
+    expectedArr[1, covDf['position']] = covDf['coverage_m']
+
+    for cache in [False, True, True]:
+        covArr = bio.load_BED_coverage_arrays(path=tmp_path, basename='s', dtype=dtype, cache=cache, verbose=0)
+        assert covArr.dtype == dtype
+        np.testing.assert_array_equal(covArr, expectedArr)
+    assert isinstance(covArr, np.memmap)
+    assert len([filename for filename in os.listdir(str(tmp_path)) if filename.endswith('.npy')]) == 1
+
+    # The cache is not used once a BED file is more recent
+    write_BED_coverage_file(tmp_path / 's.strandm_coverage.bed', [firstPosition], [7])
+    os.utime(tmp_path / 's.strandm_coverage.bed', (os.path.getmtime(tmp_path / 's.strandp_coverage.bed') + 10,)*2)
+    covArr = bio.load_BED_coverage_arrays(path=tmp_path, basename='s', dtype=dtype, mmap_mode=None, verbose=0)
+    np.testing.assert_array_equal(covArr[0], expectedArr[0])
+    assert covArr[1].sum() == 7
+
+
+@pytest.mark.parametrize('nJobs, cacheSamples', [(1, False), (2, False), (2, True)])
+def test_import_roesti_coverage_store_as_import_roesti_coverage_df(tmp_path, capsys, nJobs, cacheSamples):
+    bedFolder = tmp_path / 'bed'
+    bedFolder.mkdir()
+    for i, length in enumerate([400, 500, 450]):
+        write_random_BED_coverage_files(bedFolder, 'S{}'.format(i), length, seed=i)
+    sampleDf = pd.DataFrame({'sample':['a', 'a', 'b'], 'replicate':[1, 2, 1], 'path':str(bedFolder),
+                             'sample_filename_prefix':['S0', 'S1', 'S2']})
+    expectedDf = bio.import_roesti_coverage_df(sampleDf)
+    capsys.readouterr()
+
+    store = bio.import_roesti_coverage_store(sampleDf, tmp_path / 'store', nJobs=nJobs, cacheSamples=cacheSamples,
+                                             verbose=0)
+    assert len(store) == 3
+    assert store.coverage.shape == (3, 2, expectedDf.index.get_level_values('position').max() + 1)
+    storeDf = store.to_dataframe()
+    pd.testing.assert_frame_equal(storeDf.loc[expectedDf.index], expectedDf.fillna(0), check_dtype=False,
+                                  check_column_type=False, check_index_type=False)
+    assert (storeDf.drop(expectedDf.index) == 0).all().all()
+    for i, (sample, replicate) in enumerate(zip(sampleDf['sample'], sampleDf['replicate'])):
+        covArr = bio.load_BED_coverage_arrays(bedFolder, 'S{}'.format(i), cache=False, verbose=0)
+        np.testing.assert_array_equal(store.get_sample_coverage(sample, replicate)[:, :covArr.shape[1]], covArr)
+        assert (store.get_sample_coverage(sample, replicate)[:, covArr.shape[1]:] == 0).all()
+    assert len([filename for filename in os.listdir(str(bedFolder)) if filename.endswith('.npy')]) == \
+        (3 if cacheSamples else 0)
+    assert sorted(os.listdir(str(tmp_path))) == ['bed', 'store.npy', 'store.samples.csv']
+
+
+def write_random_expression_files(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        start = rng.integers(0, 800000, 30)
+        pd.DataFrame({'ref':'NC_000001.1', 'id':['g{}'.format(j) for j in range(30)],
+                      'strand':rng.choice(['+', '-'], 30), 'start_cds':start, 'end_cds':start + 300,
+                      'tpm':rng.random(30)*100, 'n_reads':rng.integers(0, 1000, 30)},
+                     index=pd.Index(np.arange(30), name='row')).to_csv(str(path / 'S{}.CDS_values.csv'.format(i)))
+
+
+def test_import_roesti_expression_df_cached_as_import_roesti_expression_df(tmp_path, capsys):
+    write_random_expression_files(tmp_path, 3)
+    sampleDf = pd.DataFrame({'sample':['a', 'a', 'b'], 'replicate':[1, 2, 1], 'path':str(tmp_path),
+                             'sample_filename_prefix':['S0', 'S1', 'S2']})
+    expectedDf = bio.import_roesti_expression_df(sampleDf, verbose=0)
+    cacheFilepath = tmp_path / 'cache.parquet'
+
+    for i in range(2):
+        rnaDf = bio.import_roesti_expression_df_cached(sampleDf, cacheFilepath=cacheFilepath, nThreads=2)
+        assert ('Loading expression table from cache' in capsys.readouterr().out) == (i == 1)
+        assert rnaDf.columns.tolist() == expectedDf.columns.tolist()
+        for col in ['sample', 'ref', 'id', 'strand']:
+            assert isinstance(rnaDf[col].dtype, pd.CategoricalDtype)
+        assert rnaDf['tpm'].dtype == np.float32
+        pd.testing.assert_frame_equal(rnaDf.astype({col:object for col in ['sample', 'ref', 'id', 'strand']}),
+                                      expectedDf, check_dtype=False, rtol=1e-6)
+
+    # The cache is not used for other sample labels, or once a source file is more recent
+    sampleDf.loc[2, 'sample'] = 'c'
+    rnaDf = bio.import_roesti_expression_df_cached(sampleDf, cacheFilepath=cacheFilepath)
+    assert 'from cache' not in capsys.readouterr().out
+    assert rnaDf['sample'].tolist() == ['a']*60 + ['c']*30
+    os.utime(tmp_path / 'S0.CDS_values.csv', (os.path.getmtime(str(cacheFilepath)) + 10,)*2)
+    bio.import_roesti_expression_df_cached(sampleDf, cacheFilepath=cacheFilepath)
+    assert 'from cache' not in capsys.readouterr().out
+    bio.import_roesti_expression_df_cached(sampleDf, cacheFilepath=cacheFilepath)
+    assert 'from cache' in capsys.readouterr().out
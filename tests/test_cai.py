@@ -0,0 +1,232 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from Bio.Data import CodonTable
+
+from mwTools import cai
+from mwTools.stats import jensen_shannon_div
+
+
+def make_aa_codon_dict(tableId=11):
+    codonTable = CodonTable.unambiguous_dna_by_id[tableId]
+    aaCodonDict = {}
+    for codon, aa in codonTable.forward_table.items():
+        aaCodonDict.setdefault(aa, []).append(codon)
+    aaCodonDict['*'] = codonTable.stop_codons
+    return aaCodonDict
+
+
+def make_seq_series(n, seed=0, prefix='g'):
+    """Random coding sequences with biased codon usage, some of them short or of length not multiple of 3."""
+    rng = np.random.default_rng(seed)
+    codonList = [codon for codon in cai.codonList64 if codon not in ['TAA', 'TAG', 'TGA']]
+    seqList = []
+    for i in range(n):
+        p = rng.dirichlet(np.full(len(codonList), 0.5))
+        seqList.append('ATG' + ''.join(rng.choice(codonList, int(rng.integers(2, 200)), p=p)) + 'TAA')
+    seqList[1] = 'ATGGCTTAA'
+    seqList[2] = seqList[2] + 'A'
+    seqList[3] = seqList[3][:30] + 'N' + seqList[3][31:]
+    return pd.Series(seqList, index=['{}{}'.format(prefix, i) for i in range(n)])
+
+
+def reference_codon_usage(seqList, aaCodonDict, correctWijZeroCounts=0.01, checkLengthMultipleOf3=True):
+    """Codon usage of the previous implementation, counting the codons of each sequence with a Counter."""
+    codonCount = Counter(seq[3*i:3*i + 3] for seq in seqList if len(seq) % 3 == 0 or not checkLengthMultipleOf3
+                         for i in range(len(seq) // 3))
+    nCodons = sum(codonCount.values())
+    fijDict, wijDict = {}, {}
+    for aa, synCodonList in aaCodonDict.items():
+        nSynCodons = sum(codonCount[codon] for codon in synCodonList)
+        fijDict[aa] = {codon:codonCount[codon]/nSynCodons for codon in synCodonList} if nSynCodons > 0 else None
+        wijDict[aa] = None
+        if fijDict[aa] is not None:
+            wijDict[aa] = {codon:f/max(fijDict[aa].values()) for codon, f in fijDict[aa].items()}
+            wijDict[aa] = {codon:(w if w > 0 else correctWijZeroCounts) for codon, w in wijDict[aa].items()}
+    return {'codonCount':codonCount, 'codonFreq':{codon:count/nCodons for codon, count in codonCount.items()},
+            'fij':fijDict, 'wij':wijDict}
+
+
+def assert_codon_dict_almost_equal(codonDict, expectedCodonDict):
+    assert codonDict.keys() == expectedCodonDict.keys()
+    for aa, valueDict in expectedCodonDict.items():
+        if valueDict is None:
+            assert codonDict[aa] is None
+        else:
+            assert codonDict[aa] == pytest.approx(valueDict, rel=1e-12)
+
+
+@pytest.mark.parametrize('checkLengthMultipleOf3', [True, False])
+def test_compute_codon_usage(checkLengthMultipleOf3):
+    seqS = make_seq_series(20)
+    aaCodonDict = make_aa_codon_dict()
+    codonUsage = cai.compute_codon_usage(seqS, aaCodonDict, checkLengthMultipleOf3=checkLengthMultipleOf3)
+    expected = reference_codon_usage(seqS.tolist(), aaCodonDict, checkLengthMultipleOf3=checkLengthMultipleOf3)
+
+    # The previous implementation also counted the codons with N
+    assert codonUsage['codonCount'] == Counter({codon:count for codon, count in expected['codonCount'].items()
+                                                if 'N' not in codon})
+    assert {codon:freq for codon, freq in codonUsage['codonFreq'].items()} == \
+        pytest.approx({codon:freq for codon, freq in expected['codonFreq'].items() if 'N' not in codon}, rel=1e-12)
+    assert_codon_dict_almost_equal(codonUsage['fij'], expected['fij'])
+    assert_codon_dict_almost_equal(codonUsage['wij'], expected['wij'])
+    assert set(codonUsage.keys()) == {'codonFreq', 'synCodonCount', 'fij', 'wij', 'codonDatabase', 'codonCount'}
+
+
+def test_compute_codon_count_matrix():
+    seqList = make_seq_series(10).tolist() + ['', 'AT']
+    countMatrix = cai.compute_codon_count_matrix(seqList, checkLengthMultipleOf3=False, includeInvalid=True)
+    assert countMatrix.shape == (len(seqList), 65)
+    for seq, countArr in zip(seqList, countMatrix):
+        codonCount = Counter(seq[3*i:3*i + 3] for i in range(len(seq) // 3))
+        assert countArr[:64].tolist() == [codonCount[codon] for codon in cai.codonList64]
+        assert countArr[64] == sum(count for codon, count in codonCount.items() if codon not in cai.codonList64)
+
+    assert cai.compute_codon_count_matrix([]).shape == (0, 64)
+    # Sequences of length not multiple of 3 are skipped
+    assert cai.compute_codon_count_matrix(['ATGA']).tolist() == [[0]*64]
+
+
+def test_compute_codon_usage_empty():
+    codonUsage = cai.compute_codon_usage([], make_aa_codon_dict())
+    assert codonUsage['codonCount'] == Counter()
+    assert all(fij is None for fij in codonUsage['fij'].values())
+
+
+def reference_CAI(seq, wijRef, aaList, aaCodonDict):
+    """CAI of one sequence in the previous implementation."""
+    fij = reference_codon_usage([seq], aaCodonDict)['fij']
+    sum1, sum2 = 0, 0
+    for aa in aaList:
+        for codon, wij in wijRef[aa].items():
+            if fij[aa] is not None and wij > 0:
+                sum1 += fij[aa][codon]*np.log(wij)
+                sum2 += fij[aa][codon]
+    return np.exp(sum1/sum2) if sum2 != 0 else 0.0
+
+
+def reference_metric(seq, fijRef, aaCodonDict):
+    """Family-weighted Jensen-Shannon metric of one sequence in the previous implementation."""
+    fij = reference_codon_usage([seq], aaCodonDict)['fij']
+    metric = 0.0
+    for aa, f in fij.items():
+        if f is None or fijRef[aa] is None:
+            metric += 0.5
+        else:
+            fVector = [f[codon] for codon in aaCodonDict[aa]]
+            # (0*log(0) terms are dropped as NaN by jensen_shannon_div)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                JSD = jensen_shannon_div(fVector, [fijRef[aa][codon] for codon in aaCodonDict[aa]])
+            metric += sum(fVector)*JSD
+    return metric
+
+
+def make_CAI_aa_codon_dict():
+    """Codon families as used by compute_CAI: 6-codon families split, stop codons excluded."""
+    aaCodonDict = cai.split_6_codons_synonymous_families(make_aa_codon_dict())
+    return {aa:codonList for aa, codonList in aaCodonDict.items() if aa != '*'}
+
+
+def test_compute_CAI_batch_and_metric_batch():
+    seqS = make_seq_series(30)
+    seqS = seqS[seqS.str.len() % 3 == 0]
+    aaCodonDict = make_CAI_aa_codon_dict()
+    refUsage = reference_codon_usage(make_seq_series(10, seed=1, prefix='r').tolist()[4:], aaCodonDict)
+    aaList = [aa for aa, codonList in aaCodonDict.items() if len(codonList) > 1 and refUsage['fij'][aa] is not None]
+    countMatrix = cai.compute_codon_count_matrix(seqS.tolist())
+
+    CAIArr = cai.compute_CAI_batch(countMatrix, cai.convert_codon_dict_to_array(refUsage['wij']), aaCodonDict, aaList)
+    metricArr = cai.compute_metric_batch(countMatrix, cai.convert_codon_dict_to_array(refUsage['fij']), aaCodonDict)
+
+    np.testing.assert_allclose(CAIArr, [reference_CAI(seq, refUsage['wij'], aaList, aaCodonDict) for seq in seqS],
+                               rtol=1e-12)
+    np.testing.assert_allclose(metricArr, [reference_metric(seq, refUsage['fij'], aaCodonDict) for seq in seqS],
+                               rtol=1e-12)
+    # Sequences without any codon
+    emptyMatrix = np.zeros((1, 64), dtype=np.int64)
+    assert cai.compute_CAI_batch(emptyMatrix, cai.convert_codon_dict_to_array(refUsage['wij']),
+                                 aaCodonDict, aaList).tolist() == [0.0]
+    assert cai.compute_metric_batch(emptyMatrix, cai.convert_codon_dict_to_array(refUsage['fij']),
+                                    aaCodonDict).tolist() == [0.5*len(aaCodonDict)]
+
+
+@pytest.mark.parametrize('method', ['all_query_vs_avg_ref', 'avg_query_vs_avg_ref', 'all_query_vs_all_ref'])
+def test_compute_CAI(method):
+    querySeqS = make_seq_series(20)
+    refSeqS = make_seq_series(8, seed=1, prefix='r')
+    aaCodonDict = make_CAI_aa_codon_dict()
+    validQuerySeqS = querySeqS[querySeqS.str.len() % 3 == 0]
+    validRefSeqS = refSeqS[refSeqS.str.len() % 3 == 0]
+
+    caiDf = cai.compute_CAI(querySeqS, refSeqS, make_aa_codon_dict(), method=method, verbose=0)
+
+    if method == 'all_query_vs_all_ref':
+        refItemList = [(refId, [seq]) for refId, seq in validRefSeqS.items()]
+    else:
+        refItemList = [('avg_ref_set', validRefSeqS.tolist())]
+    if method == 'avg_query_vs_avg_ref':
+        queryItemList = [(0, ''.join(validQuerySeqS))]
+    else:
+        queryItemList = list(validQuerySeqS.items())
+    expectedList = []
+    for refId, refSeqList in refItemList:
+        refUsage = reference_codon_usage(refSeqList, aaCodonDict)
+        aaList = [aa for aa, codonList in aaCodonDict.items()
+                  if len(codonList) > 1 and refUsage['fij'][aa] is not None]
+        for queryId, seq in queryItemList:
+            expectedList.append((queryId, refId, reference_CAI(seq, refUsage['wij'], aaList, aaCodonDict),
+                                 reference_metric(seq, refUsage['fij'], aaCodonDict)))
+
+    assert caiDf.index.tolist() == [queryId for queryId, refId, CAI, metric in expectedList]
+    if method != 'avg_query_vs_avg_ref':
+        assert caiDf['ref_index'].tolist() == [refId for queryId, refId, CAI, metric in expectedList]
+    np.testing.assert_allclose(caiDf['CAI'], [CAI for queryId, refId, CAI, metric in expectedList], rtol=1e-12)
+    np.testing.assert_allclose(caiDf['metric'], [metric for queryId, refId, CAI, metric in expectedList], rtol=1e-12)
+
+
+def get_pairwise_reference(seqS, aaCodonDict):
+    """Metric of each query j against each query i > j as reference."""
+    fijList = [reference_codon_usage([seq], aaCodonDict)['fij'] for seq in seqS]
+    return {(seqS.index[j], seqS.index[i]):reference_metric(seqS.iloc[j], fijList[i], aaCodonDict)
+            for i in range(len(seqS)) for j in range(i)}
+
+
+@pytest.mark.parametrize('blockSize', [3, 256])
+def test_compute_CAI_all_query_vs_all_query(blockSize, tmp_path):
+    querySeqS = make_seq_series(12)
+    validQuerySeqS = querySeqS[querySeqS.str.len() % 3 == 0]
+    expectedDict = get_pairwise_reference(validQuerySeqS, make_CAI_aa_codon_dict())
+
+    caiDf = cai.compute_CAI(querySeqS, None, make_aa_codon_dict(), method='all_query_vs_all_query',
+                            blockSize=blockSize, verbose=0)
+    assert caiDf.index.name == 'query_index'
+    assert list(zip(caiDf.index, caiDf['ref_index'])) == list(expectedDict.keys())
+    np.testing.assert_allclose(caiDf['metric'], list(expectedDict.values()), rtol=1e-12)
+
+    metricArr, queryIndex = cai.compute_CAI(querySeqS, None, make_aa_codon_dict(), method='all_query_vs_all_query',
+                                            blockSize=blockSize, pairwiseMetricFilepath=tmp_path / 'metric.npy',
+                                            returnCondensedMetric=True, verbose=0)
+    assert isinstance(metricArr, np.memmap)
+    assert queryIndex.tolist() == validQuerySeqS.index.tolist()
+    np.testing.assert_allclose(metricArr, list(expectedDict.values()), rtol=1e-12)
+    np.testing.assert_array_equal(np.load(str(tmp_path / 'metric.npy')), metricArr)
+
+
+def test_compute_pairwise_metric_small():
+    aaCodonDict = make_CAI_aa_codon_dict()
+    for nSeqs in [0, 1, 2]:
+        countMatrix = cai.compute_codon_count_matrix(make_seq_series(5).tolist()[:nSeqs])
+        assert len(cai.compute_pairwise_metric(countMatrix, aaCodonDict, verbose=0)) == nSeqs*(nSeqs - 1)//2
+    assert cai._pairwiseMetricWorkerState == {}
+
+
+@pytest.mark.parametrize('method', ['all_query_vs_all_ref', 'all_query_vs_all_query'])
+def test_compute_CAI_process_pool(method):
+    querySeqS = make_seq_series(20)
+    refSeqS = make_seq_series(8, seed=1, prefix='r') if method == 'all_query_vs_all_ref' else None
+    kwargs = {'method':method, 'blockSize':4, 'verbose':0}
+    caiDf = cai.compute_CAI(querySeqS, refSeqS, make_aa_codon_dict(), nJobs=1, **kwargs)
+    assert cai._CAIWorkerState == {}
+    pd.testing.assert_frame_equal(cai.compute_CAI(querySeqS, refSeqS, make_aa_codon_dict(), nJobs=2, **kwargs), caiDf)